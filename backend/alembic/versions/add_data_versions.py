@@ -0,0 +1,26 @@
+"""add timetables.version and schools.data_version
+
+Revision ID: add_data_versions
+Revises: add_substitute_changes
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_data_versions'
+down_revision: Union[str, None] = 'add_substitute_changes'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('timetables', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+    op.add_column('schools', sa.Column('data_version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade() -> None:
+    op.drop_column('schools', 'data_version')
+    op.drop_column('timetables', 'version')
@@ -0,0 +1,25 @@
+"""add days_per_week to school_settings
+
+Revision ID: add_days_per_week
+Revises: add_timetable_seed
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_days_per_week'
+down_revision: Union[str, None] = 'add_timetable_seed'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Number of school days per week, starting on Monday (existing schools keep Monday-Friday)
+    op.add_column('school_settings', sa.Column('days_per_week', sa.Integer(), nullable=False, server_default='5'))
+
+
+def downgrade() -> None:
+    op.drop_column('school_settings', 'days_per_week')
@@ -0,0 +1,25 @@
+"""add seed to timetables
+
+Revision ID: add_timetable_seed
+Revises: a33c0e17ef38
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_timetable_seed'
+down_revision: Union[str, None] = 'a33c0e17ef38'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Seed of the random generator used to build the timetable (allows replaying a run)
+    op.add_column('timetables', sa.Column('seed', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('timetables', 'seed')
@@ -0,0 +1,48 @@
+"""add substitute_changes (substitute timetables as overlays)
+
+Revision ID: add_substitute_changes
+Revises: add_days_per_week
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_substitute_changes'
+down_revision: Union[str, None] = 'add_days_per_week'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # New substitute timetables store only their changes; existing ones keep their copied entries
+    op.create_table('substitute_changes',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('timetable_id', sa.Integer(), nullable=False),
+    sa.Column('base_entry_id', sa.Integer(), nullable=True),
+    sa.Column('change_type', sa.Enum('MOVED', 'REASSIGNED', 'CANCELLED', 'ADDED', name='substitutechangetype'), nullable=False),
+    sa.Column('class_group_id', sa.Integer(), nullable=True),
+    sa.Column('subject_id', sa.Integer(), nullable=True),
+    sa.Column('teacher_id', sa.Integer(), nullable=True),
+    sa.Column('classroom_id', sa.Integer(), nullable=True),
+    sa.Column('day_of_week', sa.Integer(), nullable=True),
+    sa.Column('lesson_index', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['base_entry_id'], ['timetable_entries.id'], ),
+    sa.ForeignKeyConstraint(['class_group_id'], ['class_groups.id'], ),
+    sa.ForeignKeyConstraint(['classroom_id'], ['classrooms.id'], ),
+    sa.ForeignKeyConstraint(['subject_id'], ['subjects.id'], ),
+    sa.ForeignKeyConstraint(['teacher_id'], ['teachers.id'], ),
+    sa.ForeignKeyConstraint(['timetable_id'], ['timetables.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_substitute_changes_id'), 'substitute_changes', ['id'], unique=False)
+    op.create_index(op.f('ix_substitute_changes_timetable_id'), 'substitute_changes', ['timetable_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_substitute_changes_timetable_id'), table_name='substitute_changes')
+    op.drop_index(op.f('ix_substitute_changes_id'), table_name='substitute_changes')
+    op.drop_table('substitute_changes')
+    sa.Enum(name='substitutechangetype').drop(op.get_bind(), checkfirst=True)
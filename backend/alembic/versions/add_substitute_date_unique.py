@@ -0,0 +1,28 @@
+"""add unique substitute timetable per base timetable and date
+
+Revision ID: add_substitute_date_unique
+Revises: add_timetable_entry_indexes
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_substitute_date_unique'
+down_revision: Union[str, None] = 'add_timetable_entry_indexes'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Fails if a date already has two substitute timetables of the same base timetable; delete the older ones first
+    op.create_index(
+        'uq_timetables_substitute_date', 'timetables', ['base_timetable_id', 'substitute_for_date'],
+        unique=True, postgresql_where=sa.text('is_primary = 0')
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('uq_timetables_substitute_date', table_name='timetables')
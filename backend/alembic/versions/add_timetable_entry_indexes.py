@@ -0,0 +1,78 @@
+"""add composite indexes and double-booking constraints to timetable_entries
+
+Revision ID: add_timetable_entry_indexes
+Revises: add_data_versions
+Create Date: 2026-10-19 19:00:00.000000
+
+The unique indexes cannot be created while a timetable books a teacher, class or classroom
+twice in one slot. The upgrade checks for that first and aborts without changes, listing the
+offending (timetable_id, day_of_week, lesson_index) slots. Fix them before upgrading, either by
+regenerating or deleting the affected timetables, or by keeping one entry per slot, e.g. for
+teachers (likewise with class_group_id and classroom_id):
+
+    DELETE FROM timetable_entries e USING timetable_entries d
+    WHERE e.timetable_id = d.timetable_id AND e.teacher_id = d.teacher_id
+      AND e.day_of_week = d.day_of_week AND e.lesson_index = d.lesson_index AND e.id > d.id;
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_timetable_entry_indexes'
+down_revision: Union[str, None] = 'add_data_versions'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Resources that may be booked only once per slot of a timetable
+UNIQUE_SLOT_COLUMNS = {'teacher': 'teacher_id', 'class': 'class_group_id', 'classroom': 'classroom_id'}
+
+
+def _double_bookings() -> list:
+    """Slots of existing timetables that book a teacher, class or classroom more than once"""
+    bind = op.get_bind()
+    found = []
+    for name, column in UNIQUE_SLOT_COLUMNS.items():
+        rows = bind.execute(sa.text(
+            f"SELECT timetable_id, day_of_week, lesson_index, {column}, COUNT(*) FROM timetable_entries "
+            f"WHERE {column} IS NOT NULL "
+            f"GROUP BY timetable_id, day_of_week, lesson_index, {column} HAVING COUNT(*) > 1 "
+            f"ORDER BY timetable_id, day_of_week, lesson_index"
+        ))
+        found.extend(
+            f"timetable_id={timetable_id}, day_of_week={day}, lesson_index={lesson}: "
+            f"{name} {resource_id} booked {count} times"
+            for timetable_id, day, lesson, resource_id, count in rows
+        )
+    return found
+
+
+def upgrade() -> None:
+    double_bookings = _double_bookings()
+    if double_bookings:
+        raise RuntimeError(
+            "timetable_entries contains double bookings, fix them before upgrading "
+            "(see the docstring of this migration):\n  " + "\n  ".join(double_bookings)
+        )
+    
+    op.create_index('ix_timetable_entries_slot', 'timetable_entries', ['timetable_id', 'day_of_week', 'lesson_index'], unique=False)
+    op.create_index('ix_timetable_entries_teacher', 'timetable_entries', ['teacher_id', 'timetable_id', 'day_of_week'], unique=False)
+    op.create_index('ix_timetable_entries_class_group', 'timetable_entries', ['class_group_id', 'timetable_id'], unique=False)
+    op.create_index('ix_timetable_entries_subject_id', 'timetable_entries', ['subject_id'], unique=False)
+    op.create_index('uq_timetable_entries_teacher_slot', 'timetable_entries', ['timetable_id', 'teacher_id', 'day_of_week', 'lesson_index'], unique=True)
+    op.create_index('uq_timetable_entries_class_slot', 'timetable_entries', ['timetable_id', 'class_group_id', 'day_of_week', 'lesson_index'], unique=True)
+    op.create_index(
+        'uq_timetable_entries_classroom_slot', 'timetable_entries', ['timetable_id', 'classroom_id', 'day_of_week', 'lesson_index'],
+        unique=True, postgresql_where=sa.text('classroom_id IS NOT NULL')
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('uq_timetable_entries_classroom_slot', table_name='timetable_entries')
+    op.drop_index('uq_timetable_entries_class_slot', table_name='timetable_entries')
+    op.drop_index('uq_timetable_entries_teacher_slot', table_name='timetable_entries')
+    op.drop_index('ix_timetable_entries_subject_id', table_name='timetable_entries')
+    op.drop_index('ix_timetable_entries_class_group', table_name='timetable_entries')
+    op.drop_index('ix_timetable_entries_teacher', table_name='timetable_entries')
+    op.drop_index('ix_timetable_entries_slot', table_name='timetable_entries')
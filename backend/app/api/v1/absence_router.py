@@ -7,8 +7,10 @@ from app.core.database import get_db
 from app.core.dependencies import get_current_active_user, require_role
 from app.models.user import User, UserRole
 from app.models.absence import TeacherAbsence
-from app.schemas.absence import TeacherAbsenceCreate, TeacherAbsenceResponse
+from app.schemas.absence import TeacherAbsenceCreate, TeacherAbsenceUpdate, TeacherAbsenceResponse
 from app.repositories.absence_repository import TeacherAbsenceRepository
+from app.services.substitute_timetable_service import SubstituteTimetableService
+from app.services.substitute_scheduler import substitute_scheduler
 
 router = APIRouter()
 
@@ -42,6 +44,13 @@ async def create_absence(
     )
     created_absence = await repo.create(absence)
     
+    # Re-cover the teacher's lessons in substitute timetables that already exist
+    await SubstituteTimetableService(db).repair_substitute_timetables(
+        school_id, {created_absence.teacher_id}, created_absence.date_from, created_absence.date_to
+    )
+    # Dates without a substitute timetable yet are generated in the background
+    substitute_scheduler.notify(school_id)
+    
     # Reload with teacher relationship eagerly loaded
     result = await db.execute(
         select(TeacherAbsence)
@@ -101,6 +110,49 @@ async def get_absence(
     
     return absence
 
+@router.put("/schools/{school_id}/absences/{absence_id}", response_model=TeacherAbsenceResponse)
+async def update_absence(
+    school_id: int,
+    absence_id: int,
+    absence_data: TeacherAbsenceUpdate,
+    current_user: User = Depends(require_role([UserRole.ADMIN])),
+    db: AsyncSession = Depends(get_db)
+):
+    if current_user.school_id != school_id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    repo = TeacherAbsenceRepository(db)
+    absence = await repo.get_by_id(absence_id)
+    if not absence or absence.school_id != school_id:
+        raise HTTPException(status_code=404, detail="Absence not found")
+    
+    update_data = {k: v for k, v in absence_data.model_dump().items() if v is not None}
+    if "teacher_id" in update_data:
+        from app.repositories.teacher_repository import TeacherRepository
+        teacher = await TeacherRepository(db).get_by_id(update_data["teacher_id"])
+        if not teacher or teacher.school_id != school_id:
+            raise HTTPException(status_code=404, detail="Teacher not found")
+    if update_data.get("date_from", absence.date_from) > update_data.get("date_to", absence.date_to):
+        raise HTTPException(status_code=400, detail="date_from must not be after date_to")
+    
+    old_teacher_id, old_from, old_to = absence.teacher_id, absence.date_from, absence.date_to
+    absence = await repo.update(absence_id, **update_data)
+    await db.refresh(absence)
+    
+    # Repair substitute timetables of both the old and the new absence
+    await SubstituteTimetableService(db).repair_substitute_timetables(
+        school_id, {old_teacher_id, absence.teacher_id},
+        min(old_from, absence.date_from), max(old_to, absence.date_to)
+    )
+    substitute_scheduler.notify(school_id)
+    
+    result = await db.execute(
+        select(TeacherAbsence)
+        .options(selectinload(TeacherAbsence.teacher))
+        .where(TeacherAbsence.id == absence_id)
+    )
+    return result.scalar_one()
+
 @router.delete("/schools/{school_id}/absences/{absence_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_absence(
     school_id: int,
@@ -117,4 +169,8 @@ async def delete_absence(
         raise HTTPException(status_code=404, detail="Absence not found")
     
     await repo.delete(absence_id)
-
+    
+    # Give the lessons back to the teacher in substitute timetables that already exist
+    await SubstituteTimetableService(db).repair_substitute_timetables(
+        school_id, {absence.teacher_id}, absence.date_from, absence.date_to
+    )
@@ -115,15 +115,12 @@ async def delete_subject(
         await db.commit()
     
     # Check for timetable entries
-    from app.models.timetable import TimetableEntry
-    result = await db.execute(
-        select(TimetableEntry).where(TimetableEntry.subject_id == subject_id)
-    )
-    timetable_entries = result.scalars().all()
-    if timetable_entries:
+    from app.repositories.timetable_repository import TimetableEntryRepository
+    used = await TimetableEntryRepository(db).count_by_subject(subject_id)
+    if used:
         raise HTTPException(
             status_code=400,
-            detail=f"Cannot delete subject: it is used in {len(timetable_entries)} timetable entries. Please remove it from the timetable first."
+            detail=f"Cannot delete subject: it is used in {used} timetable entries. Please remove it from the timetable first."
         )
     
     # Now safe to delete the subject
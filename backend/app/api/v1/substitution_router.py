@@ -5,7 +5,7 @@ from app.core.database import get_db
 from app.core.dependencies import get_current_active_user, require_role
 from app.models.user import User, UserRole
 from app.models.absence import SubstitutionStatus
-from app.schemas.absence import SubstitutionResponse, SubstitutionUpdate
+from app.schemas.absence import SubstitutionResponse, SubstitutionUpdate, SubstitutionBulkCreate
 from app.services.substitution_service import SubstitutionService
 from app.repositories.absence_repository import SubstitutionRepository
 
@@ -28,6 +28,25 @@ async def generate_substitutions(
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@router.post("/schools/{school_id}/substitutions/generate-bulk", response_model=List[SubstitutionResponse])
+async def generate_substitutions_bulk(
+    school_id: int,
+    data: SubstitutionBulkCreate,
+    current_user: User = Depends(require_role([UserRole.ADMIN])),
+    db: AsyncSession = Depends(get_db)
+):
+    """Generate substitutions for several absences at once (listed or overlapping a date window)"""
+    if current_user.school_id != school_id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    substitution_service = SubstitutionService(db)
+    try:
+        return await substitution_service.generate_substitutions_bulk(
+            school_id, data.absence_ids, data.date_from, data.date_to
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.get("/schools/{school_id}/substitutions", response_model=List[SubstitutionResponse])
 async def list_substitutions(
     school_id: int,
@@ -156,15 +156,16 @@ async def get_teacher_timetable(
     
     entry_repo = TimetableEntryRepository(db)
     timetable_repo = TimetableRepository(db)
-    timetables = await timetable_repo.get_by_school_id(school_id)
+    teacher_entries = await entry_repo.get_by_teacher(school_id, teacher_id, day_of_week)
     
-    teacher_entries = []
-    for timetable in timetables:
-        entries = await entry_repo.get_by_timetable_id(timetable.id)
-        filtered_entries = [e for e in entries if e.teacher_id == teacher_id]
-        if day_of_week is not None:
-            filtered_entries = [e for e in filtered_entries if e.day_of_week == day_of_week]
-        teacher_entries.extend(filtered_entries)
+    # Substitute timetables stored as changes over their base timetable, only those with lessons of the teacher
+    for timetable_id in await timetable_repo.get_overlay_ids_by_teacher(school_id, teacher_id):
+        entries = await entry_repo.get_substitute_view(timetable_id)
+        teacher_entries.extend(
+            e for e in entries
+            if e.teacher_id == teacher_id and (day_of_week is None or e.day_of_week == day_of_week)
+        )
+    teacher_entries.sort(key=lambda e: e.timetable_id)
     
     return teacher_entries
 
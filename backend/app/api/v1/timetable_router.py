@@ -1,11 +1,12 @@
 from sqlalchemy import select
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.database import get_db
 from app.core.dependencies import get_current_active_user, require_role
 from app.models.user import User, UserRole
-from app.schemas.timetable import TimetableCreate, TimetableResponse, ValidationResponse, ValidationErrorResponse
-from app.repositories.timetable_repository import TimetableRepository
+from app.schemas.timetable import TimetableCreate, TimetableResponse, TimetableSummaryResponse, TimetablePage, ValidationResponse, ValidationErrorResponse, TimetableScoreResponse, TimetableEditCheck, TimetableEditCheckResponse
+from app.repositories.timetable_repository import TimetableRepository, TimetableEntryRepository
 from app.models.timetable import TimetableEntry, Timetable
 from pydantic import BaseModel
 from app.services.timetable_service import TimetableService
@@ -31,7 +32,8 @@ async def generate_timetable(
             school_id=school_id,
             name=timetable_data.name,
             valid_from=timetable_data.valid_from,
-            valid_to=timetable_data.valid_to
+            valid_to=timetable_data.valid_to,
+            seed=timetable_data.seed
         )
         
         if not timetable:
@@ -53,6 +55,7 @@ async def generate_timetable(
             "is_primary": full_timetable.is_primary,
             "substitute_for_date": full_timetable.substitute_for_date,
             "base_timetable_id": full_timetable.base_timetable_id,
+            "seed": full_timetable.seed,
             "entries": full_timetable.entries,
             "class_lunch_hours": lunch_hours
         }
@@ -78,39 +81,101 @@ async def validate_timetable(
         errors=[ValidationErrorResponse(type=e.type, message=e.message, entry_id=e.entry_id) for e in errors]
     )
 
-@router.get("/schools/{school_id}/timetables", response_model=list[TimetableResponse])
-async def list_timetables(
+@router.post("/schools/{school_id}/timetables/{timetable_id}/check-edit", response_model=TimetableEditCheckResponse)
+async def check_timetable_edit(
     school_id: int,
+    timetable_id: int,
+    edit: TimetableEditCheck,
     current_user: User = Depends(get_current_active_user),
     db: AsyncSession = Depends(get_db)
 ):
+    """Whether moving, swapping or deleting lessons would keep the timetable valid (nothing is saved)"""
     if current_user.school_id != school_id:
         raise HTTPException(status_code=403, detail="Access denied")
     
     repo = TimetableRepository(db)
-    timetables = await repo.get_by_school_id(school_id)
+    timetable = await repo.get_by_id(timetable_id)
+    if not timetable or timetable.school_id != school_id:
+        raise HTTPException(status_code=404, detail="Timetable not found")
     
-    # Add lunch hours for each timetable
-    timetable_service = TimetableService(db)
-    result = []
-    for timetable in timetables:
-        lunch_hours = await timetable_service.calculate_class_lunch_hours(school_id, timetable.id)
-        # Convert to dict response
-        timetable_dict = {
-            "id": timetable.id,
-            "school_id": timetable.school_id,
-            "name": timetable.name,
-            "valid_from": timetable.valid_from,
-            "valid_to": timetable.valid_to,
-            "is_primary": timetable.is_primary,
-            "substitute_for_date": timetable.substitute_for_date,
-            "base_timetable_id": timetable.base_timetable_id,
-            "entries": timetable.entries,
-            "class_lunch_hours": lunch_hours
-        }
-        result.append(TimetableResponse(**timetable_dict))
+    validator = await TimetableValidationService(db).get_incremental_validator(
+        timetable_id, {move.teacher_id for move in edit.moves if move.teacher_id is not None}
+    )
+    changes = {}
+    try:
+        for move in edit.moves:
+            overrides = {k: v for k, v in (("teacher_id", move.teacher_id), ("classroom_id", move.classroom_id)) if v is not None}
+            changes.update(validator.move(move.entry_id, move.day_of_week, move.lesson_index, **overrides))
+        for swap in edit.swaps:
+            changes.update(validator.swap(swap.entry_id, swap.other_entry_id))
+        for entry_id in edit.deletes:
+            if entry_id not in validator.lessons:
+                raise KeyError(entry_id)
+            changes.update(validator.delete(entry_id))
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Entry {e.args[0]} not found in timetable")
+    
+    delta = validator.delta(changes)
+    violations = validator.totals.copy()
+    violations.update(delta)
+    violations = {kind: count for kind, count in violations.items() if count}
+    return TimetableEditCheckResponse(is_valid=not violations, delta=delta, violations=violations)
+
+@router.get("/schools/{school_id}/timetables/{timetable_id}/score", response_model=TimetableScoreResponse)
+async def score_timetable(
+    school_id: int,
+    timetable_id: int,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    if current_user.school_id != school_id:
+        raise HTTPException(status_code=403, detail="Access denied")
     
-    return result
+    timetable = await TimetableRepository(db).get_by_id(timetable_id)
+    if not timetable or timetable.school_id != school_id:
+        raise HTTPException(status_code=404, detail="Timetable not found")
+    
+    try:
+        timetable_service = TimetableService(db)
+        return TimetableScoreResponse(**await timetable_service.score_timetable(school_id, timetable_id))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/schools/{school_id}/timetables", response_model=TimetablePage)
+async def list_timetables(
+    school_id: int,
+    after: Optional[int] = Query(None, description="Id of the last timetable of the previous page (next_cursor)"),
+    limit: int = Query(50, ge=1, le=200),
+    is_primary: Optional[int] = Query(None, description="1 = primary timetables only, 0 = substitute timetables only"),
+    date_from: Optional[date] = Query(None, description="Only timetables valid (or substitute timetables for a date) on or after this date"),
+    date_to: Optional[date] = Query(None, description="Only timetables valid (or substitute timetables for a date) on or before this date"),
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Timetables of a school without their entries, in pages of `limit` (fetch a single timetable for its lessons)"""
+    if current_user.school_id != school_id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    repo = TimetableRepository(db)
+    # One row more than requested tells whether there is a next page
+    rows = await repo.get_summaries(school_id, after, limit + 1, is_primary, date_from, date_to)
+    items = [
+        TimetableSummaryResponse(
+            id=timetable.id,
+            school_id=timetable.school_id,
+            name=timetable.name,
+            valid_from=timetable.valid_from,
+            valid_to=timetable.valid_to,
+            is_primary=timetable.is_primary,
+            substitute_for_date=timetable.substitute_for_date,
+            base_timetable_id=timetable.base_timetable_id,
+            seed=timetable.seed,
+            entry_count=entry_count
+        )
+        for timetable, entry_count in rows[:limit]
+    ]
+    next_cursor = items[-1].id if len(rows) > limit else None
+    return TimetablePage(items=items, next_cursor=next_cursor)
 
 @router.get("/schools/{school_id}/timetables/{timetable_id}", response_model=TimetableResponse)
 async def get_timetable(
@@ -132,6 +197,10 @@ async def get_timetable(
     # Calculate and add lunch hours
     timetable_service = TimetableService(db)
     lunch_hours = await timetable_service.calculate_class_lunch_hours(school_id, timetable_id)
+    # Substitute timetables are stored as changes over their base timetable
+    entries = timetable.entries or (
+        await TimetableEntryRepository(db).get_substitute_view(timetable.id) if timetable.is_primary == 0 else []
+    )
     timetable_dict = {
         "id": timetable.id,
         "school_id": timetable.school_id,
@@ -141,7 +210,8 @@ async def get_timetable(
         "is_primary": timetable.is_primary,
         "substitute_for_date": timetable.substitute_for_date,
         "base_timetable_id": timetable.base_timetable_id,
-        "entries": timetable.entries,
+        "seed": timetable.seed,
+        "entries": entries,
         "class_lunch_hours": lunch_hours
     }
     return TimetableResponse(**timetable_dict)
@@ -189,7 +259,7 @@ async def generate_substitute_timetable(
             raise HTTPException(status_code=404, detail="Substitute timetable not found after creation")
         
         # Get full timetable with entries and lunch hours
-        full_timetable, lunch_hours = await substitute_service.get_substitute_timetable_with_lunch_hours(
+        full_timetable, entries, lunch_hours = await substitute_service.get_substitute_timetable_with_lunch_hours(
             school_id, substitute_timetable.id
         )
         if not full_timetable:
@@ -204,10 +274,97 @@ async def generate_substitute_timetable(
             "is_primary": full_timetable.is_primary,
             "substitute_for_date": full_timetable.substitute_for_date,
             "base_timetable_id": full_timetable.base_timetable_id,
-            "entries": full_timetable.entries,
+            "seed": full_timetable.seed,
+            "entries": entries,
             "class_lunch_hours": lunch_hours
         }
         return TimetableResponse(**timetable_dict)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+
+@router.get("/schools/{school_id}/timetables/{base_timetable_id}/substitute/{substitute_date}", response_model=TimetableResponse)
+async def get_substitute_timetable(
+    school_id: int,
+    base_timetable_id: int,
+    substitute_date: date,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get the substitute timetable of a date if it was already generated (or precomputed)"""
+    if current_user.school_id != school_id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    substitute_timetable = await TimetableRepository(db).get_substitute_for_date(
+        school_id, base_timetable_id, substitute_date
+    )
+    if not substitute_timetable:
+        raise HTTPException(status_code=404, detail="Substitute timetable not found")
+    
+    full_timetable, entries, lunch_hours = await SubstituteTimetableService(db).get_substitute_timetable_with_lunch_hours(
+        school_id, substitute_timetable.id
+    )
+    timetable_dict = {
+        "id": full_timetable.id,
+        "school_id": full_timetable.school_id,
+        "name": full_timetable.name,
+        "valid_from": full_timetable.valid_from,
+        "valid_to": full_timetable.valid_to,
+        "is_primary": full_timetable.is_primary,
+        "substitute_for_date": full_timetable.substitute_for_date,
+        "base_timetable_id": full_timetable.base_timetable_id,
+        "seed": full_timetable.seed,
+        "entries": entries,
+        "class_lunch_hours": lunch_hours
+    }
+    return TimetableResponse(**timetable_dict)
+
+
+class SubstituteTimetableRangeCreate(BaseModel):
+    date_from: date
+    date_to: date
+
+@router.post("/schools/{school_id}/timetables/{base_timetable_id}/generate-substitute-range", response_model=list[TimetableResponse])
+async def generate_substitute_timetable_range(
+    school_id: int,
+    base_timetable_id: int,
+    data: SubstituteTimetableRangeCreate,
+    current_user: User = Depends(require_role([UserRole.ADMIN])),
+    db: AsyncSession = Depends(get_db)
+):
+    """Generate substitute timetables for every school day in a date range"""
+    if current_user.school_id != school_id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    substitute_service = SubstituteTimetableService(db)
+    try:
+        substitute_timetables = await substitute_service.generate_substitute_timetables(
+            school_id=school_id,
+            base_timetable_id=base_timetable_id,
+            date_from=data.date_from,
+            date_to=data.date_to
+        )
+        
+        responses = []
+        for substitute_timetable in substitute_timetables:
+            full_timetable, entries, lunch_hours = await substitute_service.get_substitute_timetable_with_lunch_hours(
+                school_id, substitute_timetable.id
+            )
+            if not full_timetable:
+                raise HTTPException(status_code=404, detail="Substitute timetable not found after creation")
+            responses.append(TimetableResponse(
+                id=full_timetable.id,
+                school_id=full_timetable.school_id,
+                name=full_timetable.name,
+                valid_from=full_timetable.valid_from,
+                valid_to=full_timetable.valid_to,
+                is_primary=full_timetable.is_primary,
+                substitute_for_date=full_timetable.substitute_for_date,
+                base_timetable_id=full_timetable.base_timetable_id,
+                seed=full_timetable.seed,
+                entries=entries,
+                class_lunch_hours=lunch_hours
+            ))
+        return responses
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import List, Optional
 import os
 
 class Settings(BaseSettings):
@@ -18,6 +18,14 @@ class Settings(BaseSettings):
     # CORS - accept comma-separated string from env, convert to list
     CORS_ORIGINS: str = "http://localhost:5173,http://localhost:3000"
     
+    # Solver - directory for placement decision traces of generation runs (disabled when unset)
+    SOLVER_TRACE_DIR: Optional[str] = None
+    
+    # Substitute timetables - precomputed for the next school days with absences (disabled when 0)
+    SUBSTITUTE_PRECOMPUTE_DAYS: int = 2
+    SUBSTITUTE_PRECOMPUTE_HOUR: int = 2  # Nightly run, local time
+    SUBSTITUTE_NOTIFY_DELAY: float = 30  # Seconds without absence changes before a school is processed
+    
     @property
     def cors_origins_list(self) -> List[str]:
         """Convert CORS_ORIGINS to a list"""
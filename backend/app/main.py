@@ -2,6 +2,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
 from app.api.v1 import api_router
+from app.services.substitute_scheduler import substitute_scheduler
 
 app = FastAPI(
     title="Rozvrhovac API",
@@ -20,6 +21,14 @@ app.add_middleware(
 
 app.include_router(api_router, prefix="/api/v1")
 
+@app.on_event("startup")
+async def start_substitute_scheduler():
+    substitute_scheduler.start()
+
+@app.on_event("shutdown")
+async def stop_substitute_scheduler():
+    await substitute_scheduler.stop()
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
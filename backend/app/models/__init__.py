@@ -5,8 +5,9 @@ from app.models.subject import Subject, ClassSubjectAllocation
 from app.models.teacher import Teacher, TeacherSubjectCapability
 from app.models.classroom import Classroom
 from app.models.user import User, UserRole
-from app.models.timetable import Timetable, TimetableEntry
+from app.models.timetable import Timetable, TimetableEntry, SubstituteChange, SubstituteChangeType
 from app.models.absence import TeacherAbsence, Substitution
+from app.models import versioning  # registers the version counter events
 
 __all__ = [
     "School",
@@ -22,6 +23,8 @@ __all__ = [
     "UserRole",
     "Timetable",
     "TimetableEntry",
+    "SubstituteChange",
+    "SubstituteChangeType",
     "TeacherAbsence",
     "Substitution",
 ]
@@ -8,6 +8,8 @@ class School(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
     code = Column(String, unique=True, nullable=False, index=True)
+    # Bumped whenever data that validation reads changes (see app.models.versioning)
+    data_version = Column(Integer, nullable=False, default=1, server_default="1")
     # settings_id removed - circular dependency. Use SchoolSettings.school_id instead
     
     settings = relationship("SchoolSettings", back_populates="school", uselist=False, foreign_keys="SchoolSettings.school_id")
@@ -31,6 +33,7 @@ class SchoolSettings(Base):
     break_durations = Column(JSON, nullable=True)  # e.g., [5, 20, 10, 10, 10] - break durations after each lesson (index 0 = after lesson 1)
     possible_lunch_hours = Column(JSON, nullable=True)  # e.g., [3, 4, 5]
     lunch_duration_minutes = Column(Integer, nullable=False, default=30)
+    days_per_week = Column(Integer, nullable=False, default=5, server_default="5")  # School days starting on Monday (5 = Monday-Friday)
     
     school = relationship("School", back_populates="settings", foreign_keys="SchoolSettings.school_id")
 
@@ -22,7 +22,7 @@ class Teacher(Base):
     
     school = relationship("School", back_populates="teachers")
     user = relationship("User", back_populates="teacher", uselist=False, foreign_keys="User.teacher_id")
-    capabilities = relationship("TeacherSubjectCapability", back_populates="teacher", cascade="all, delete-orphan")
+    capabilities = relationship("TeacherSubjectCapability", back_populates="teacher", cascade="all, delete-orphan", order_by="TeacherSubjectCapability.id")
     classrooms = relationship("Classroom", secondary=teacher_classroom_association, back_populates="teachers")
     timetable_entries = relationship("TimetableEntry", back_populates="teacher")
     absences = relationship("TeacherAbsence", back_populates="teacher", cascade="all, delete-orphan")
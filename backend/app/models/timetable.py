@@ -1,7 +1,14 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Date
+from sqlalchemy import Column, Integer, String, ForeignKey, Date, Enum, Index, text
 from sqlalchemy.orm import relationship
+import enum
 from app.core.database import Base
 
+class SubstituteChangeType(str, enum.Enum):
+    MOVED = "MOVED"  # Lesson takes place at another day/lesson index (teacher or classroom may change too)
+    REASSIGNED = "REASSIGNED"  # Same slot, other teacher or classroom
+    CANCELLED = "CANCELLED"  # Lesson does not take place
+    ADDED = "ADDED"  # Lesson without a base entry
+
 class Timetable(Base):
     __tablename__ = "timetables"
     
@@ -13,10 +20,22 @@ class Timetable(Base):
     is_primary = Column(Integer, nullable=False, default=1)  # 1 = primary timetable, 0 = substitute timetable
     substitute_for_date = Column(Date, nullable=True)  # For substitute timetables: the date this applies to
     base_timetable_id = Column(Integer, ForeignKey("timetables.id"), nullable=True)  # For substitute timetables: reference to primary timetable
+    seed = Column(Integer, nullable=True)  # Seed of the generator run that produced this timetable (for exact replay)
+    version = Column(Integer, nullable=False, default=1, server_default="1")  # Bumped whenever its lessons change (see app.models.versioning)
     
     school = relationship("School", back_populates="timetables")
-    entries = relationship("TimetableEntry", back_populates="timetable", cascade="all, delete-orphan", foreign_keys="TimetableEntry.timetable_id")
+    entries = relationship("TimetableEntry", back_populates="timetable", cascade="all, delete-orphan", foreign_keys="TimetableEntry.timetable_id", order_by="TimetableEntry.id")
     base_timetable = relationship("Timetable", remote_side=[id], foreign_keys=[base_timetable_id])
+    # Substitute timetables store only their changes over the base timetable's day
+    changes = relationship("SubstituteChange", back_populates="timetable", cascade="all, delete-orphan", order_by="SubstituteChange.id")
+    
+    __table_args__ = (
+        # One substitute timetable per base timetable and date, also when generated concurrently
+        Index(
+            "uq_timetables_substitute_date", "base_timetable_id", "substitute_for_date", unique=True,
+            postgresql_where=text("is_primary = 0"), sqlite_where=text("is_primary = 0")
+        ),
+    )
 
 class TimetableEntry(Base):
     __tablename__ = "timetable_entries"
@@ -36,4 +55,38 @@ class TimetableEntry(Base):
     teacher = relationship("Teacher", back_populates="timetable_entries")
     classroom = relationship("Classroom", back_populates="timetable_entries")
     substitutions = relationship("Substitution", back_populates="timetable_entry", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        # Slot lookups within a timetable, lessons of a teacher / class, usage of a subject
+        Index("ix_timetable_entries_slot", "timetable_id", "day_of_week", "lesson_index"),
+        Index("ix_timetable_entries_teacher", "teacher_id", "timetable_id", "day_of_week"),
+        Index("ix_timetable_entries_class_group", "class_group_id", "timetable_id"),
+        Index("ix_timetable_entries_subject_id", "subject_id"),
+        # No teacher, class or classroom has two lessons at the same time in a timetable
+        Index("uq_timetable_entries_teacher_slot", "timetable_id", "teacher_id", "day_of_week", "lesson_index", unique=True),
+        Index("uq_timetable_entries_class_slot", "timetable_id", "class_group_id", "day_of_week", "lesson_index", unique=True),
+        Index(
+            "uq_timetable_entries_classroom_slot", "timetable_id", "classroom_id", "day_of_week", "lesson_index", unique=True,
+            postgresql_where=text("classroom_id IS NOT NULL"), sqlite_where=text("classroom_id IS NOT NULL")
+        ),
+    )
+
 
+class SubstituteChange(Base):
+    """One change of a substitute timetable relative to its base timetable"""
+    __tablename__ = "substitute_changes"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    timetable_id = Column(Integer, ForeignKey("timetables.id"), nullable=False, index=True)  # The substitute timetable
+    base_entry_id = Column(Integer, ForeignKey("timetable_entries.id"), nullable=True)  # Changed lesson (None for ADDED)
+    change_type = Column(Enum(SubstituteChangeType), nullable=False)
+    # The lesson after the change (unset for CANCELLED)
+    class_group_id = Column(Integer, ForeignKey("class_groups.id"), nullable=True)
+    subject_id = Column(Integer, ForeignKey("subjects.id"), nullable=True)
+    teacher_id = Column(Integer, ForeignKey("teachers.id"), nullable=True)
+    classroom_id = Column(Integer, ForeignKey("classrooms.id"), nullable=True)
+    day_of_week = Column(Integer, nullable=True)
+    lesson_index = Column(Integer, nullable=True)
+    
+    timetable = relationship("Timetable", back_populates="changes")
+    base_entry = relationship("TimetableEntry")
@@ -0,0 +1,103 @@
+"""Version counters for caches of derived data (validation results).
+
+``Timetable.version`` is bumped whenever the lessons of a timetable (its entries or
+substitute changes) change, and with it the versions of the substitute timetables
+built on it. ``School.data_version`` is bumped whenever data the validation reads
+changes: teachers, capabilities, subjects, allocations, classes, classrooms or settings.
+
+Both are maintained by session events, for unit-of-work flushes as well as for
+ORM-enabled bulk INSERT/UPDATE/DELETE statements, so no code has to bump them by hand.
+Core statements on the tables (``connection.execute(table.update())``) are not seen.
+"""
+from itertools import chain
+from typing import Dict, Iterable, Optional, Set, Tuple, Union
+from sqlalchemy import event, or_, select, update
+from sqlalchemy.orm import InstrumentedAttribute, Session
+from sqlalchemy.sql import Select
+from app.models.school import School, SchoolSettings
+from app.models.class_group import ClassGroup
+from app.models.subject import Subject, ClassSubjectAllocation
+from app.models.teacher import Teacher, TeacherSubjectCapability
+from app.models.classroom import Classroom
+from app.models.timetable import Timetable, TimetableEntry, SubstituteChange
+
+_LESSON_MODELS = (TimetableEntry, SubstituteChange)
+_SCHOOL_MODELS = (Teacher, Subject, Classroom, ClassGroup, SchoolSettings)
+
+Ids = Union[Iterable[int], Select]
+
+
+def _bump_timetables(connection, timetable_ids: Ids) -> None:
+    timetables = Timetable.__table__
+    connection.execute(
+        update(timetables)
+        .where(or_(timetables.c.id.in_(timetable_ids), timetables.c.base_timetable_id.in_(timetable_ids)))
+        .values(version=timetables.c.version + 1)
+    )
+
+
+def _bump_schools(connection, school_ids: Ids) -> None:
+    schools = School.__table__
+    connection.execute(
+        update(schools).where(schools.c.id.in_(school_ids)).values(data_version=schools.c.data_version + 1)
+    )
+
+
+def _owner(model) -> Tuple[Optional[InstrumentedAttribute], Optional[str]]:
+    """Column of a model naming what its rows belong to, and the kind of id it holds"""
+    if issubclass(model, _LESSON_MODELS):
+        return model.timetable_id, "timetable"
+    if issubclass(model, _SCHOOL_MODELS):
+        return model.school_id, "school"
+    if issubclass(model, ClassSubjectAllocation):
+        return model.class_group_id, "class"
+    if issubclass(model, TeacherSubjectCapability):
+        return model.teacher_id, "teacher"
+    return None, None
+
+
+def _bump(connection, kind: str, ids: Iterable[int]) -> None:
+    if kind == "timetable":
+        _bump_timetables(connection, ids)
+    elif kind == "class":
+        _bump_schools(connection, select(ClassGroup.school_id).where(ClassGroup.id.in_(ids)))
+    elif kind == "teacher":
+        _bump_schools(connection, select(Teacher.school_id).where(Teacher.id.in_(ids)))
+    else:
+        _bump_schools(connection, ids)
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_after_flush(session, flush_context) -> None:
+    owners: Dict[str, Set[int]] = {}
+    for obj in chain(session.new, session.dirty, session.deleted):
+        column, kind = _owner(type(obj))
+        if kind:
+            owners.setdefault(kind, set()).add(getattr(obj, column.key))
+    if not owners:
+        return
+    connection = session.connection()
+    for kind, ids in owners.items():
+        _bump(connection, kind, ids)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _bump_for_bulk_statement(state) -> None:
+    if not (state.is_insert or state.is_update or state.is_delete) or state.bind_mapper is None:
+        return
+    column, kind = _owner(state.bind_mapper.class_)
+    if not kind:
+        return
+    connection = state.session.connection()
+    if state.is_insert:
+        # Inserted rows are passed as parameters (one dict, or a list for executemany)
+        rows = state.parameters if isinstance(state.parameters, list) else [state.parameters or {}]
+        ids = {row[column.key] for row in rows if row.get(column.key) is not None}
+    else:
+        # Rows the statement touches, selected before it runs (deleted rows are gone afterwards)
+        query = select(column).distinct()
+        if state.statement.whereclause is not None:
+            query = query.where(state.statement.whereclause)
+        ids = set(connection.execute(query).scalars())
+    if ids:
+        _bump(connection, kind, ids)
@@ -1,4 +1,5 @@
 from typing import List
+from datetime import date
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
@@ -24,6 +25,17 @@ class TeacherAbsenceRepository(BaseRepository[TeacherAbsence]):
             .where(TeacherAbsence.teacher_id == teacher_id)
         )
         return list(result.scalars().all())
+    
+    async def get_overlapping(self, school_id: int, date_from: date, date_to: date) -> List[TeacherAbsence]:
+        """Absences of a school that cover at least one day of [date_from, date_to]"""
+        result = await self.db.execute(
+            select(TeacherAbsence).where(
+                TeacherAbsence.school_id == school_id,
+                TeacherAbsence.date_from <= date_to,
+                TeacherAbsence.date_to >= date_from
+            ).order_by(TeacherAbsence.id)
+        )
+        return list(result.scalars().all())
 
 class SubstitutionRepository(BaseRepository[Substitution]):
     def __init__(self, db: AsyncSession):
@@ -1,11 +1,42 @@
-from typing import Generic, TypeVar, Optional, List
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Generic, Iterable, TypeVar, Optional, List
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, delete
+from sqlalchemy import select, insert, update, delete
 from sqlalchemy.orm import selectinload
 from app.core.database import Base
 
 ModelType = TypeVar("ModelType", bound=Base)
 
+# Session.info flag set while a unit of work is open on the session
+_UNIT_OF_WORK = "unit_of_work"
+
+
+@asynccontextmanager
+async def unit_of_work(db: AsyncSession) -> AsyncIterator[AsyncSession]:
+    """Batch repository writes into one transaction.
+
+    Inside the block create/update/delete (and the bulk methods) only flush, so ids are
+    available but nothing is committed; the block commits once at the end and rolls back
+    if it raises. Nested blocks join the outer one.
+
+        async with unit_of_work(db):
+            timetable = await timetable_repo.create(timetable)
+            await entry_repo.create_many(rows)
+    """
+    if db.info.get(_UNIT_OF_WORK):
+        yield db
+        return
+    db.info[_UNIT_OF_WORK] = True
+    try:
+        yield db
+        await db.commit()
+    except BaseException:
+        await db.rollback()
+        raise
+    finally:
+        db.info.pop(_UNIT_OF_WORK, None)
+
+
 class BaseRepository(Generic[ModelType]):
     def __init__(self, db: AsyncSession, model: type[ModelType]):
         self.db = db
@@ -21,19 +52,51 @@ class BaseRepository(Generic[ModelType]):
     
     async def create(self, obj: ModelType) -> ModelType:
         self.db.add(obj)
+        if self._in_unit_of_work():
+            # Server-generated values other than the id are loaded on commit, not here
+            await self.db.flush()
+            return obj
         await self.db.commit()
         await self.db.refresh(obj)
         return obj
     
+    async def create_many(self, rows: Iterable[Dict[str, Any]]) -> List[ModelType]:
+        """Insert rows (column values by attribute name) with one INSERT .. RETURNING,
+        returning the new objects in the order of the rows"""
+        rows = list(rows)
+        if not rows:
+            return []
+        result = await self.db.scalars(insert(self.model).returning(self.model, sort_by_parameter_order=True), rows)
+        objs = list(result.all())
+        await self._finish()
+        return objs
+    
     async def update(self, id: int, **kwargs) -> Optional[ModelType]:
         await self.db.execute(
             update(self.model).where(self.model.id == id).values(**kwargs)
         )
-        await self.db.commit()
+        await self._finish()
         return await self.get_by_id(id)
     
     async def delete(self, id: int) -> bool:
         result = await self.db.execute(delete(self.model).where(self.model.id == id))
-        await self.db.commit()
+        await self._finish()
         return result.rowcount > 0
-
+    
+    async def delete_where(self, *criteria) -> int:
+        """Delete all rows matching the criteria in one statement, returning how many were deleted"""
+        result = await self.db.execute(
+            delete(self.model).where(*criteria).execution_options(synchronize_session=False)
+        )
+        await self._finish()
+        return result.rowcount
+    
+    def _in_unit_of_work(self) -> bool:
+        return bool(self.db.info.get(_UNIT_OF_WORK))
+    
+    async def _finish(self) -> None:
+        """Commit a write, or only flush it inside a unit of work"""
+        if self._in_unit_of_work():
+            await self.db.flush()
+        else:
+            await self.db.commit()
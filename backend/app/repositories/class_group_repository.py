@@ -14,6 +14,7 @@ class ClassGroupRepository(BaseRepository[ClassGroup]):
             select(ClassGroup)
             .where(ClassGroup.school_id == school_id)
             .options(selectinload(ClassGroup.subject_allocations))
+            .order_by(ClassGroup.id)
         )
         return list(result.scalars().all())
 
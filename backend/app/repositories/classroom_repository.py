@@ -9,6 +9,8 @@ class ClassroomRepository(BaseRepository[Classroom]):
         super().__init__(db, Classroom)
     
     async def get_by_school_id(self, school_id: int) -> List[Classroom]:
-        result = await self.db.execute(select(Classroom).where(Classroom.school_id == school_id))
+        result = await self.db.execute(
+            select(Classroom).where(Classroom.school_id == school_id).order_by(Classroom.id)
+        )
         return list(result.scalars().all())
 
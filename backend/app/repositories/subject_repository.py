@@ -10,7 +10,9 @@ class SubjectRepository(BaseRepository[Subject]):
         super().__init__(db, Subject)
     
     async def get_by_school_id(self, school_id: int) -> List[Subject]:
-        result = await self.db.execute(select(Subject).where(Subject.school_id == school_id))
+        result = await self.db.execute(
+            select(Subject).where(Subject.school_id == school_id).order_by(Subject.id)
+        )
         return list(result.scalars().all())
 
 class ClassSubjectAllocationRepository(BaseRepository[ClassSubjectAllocation]):
@@ -30,6 +32,7 @@ class ClassSubjectAllocationRepository(BaseRepository[ClassSubjectAllocation]):
             select(ClassSubjectAllocation)
             .options(selectinload(ClassSubjectAllocation.primary_teacher))
             .where(ClassSubjectAllocation.class_group_id == class_group_id)
+            .order_by(ClassSubjectAllocation.id)
         )
         return list(result.scalars().all())
     
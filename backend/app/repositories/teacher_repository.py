@@ -14,6 +14,7 @@ class TeacherRepository(BaseRepository[Teacher]):
             select(Teacher)
             .where(Teacher.school_id == school_id)
             .options(selectinload(Teacher.capabilities))
+            .order_by(Teacher.id)
         )
         return list(result.scalars().all())
     
@@ -1,26 +1,98 @@
-from typing import List, Optional
+from collections import OrderedDict
+from dataclasses import replace
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import and_, exists, func, or_, select
 from sqlalchemy.orm import selectinload
-from app.models.timetable import Timetable, TimetableEntry
+from app.models.timetable import Timetable, TimetableEntry, SubstituteChange, SubstituteChangeType
+from app.models.class_group import ClassGroup
+from app.models.subject import Subject
+from app.models.teacher import Teacher
+from app.models.classroom import Classroom
 from app.repositories.base_repository import BaseRepository
+from app.solver.overlay import ResolvedEntry, merge_day
+
+# Merged lessons of recently read substitute timetables
+# ((timetable_id, timetable version) -> lessons without relationships)
+SUBSTITUTE_VIEW_CACHE_SIZE = 256
+_substitute_views: "OrderedDict[Tuple[int, int], List[ResolvedEntry]]" = OrderedDict()
+
+
+def invalidate_substitute_views(*timetable_ids: int) -> None:
+    """Drop cached merged views (frees memory when substitute timetables are replaced or deleted,
+    stale views are never read since the key holds the timetable version)"""
+    ids = set(timetable_ids)
+    for key in [key for key in _substitute_views if key[0] in ids]:
+        del _substitute_views[key]
 
 class TimetableRepository(BaseRepository[Timetable]):
     def __init__(self, db: AsyncSession):
         super().__init__(db, Timetable)
     
-    async def get_by_school_id(self, school_id: int) -> List[Timetable]:
-        result = await self.db.execute(
-            select(Timetable)
-            .where(Timetable.school_id == school_id)
-            .options(
-                selectinload(Timetable.entries).selectinload(TimetableEntry.class_group),
-                selectinload(Timetable.entries).selectinload(TimetableEntry.subject),
-                selectinload(Timetable.entries).selectinload(TimetableEntry.teacher),
-                selectinload(Timetable.entries).selectinload(TimetableEntry.classroom),
-            )
+    async def get_summaries(
+        self,
+        school_id: int,
+        after_id: Optional[int] = None,
+        limit: int = 50,
+        is_primary: Optional[int] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None
+    ) -> List[Tuple[Timetable, int]]:
+        """Timetables of a school in id order, without their entries, each with its number of lessons.
+        Keyset pagination: pass the id of the last timetable of the previous page as after_id.
+        The date range keeps primary timetables valid on some day of it (open bounds when unset)
+        and substitute timetables for a date inside it."""
+        entry_count = (
+            select(func.count(TimetableEntry.id))
+            .where(TimetableEntry.timetable_id == Timetable.id)
+            .correlate(Timetable)
+            .scalar_subquery()
         )
-        return list(result.scalars().all())
+        query = select(Timetable, entry_count).where(Timetable.school_id == school_id)
+        if after_id is not None:
+            query = query.where(Timetable.id > after_id)
+        if is_primary is not None:
+            query = query.where(Timetable.is_primary == is_primary)
+        if date_from is not None:
+            query = query.where(or_(
+                and_(Timetable.is_primary == 0, Timetable.substitute_for_date >= date_from),
+                and_(Timetable.is_primary != 0, or_(Timetable.valid_to.is_(None), Timetable.valid_to >= date_from))
+            ))
+        if date_to is not None:
+            query = query.where(or_(
+                and_(Timetable.is_primary == 0, Timetable.substitute_for_date <= date_to),
+                and_(Timetable.is_primary != 0, or_(Timetable.valid_from.is_(None), Timetable.valid_from <= date_to))
+            ))
+        result = await self.db.execute(query.order_by(Timetable.id).limit(limit))
+        rows = [(timetable, count) for timetable, count in result.all()]
+        
+        # Substitute timetables stored as changes: the lessons of their base day, less cancelled, plus added ones
+        overlays = [
+            timetable for timetable, count in rows
+            if not count and timetable.is_primary == 0 and timetable.base_timetable_id and timetable.substitute_for_date
+        ]
+        if not overlays:
+            return rows
+        base_result = await self.db.execute(
+            select(TimetableEntry.timetable_id, TimetableEntry.day_of_week, func.count(TimetableEntry.id))
+            .where(TimetableEntry.timetable_id.in_({t.base_timetable_id for t in overlays}))
+            .group_by(TimetableEntry.timetable_id, TimetableEntry.day_of_week)
+        )
+        base_counts = {(timetable_id, day): count for timetable_id, day, count in base_result.all()}
+        changes_result = await self.db.execute(
+            select(SubstituteChange.timetable_id, SubstituteChange.change_type, func.count(SubstituteChange.id))
+            .where(SubstituteChange.timetable_id.in_([t.id for t in overlays]))
+            .group_by(SubstituteChange.timetable_id, SubstituteChange.change_type)
+        )
+        change_counts = {(timetable_id, change_type): count for timetable_id, change_type, count in changes_result.all()}
+        counts = {
+            t.id: base_counts.get((t.base_timetable_id, t.substitute_for_date.weekday()), 0)
+            - change_counts.get((t.id, SubstituteChangeType.CANCELLED), 0)
+            + change_counts.get((t.id, SubstituteChangeType.ADDED), 0)
+            for t in overlays
+        }
+        return [(timetable, counts.get(timetable.id, count)) for timetable, count in rows]
     
     async def get_by_id_with_entries(self, id: int) -> Optional[Timetable]:
         result = await self.db.execute(
@@ -34,12 +106,51 @@ class TimetableRepository(BaseRepository[Timetable]):
             )
         )
         return result.scalar_one_or_none()
+    
+    async def get_substitute_for_date(
+        self, school_id: int, base_timetable_id: int, substitute_date
+    ) -> Optional[Timetable]:
+        result = await self.db.execute(
+            select(Timetable).where(
+                Timetable.school_id == school_id,
+                Timetable.base_timetable_id == base_timetable_id,
+                Timetable.substitute_for_date == substitute_date,
+                Timetable.is_primary == 0
+            ).order_by(Timetable.id.desc()).limit(1)
+        )
+        return result.scalar_one_or_none()
+
+    async def get_overlay_ids_by_teacher(self, school_id: int, teacher_id: int) -> List[int]:
+        """Ids of the substitute timetables that store only changes (no entries of their own) and
+        have lessons of a teacher: changes assigning the teacher, or base lessons of the teacher
+        on the substitute timetable's weekday"""
+        result = await self.db.execute(
+            select(TimetableEntry.timetable_id, TimetableEntry.day_of_week)
+            .where(TimetableEntry.teacher_id == teacher_id)
+            .distinct()
+        )
+        base_days = {(row.timetable_id, row.day_of_week) for row in result}
+        assigned = exists().where(SubstituteChange.timetable_id == Timetable.id, SubstituteChange.teacher_id == teacher_id)
+        result = await self.db.execute(
+            select(Timetable.id, Timetable.base_timetable_id, Timetable.substitute_for_date, assigned.label("assigned"))
+            .where(
+                Timetable.school_id == school_id,
+                Timetable.is_primary == 0,
+                ~exists().where(TimetableEntry.timetable_id == Timetable.id),
+                or_(assigned, Timetable.base_timetable_id.in_({timetable_id for timetable_id, _ in base_days}))
+            ).order_by(Timetable.id)
+        )
+        return [
+            row.id for row in result
+            if row.assigned or (row.substitute_for_date is not None
+                                and (row.base_timetable_id, row.substitute_for_date.weekday()) in base_days)
+        ]
 
 class TimetableEntryRepository(BaseRepository[TimetableEntry]):
     def __init__(self, db: AsyncSession):
         super().__init__(db, TimetableEntry)
     
-    async def get_by_timetable_id(self, timetable_id: int) -> List[TimetableEntry]:
+    async def get_by_timetable_id(self, timetable_id: int) -> List[Union[TimetableEntry, ResolvedEntry]]:
         result = await self.db.execute(
             select(TimetableEntry)
             .where(TimetableEntry.timetable_id == timetable_id)
@@ -51,15 +162,156 @@ class TimetableEntryRepository(BaseRepository[TimetableEntry]):
                 selectinload(TimetableEntry.classroom),
             )
         )
+        entries = list(result.scalars().all())
+        if entries:
+            return entries
+        # Substitute timetables store only their changes over the base timetable
+        return await self.get_substitute_view(timetable_id)
+    
+    async def get_substitute_view(self, timetable_id: int) -> List[ResolvedEntry]:
+        """Lessons of a substitute timetable: the base timetable's lessons on its weekday
+        merged with its changes. The merge is cached per timetable version (bumped when the
+        changes or the base timetable's lessons change), relationships are loaded per call."""
+        result = await self.db.execute(
+            select(
+                Timetable.version, Timetable.is_primary, Timetable.base_timetable_id, Timetable.substitute_for_date
+            ).where(Timetable.id == timetable_id)
+        )
+        timetable = result.one_or_none()
+        if not timetable or timetable.is_primary != 0 or not timetable.base_timetable_id \
+                or not timetable.substitute_for_date:
+            return []
+        key = (timetable_id, timetable.version)
+        cached = _substitute_views.get(key)
+        if cached is None:
+            base_result = await self.db.execute(
+                select(TimetableEntry).where(
+                    TimetableEntry.timetable_id == timetable.base_timetable_id,
+                    TimetableEntry.day_of_week == timetable.substitute_for_date.weekday()
+                ).order_by(TimetableEntry.id)
+            )
+            changes_result = await self.db.execute(
+                select(SubstituteChange).where(SubstituteChange.timetable_id == timetable_id)
+                .order_by(SubstituteChange.id)
+            )
+            cached = merge_day(timetable_id, list(base_result.scalars().all()), list(changes_result.scalars().all()))
+            _substitute_views[key] = cached
+            if len(_substitute_views) > SUBSTITUTE_VIEW_CACHE_SIZE:
+                _substitute_views.popitem(last=False)
+        else:
+            _substitute_views.move_to_end(key)
+        
+        entries = [replace(entry) for entry in cached]
+        await self._attach_related(entries)
+        return entries
+    
+    async def _attach_related(self, entries: List[ResolvedEntry]) -> None:
+        """Load class, subject, teacher and classroom of merged lessons (one query per kind)"""
+        for model, id_attr, attr in (
+            (ClassGroup, "class_group_id", "class_group"),
+            (Subject, "subject_id", "subject"),
+            (Teacher, "teacher_id", "teacher"),
+            (Classroom, "classroom_id", "classroom"),
+        ):
+            ids = {getattr(e, id_attr) for e in entries if getattr(e, id_attr) is not None}
+            if not ids:
+                continue
+            result = await self.db.execute(select(model).where(model.id.in_(ids)))
+            objects = {obj.id: obj for obj in result.scalars().all()}
+            for entry in entries:
+                setattr(entry, attr, objects.get(getattr(entry, id_attr)))
+    
+    async def get_by_teacher(
+        self, school_id: int, teacher_id: int, day_of_week: Optional[int] = None
+    ) -> List[TimetableEntry]:
+        """Stored lessons of a teacher in all timetables of a school, by timetable"""
+        query = (
+            select(TimetableEntry)
+            .join(Timetable, Timetable.id == TimetableEntry.timetable_id)
+            .where(Timetable.school_id == school_id, TimetableEntry.teacher_id == teacher_id)
+        )
+        if day_of_week is not None:
+            query = query.where(TimetableEntry.day_of_week == day_of_week)
+        result = await self.db.execute(
+            query.options(
+                selectinload(TimetableEntry.class_group),
+                selectinload(TimetableEntry.subject),
+                selectinload(TimetableEntry.teacher),
+                selectinload(TimetableEntry.classroom),
+            ).order_by(TimetableEntry.timetable_id, TimetableEntry.id)
+        )
         return list(result.scalars().all())
     
+    async def count_by_subject(self, subject_id: int) -> int:
+        result = await self.db.execute(
+            select(func.count()).select_from(TimetableEntry).where(TimetableEntry.subject_id == subject_id)
+        )
+        return result.scalar_one()
+    
     async def get_by_teacher_and_date_range(
-        self, teacher_id: int, date_from, date_to
+        self, school_id: int, teacher_id: int, date_from: date, date_to: date
     ) -> List[TimetableEntry]:
-        # This would need to be implemented based on how we map day_of_week to actual dates
-        # For now, returning entries by teacher_id
+        """Lessons of a teacher in primary timetables that take place between date_from and date_to.
+        The range is reduced to its weekdays (at most seven, each with its first and last date), so
+        the statement has the same size for any range; lessons whose timetable is valid on none of
+        their dates (validity shorter than a week) are dropped after loading."""
+        weekdays: Dict[int, Tuple[date, date]] = {}
+        for offset in range(min((date_to - date_from).days + 1, 7)):
+            first = date_from + timedelta(days=offset)
+            weekdays[first.weekday()] = (first, first + timedelta(weeks=(date_to - first).days // 7))
+        if not weekdays:
+            return []
         result = await self.db.execute(
-            select(TimetableEntry).where(TimetableEntry.teacher_id == teacher_id)
+            select(TimetableEntry, Timetable.valid_from, Timetable.valid_to)
+            .join(Timetable, Timetable.id == TimetableEntry.timetable_id)
+            .where(
+                Timetable.school_id == school_id,
+                Timetable.is_primary == 1,
+                TimetableEntry.teacher_id == teacher_id,
+                or_(*(
+                    and_(
+                        TimetableEntry.day_of_week == weekday,
+                        or_(Timetable.valid_from.is_(None), Timetable.valid_from <= last),
+                        or_(Timetable.valid_to.is_(None), Timetable.valid_to >= first)
+                    )
+                    for weekday, (first, last) in weekdays.items()
+                ))
+            )
+            .order_by(TimetableEntry.id)
         )
-        return list(result.scalars().all())
-
+        entries = []
+        for entry, valid_from, valid_to in result.all():
+            first, last = weekdays[entry.day_of_week]
+            start = max(first, valid_from or first)
+            end = min(last, valid_to or last)
+            # First date with the lesson's weekday inside the timetable's validity
+            if start + timedelta(days=(entry.day_of_week - start.weekday()) % 7) <= end:
+                entries.append(entry)
+        return entries
+    
+    async def get_busy_teachers(
+        self, timetable_ids: Iterable[int], days: Iterable[int]
+    ) -> Dict[Tuple[int, int, int], Set[int]]:
+        """(timetable_id, day_of_week, lesson_index) -> ids of the teachers teaching then"""
+        result = await self.db.execute(
+            select(
+                TimetableEntry.timetable_id, TimetableEntry.day_of_week,
+                TimetableEntry.lesson_index, TimetableEntry.teacher_id
+            ).where(
+                TimetableEntry.timetable_id.in_(set(timetable_ids)),
+                TimetableEntry.day_of_week.in_(set(days))
+            )
+        )
+        busy: Dict[Tuple[int, int, int], Set[int]] = {}
+        for timetable_id, day, lesson_index, teacher_id in result.all():
+            busy.setdefault((timetable_id, day, lesson_index), set()).add(teacher_id)
+        return busy
+    
+    async def count_by_teacher(self, timetable_ids: Iterable[int]) -> Dict[Tuple[int, int], int]:
+        """(timetable_id, teacher_id) -> number of lessons the teacher teaches in the timetable"""
+        result = await self.db.execute(
+            select(TimetableEntry.timetable_id, TimetableEntry.teacher_id, func.count(TimetableEntry.id))
+            .where(TimetableEntry.timetable_id.in_(set(timetable_ids)))
+            .group_by(TimetableEntry.timetable_id, TimetableEntry.teacher_id)
+        )
+        return {(timetable_id, teacher_id): count for timetable_id, teacher_id, count in result.all()}
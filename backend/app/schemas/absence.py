@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from datetime import date
 
 class TeacherAbsenceBase(BaseModel):
@@ -11,6 +11,12 @@ class TeacherAbsenceBase(BaseModel):
 class TeacherAbsenceCreate(TeacherAbsenceBase):
     pass
 
+class TeacherAbsenceUpdate(BaseModel):
+    teacher_id: Optional[int] = None
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    reason: Optional[str] = None
+
 class TeacherSimpleResponse(BaseModel):
     id: int
     full_name: str
@@ -35,6 +41,12 @@ class SubstitutionBase(BaseModel):
 class SubstitutionCreate(SubstitutionBase):
     pass
 
+class SubstitutionBulkCreate(BaseModel):
+    # Either the absences to cover or a date window selecting all absences overlapping it
+    absence_ids: Optional[List[int]] = None
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+
 class SubstitutionUpdate(BaseModel):
     substitute_teacher_id: Optional[int] = None
     new_classroom_id: Optional[int] = None
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from datetime import time
 
@@ -10,6 +10,7 @@ class SchoolSettingsBase(BaseModel):
     break_durations: Optional[List[int]] = None  # Break durations after each lesson (index 0 = after lesson 1)
     possible_lunch_hours: Optional[List[int]] = None
     lunch_duration_minutes: int = 30
+    days_per_week: int = Field(default=5, ge=1, le=7)  # School days starting on Monday
 
 class SchoolSettingsUpdate(BaseModel):
     start_time: Optional[time] = None
@@ -19,6 +20,7 @@ class SchoolSettingsUpdate(BaseModel):
     break_durations: Optional[List[int]] = None
     possible_lunch_hours: Optional[List[int]] = None
     lunch_duration_minutes: Optional[int] = None
+    days_per_week: Optional[int] = Field(default=None, ge=1, le=7)
 
 class SchoolSettingsResponse(SchoolSettingsBase):
     id: int
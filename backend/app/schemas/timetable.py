@@ -9,6 +9,7 @@ class TimetableCreate(BaseModel):
     name: str
     valid_from: Optional[date] = None
     valid_to: Optional[date] = None
+    seed: Optional[int] = None  # Generator seed; pass the seed of an existing timetable to replay its run
 
 # Simple teacher response for timetable entries (without capabilities to avoid lazy loading)
 class TeacherSimpleResponse(BaseModel):
@@ -34,6 +35,9 @@ class TimetableEntryResponse(BaseModel):
     subject: Optional[SubjectResponse] = None
     teacher: Optional[TeacherSimpleResponse] = None
     classroom: Optional[ClassroomResponse] = None
+    # Set on lessons of substitute timetables that differ from the base timetable
+    base_entry_id: Optional[int] = None
+    change_type: Optional[str] = None
     
     class Config:
         from_attributes = True
@@ -47,12 +51,33 @@ class TimetableResponse(BaseModel):
     is_primary: Optional[int] = 1
     substitute_for_date: Optional[date] = None
     base_timetable_id: Optional[int] = None
+    seed: Optional[int] = None
     entries: list[TimetableEntryResponse] = []
     class_lunch_hours: Optional[dict[int, dict[int, list[int]]]] = None  # class_id -> {day: list of lunch hour lesson indices}
     
     class Config:
         from_attributes = True
 
+class TimetableSummaryResponse(BaseModel):
+    """A timetable without its entries (see TimetableResponse for the lessons)"""
+    id: int
+    school_id: int
+    name: str
+    valid_from: Optional[date]
+    valid_to: Optional[date]
+    is_primary: Optional[int] = 1
+    substitute_for_date: Optional[date] = None
+    base_timetable_id: Optional[int] = None
+    seed: Optional[int] = None
+    entry_count: int = 0  # number of lessons (for substitute timetables: after their changes)
+    
+    class Config:
+        from_attributes = True
+
+class TimetablePage(BaseModel):
+    items: list[TimetableSummaryResponse]
+    next_cursor: Optional[int] = None  # pass as `after` to get the next page, None on the last page
+
 class ValidationErrorResponse(BaseModel):
     type: str
     message: str
@@ -62,3 +87,34 @@ class ValidationResponse(BaseModel):
     is_valid: bool
     errors: list[ValidationErrorResponse]
 
+class EntryMove(BaseModel):
+    entry_id: int
+    day_of_week: int
+    lesson_index: int
+    teacher_id: Optional[int] = None  # None keeps the teacher
+    classroom_id: Optional[int] = None  # None keeps the classroom
+
+class EntrySwap(BaseModel):
+    entry_id: int
+    other_entry_id: int
+
+class TimetableEditCheck(BaseModel):
+    """A proposed edit of a timetable (not saved)"""
+    moves: list[EntryMove] = []
+    swaps: list[EntrySwap] = []
+    deletes: list[int] = []
+
+class TimetableEditCheckResponse(BaseModel):
+    is_valid: bool  # whether the timetable would have no violations after the edit
+    delta: dict[str, int]  # change of the number of violations per type
+    violations: dict[str, int]  # number of violations per type after the edit
+
+
+class TimetableScoreResponse(BaseModel):
+    """Soft-constraint metrics of a timetable (lower is better)"""
+    class_gaps: int
+    teacher_gaps: int
+    day_balance: float
+    subject_spread: int
+    room_changes: int
+    total: float
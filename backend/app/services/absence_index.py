@@ -0,0 +1,45 @@
+from bisect import bisect_right
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Set, Tuple
+from app.models.absence import TeacherAbsence
+
+
+class AbsenceIndex:
+    """In-memory interval index of teacher absences.
+
+    Absences of each teacher are merged into sorted, non-overlapping date
+    intervals, so "is this teacher absent on this date" is a binary search.
+    Load it once for the dates a run looks at and pass it around instead of
+    querying absences per teacher or per day."""
+
+    def __init__(self, absences: Iterable[TeacherAbsence]):
+        intervals: Dict[int, List[Tuple[date, date]]] = {}
+        for absence in absences:
+            intervals.setdefault(absence.teacher_id, []).append((absence.date_from, absence.date_to))
+
+        self._starts: Dict[int, List[date]] = {}
+        self._ends: Dict[int, List[date]] = {}
+        for teacher_id, teacher_intervals in intervals.items():
+            starts: List[date] = []
+            ends: List[date] = []
+            for date_from, date_to in sorted(teacher_intervals):
+                # Merge overlapping and adjacent absences
+                if ends and date_from <= ends[-1] + timedelta(days=1):
+                    ends[-1] = max(ends[-1], date_to)
+                else:
+                    starts.append(date_from)
+                    ends.append(date_to)
+            self._starts[teacher_id] = starts
+            self._ends[teacher_id] = ends
+
+    def is_absent(self, teacher_id: int, on: date) -> bool:
+        """Whether the teacher is absent on a date"""
+        starts = self._starts.get(teacher_id)
+        if not starts:
+            return False
+        i = bisect_right(starts, on)
+        return i > 0 and self._ends[teacher_id][i - 1] >= on
+
+    def absent_teachers(self, on: date) -> Set[int]:
+        """Ids of the teachers absent on a date"""
+        return {teacher_id for teacher_id in self._starts if self.is_absent(teacher_id, on)}
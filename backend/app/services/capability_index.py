@@ -0,0 +1,69 @@
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+from app.models.teacher import Teacher
+
+
+class CapabilityRow(NamedTuple):
+    teacher_id: int
+    class_group_id: Optional[int]
+    grade_level_id: Optional[int]
+    is_primary: bool
+
+
+class CapabilityIndex:
+    """Inverted index of teacher capabilities: subject_id -> the capabilities of qualified teachers.
+
+    Rows keep the order of the teacher list the index was built from, so looking up
+    candidates gives the same teachers in the same order as scanning all teachers,
+    but only touches the qualified ones. Built once per run from the teachers
+    (with capabilities) loaded in that run's session."""
+
+    def __init__(self, teachers: Sequence[Teacher]):
+        self.by_subject: Dict[int, List[CapabilityRow]] = {}
+        self.teachers: Dict[int, Teacher] = {}
+        for teacher in teachers:
+            self.teachers[teacher.id] = teacher
+            for capability in teacher.capabilities:
+                self.by_subject.setdefault(capability.subject_id, []).append(CapabilityRow(
+                    teacher.id, capability.class_group_id, capability.grade_level_id, capability.is_primary == 1
+                ))
+
+    def candidates(
+        self,
+        subject_id: int,
+        class_group_id: Optional[int] = None,
+        grade_level_id: Optional[int] = None
+    ) -> List[Teacher]:
+        """Teachers who can teach a subject. With a class, only capabilities that apply to it
+        (class-specific, for its grade level or general) count."""
+        result: List[Teacher] = []
+        seen = set()
+        for row in self.by_subject.get(subject_id, ()):
+            if row.teacher_id in seen:
+                continue
+            if class_group_id is not None and not (
+                row.class_group_id == class_group_id or
+                (row.class_group_id is None and row.grade_level_id in (None, grade_level_id))
+            ):
+                continue
+            seen.add(row.teacher_id)
+            result.append(self.teachers[row.teacher_id])
+        return result
+
+    def fit(self, teacher_id: int, subject_id: int, class_group_id: int,
+            grade_level_id: Optional[int]) -> Tuple[int, bool]:
+        """How specifically a teacher is qualified to teach a subject in a class
+        (0 for the class, 1 for its grade level, 2 for any class, 3 only for other classes)
+        and whether the teacher is a primary teacher of the subject"""
+        level = 3
+        primary = False
+        for row in self.by_subject.get(subject_id, ()):
+            if row.teacher_id != teacher_id:
+                continue
+            primary = primary or row.is_primary
+            if row.class_group_id == class_group_id:
+                level = 0
+            elif row.class_group_id is None and row.grade_level_id is not None and row.grade_level_id == grade_level_id:
+                level = min(level, 1)
+            elif row.class_group_id is None and row.grade_level_id is None:
+                level = min(level, 2)
+        return level, primary
@@ -0,0 +1,233 @@
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional, Set, Tuple
+from app.models.subject import Subject
+from app.models.teacher import Teacher
+
+# Violation types, as reported by TimetableValidationService
+TEACHER_CONFLICT = "teacher_conflict"
+CLASS_CONFLICT = "class_conflict"
+CLASSROOM_CONFLICT = "classroom_conflict"
+TEACHER_HOURS_EXCEEDED = "teacher_hours_exceeded"
+CONSECUTIVE_HOURS = "consecutive_hours_violation"
+MAX_CONSECUTIVE_HOURS = "max_consecutive_hours_violation"
+MULTIPLE_IN_DAY = "multiple_in_day_violation"
+
+
+class Lesson(NamedTuple):
+    class_group_id: int
+    subject_id: int
+    teacher_id: int
+    classroom_id: Optional[int]
+    day_of_week: int
+    lesson_index: int
+
+
+def lesson_of(entry) -> Lesson:
+    return Lesson(entry.class_group_id, entry.subject_id, entry.teacher_id, entry.classroom_id,
+                  entry.day_of_week, entry.lesson_index)
+
+
+# Keys of the constraint state a lesson contributes to
+_Key = Tuple
+
+
+def _keys(lesson: Lesson) -> List[_Key]:
+    keys = [
+        (TEACHER_CONFLICT, lesson.teacher_id, lesson.day_of_week, lesson.lesson_index),
+        (CLASS_CONFLICT, lesson.class_group_id, lesson.day_of_week, lesson.lesson_index),
+        (TEACHER_HOURS_EXCEEDED, lesson.teacher_id),
+        ("subject_day", lesson.class_group_id, lesson.day_of_week, lesson.subject_id),
+    ]
+    if lesson.classroom_id:
+        keys.append((CLASSROOM_CONFLICT, lesson.classroom_id, lesson.day_of_week, lesson.lesson_index))
+    return keys
+
+
+class IncrementalValidator:
+    """Constraint state of a timetable that answers "what would this edit change" without
+    validating the whole timetable again.
+
+    The state is kept as counts per (teacher/class/classroom, day, lesson) slot, lessons per
+    teacher and the lesson indices per (class, day, subject). Violations are counted the way
+    TimetableValidationService reports them (one conflict per pair of lessons in a slot, one
+    subject violation per affected lesson), so a delta is exact and only looks at the slots,
+    teachers and subject days the edit touches.
+
+    Edits are mappings entry_id -> new Lesson, or None to delete the entry. Unknown ids add lessons.
+    Checks against allocations and resources (weekly hours, blocks, availability, rooms) are not
+    tracked here, validate_timetable reports them."""
+
+    def __init__(
+        self,
+        entries: Iterable,
+        teachers: Mapping[int, Teacher],
+        subjects: Mapping[int, Subject],
+        allow_multiple: Optional[Mapping[Tuple[int, int], bool]] = None
+    ):
+        self.max_hours = {t.id: t.max_weekly_hours for t in teachers.values()}
+        self.subjects = dict(subjects)
+        # (class_group_id, subject_id) -> allocation override of allow_multiple_in_one_day
+        self.allow_multiple = dict(allow_multiple or {})
+        self.lessons: Dict[int, Lesson] = {}
+        self._counts: Counter = Counter()
+        self._subject_days: Dict[_Key, Counter] = {}
+        for entry in entries:
+            lesson = lesson_of(entry)
+            self.lessons[entry.id] = lesson
+            self._add(lesson)
+        self.totals: Counter = Counter()
+        touched = {key for lesson in self.lessons.values() for key in _keys(lesson)}
+        for key in touched:
+            self.totals.update(self._score(key))
+
+    def add_teachers(self, teachers: Iterable[Teacher]) -> None:
+        """Weekly hour limits of teachers an edit assigns who have no lessons in the timetable yet"""
+        for teacher in teachers:
+            self.max_hours[teacher.id] = teacher.max_weekly_hours
+
+    def delta(self, edit: Mapping[int, Optional[Lesson]]) -> Dict[str, int]:
+        """Change of the violation counts per type if the edit was applied (non-zero types only)"""
+        touched = self._touched(edit)
+        before = self._score_all(touched)
+        undo = self._apply(edit)
+        after = self._score_all(touched)
+        self._apply(undo)
+        after.subtract(before)
+        return {kind: count for kind, count in after.items() if count}
+
+    def would_be_valid(self, edit: Mapping[int, Optional[Lesson]]) -> bool:
+        """Whether the timetable would have no violations after the edit"""
+        totals = self.totals.copy()
+        totals.update(self.delta(edit))
+        return not any(count > 0 for count in totals.values())
+
+    def apply(self, edit: Mapping[int, Optional[Lesson]]) -> Dict[str, int]:
+        """Apply an edit to the state and return its delta"""
+        delta = self.delta(edit)
+        self._apply(edit)
+        self.totals.update(delta)
+        return delta
+
+    def move(self, entry_id: int, day_of_week: int, lesson_index: int, **changes) -> Dict[int, Lesson]:
+        """Edit moving a lesson to another slot (optionally with another teacher or classroom)"""
+        return {entry_id: self.lessons[entry_id]._replace(day_of_week=day_of_week, lesson_index=lesson_index, **changes)}
+
+    def swap(self, entry_id: int, other_entry_id: int) -> Dict[int, Lesson]:
+        """Edit exchanging the slots of two lessons"""
+        first, second = self.lessons[entry_id], self.lessons[other_entry_id]
+        return {
+            entry_id: first._replace(day_of_week=second.day_of_week, lesson_index=second.lesson_index),
+            other_entry_id: second._replace(day_of_week=first.day_of_week, lesson_index=first.lesson_index),
+        }
+
+    def delete(self, entry_id: int) -> Dict[int, None]:
+        """Edit removing a lesson"""
+        return {entry_id: None}
+
+    def _touched(self, edit: Mapping[int, Optional[Lesson]]) -> Set[_Key]:
+        touched: Set[_Key] = set()
+        for entry_id, lesson in edit.items():
+            if entry_id in self.lessons:
+                touched.update(_keys(self.lessons[entry_id]))
+            if lesson is not None:
+                touched.update(_keys(lesson))
+        return touched
+
+    def _apply(self, edit: Mapping[int, Optional[Lesson]]) -> Dict[int, Optional[Lesson]]:
+        """Apply an edit, returning the edit that undoes it"""
+        undo: Dict[int, Optional[Lesson]] = {}
+        for entry_id, lesson in edit.items():
+            old = self.lessons.pop(entry_id, None)
+            undo[entry_id] = old
+            if old is not None:
+                self._remove(old)
+            if lesson is not None:
+                self.lessons[entry_id] = lesson
+                self._add(lesson)
+        return undo
+
+    def _add(self, lesson: Lesson) -> None:
+        for key in _keys(lesson):
+            if key[0] == "subject_day":
+                self._subject_days.setdefault(key, Counter())[lesson.lesson_index] += 1
+            else:
+                self._counts[key] += 1
+
+    def _remove(self, lesson: Lesson) -> None:
+        for key in _keys(lesson):
+            if key[0] == "subject_day":
+                indices = self._subject_days[key]
+                indices[lesson.lesson_index] -= 1
+                if not indices[lesson.lesson_index]:
+                    del indices[lesson.lesson_index]
+                if not indices:
+                    del self._subject_days[key]
+            else:
+                self._counts[key] -= 1
+                if not self._counts[key]:
+                    del self._counts[key]
+
+    def _score_all(self, keys: Iterable[_Key]) -> Counter:
+        total: Counter = Counter()
+        for key in keys:
+            total.update(self._score(key))
+        return total
+
+    def _score(self, key: _Key) -> Dict[str, int]:
+        """Violations of one slot, teacher or subject day"""
+        kind = key[0]
+        if kind == TEACHER_HOURS_EXCEEDED:
+            max_hours = self.max_hours.get(key[1])
+            return {kind: 1} if max_hours is not None and self._counts.get(key, 0) > max_hours else {}
+        if kind != "subject_day":
+            count = self._counts.get(key, 0)
+            return {kind: count * (count - 1) // 2} if count > 1 else {}
+
+        indices = self._subject_days.get(key)
+        subject = self.subjects.get(key[3])
+        if not indices or subject is None:
+            return {}
+        size = sum(indices.values())
+        violations: Dict[str, int] = {}
+        if not subject.allow_consecutive_hours:
+            adjacent = sum(n for index, n in indices.items() if index - 1 in indices or index + 1 in indices)
+            if adjacent:
+                violations[CONSECUTIVE_HOURS] = adjacent
+        if subject.max_consecutive_hours:
+            # Longest run over the sorted indices (a repeated index breaks the run)
+            ordered = sorted(indices.elements())
+            longest = current = 1
+            for previous, index in zip(ordered, ordered[1:]):
+                current = current + 1 if index == previous + 1 else 1
+                longest = max(longest, current)
+            if longest > subject.max_consecutive_hours:
+                violations[MAX_CONSECUTIVE_HOURS] = size
+        if not self.allow_multiple.get((key[1], key[3]), subject.allow_multiple_in_one_day) and size > 1:
+            violations[MULTIPLE_IN_DAY] = size
+        return violations
+
+
+# (timetable_id, timetable version, school data version) -> validator of recently checked timetables
+INCREMENTAL_VALIDATOR_CACHE_SIZE = 32
+_validators: "OrderedDict[Tuple[int, int, int], IncrementalValidator]" = OrderedDict()
+
+
+def cached_validator(key: Tuple[int, int, int]) -> Optional[IncrementalValidator]:
+    validator = _validators.get(key)
+    if validator is not None:
+        _validators.move_to_end(key)
+    return validator
+
+
+def cache_validator(key: Tuple[int, int, int], validator: IncrementalValidator) -> None:
+    _validators[key] = validator
+    if len(_validators) > INCREMENTAL_VALIDATOR_CACHE_SIZE:
+        _validators.popitem(last=False)
+
+
+def invalidate_validators(*timetable_ids: int) -> None:
+    """Drop cached validators of timetables (frees memory when they are replaced or deleted,
+    stale validators are never used since the key holds the versions)"""
+    ids = set(timetable_ids)
+    for key in [key for key in _validators if key[0] in ids]:
+        del _validators[key]
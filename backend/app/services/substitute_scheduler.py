@@ -0,0 +1,186 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, List, Optional, Set
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.school import School
+from app.models.timetable import Timetable
+from app.repositories.absence_repository import TeacherAbsenceRepository
+from app.repositories.school_repository import SchoolSettingsRepository
+from app.services.absence_index import AbsenceIndex
+from app.services.substitute_timetable_service import SubstituteTimetableService
+
+logger = logging.getLogger(__name__)
+
+# Namespace of the advisory locks held while precomputing a school (first key of the two-key form)
+PRECOMPUTE_LOCK_NAMESPACE = 0x5B57
+
+
+def upcoming_school_days(start: date, days_per_week: int, count: int) -> List[date]:
+    """The next `count` school days from `start` (inclusive)"""
+    days: List[date] = []
+    current = start
+    while len(days) < count:
+        if current.weekday() < days_per_week:
+            days.append(current)
+        current += timedelta(days=1)
+    return days
+
+
+@asynccontextmanager
+async def school_lock(engine: AsyncEngine, school_id: int) -> AsyncIterator[bool]:
+    """Try to take the precompute lock of a school on PostgreSQL, yields whether it was taken.
+    The lock is held on its own connection, since sessions give theirs back on every commit.
+    Other databases have no advisory locks (single process setups), the lock is always taken."""
+    if engine.dialect.name != "postgresql":
+        yield True
+        return
+    async with engine.connect() as connection:
+        acquired = (await connection.execute(
+            text("SELECT pg_try_advisory_lock(:namespace, :school_id)"),
+            {"namespace": PRECOMPUTE_LOCK_NAMESPACE, "school_id": school_id}
+        )).scalar()
+        try:
+            yield bool(acquired)
+        finally:
+            if acquired:
+                await connection.execute(
+                    text("SELECT pg_advisory_unlock(:namespace, :school_id)"),
+                    {"namespace": PRECOMPUTE_LOCK_NAMESPACE, "school_id": school_id}
+                )
+
+
+async def precompute_school(school_id: int, days: int, today: Optional[date] = None) -> List[int]:
+    """Generate the missing substitute timetables of a school for its next school days with absences.
+    Existing substitute timetables are left alone (absence changes repair them). Runs of other
+    replicas for the same school are skipped (advisory lock).
+    Returns the ids of the generated timetables."""
+    today = today or date.today()
+    async with AsyncSessionLocal() as db, school_lock(db.bind, school_id) as acquired:
+        school_settings = await SchoolSettingsRepository(db).get_by_school_id(school_id)
+        if not acquired or not school_settings or days <= 0:
+            return []
+        dates = upcoming_school_days(today, school_settings.days_per_week, days)
+        absence_index = AbsenceIndex(
+            await TeacherAbsenceRepository(db).get_overlapping(school_id, dates[0], dates[-1])
+        )
+        dates = [d for d in dates if absence_index.absent_teachers(d)]
+        if not dates:
+            return []
+
+        result = await db.execute(
+            select(Timetable.substitute_for_date).where(
+                Timetable.school_id == school_id,
+                Timetable.is_primary == 0,
+                Timetable.substitute_for_date.in_(dates)
+            )
+        )
+        ready = set(result.scalars().all())
+        result = await db.execute(
+            select(Timetable).where(
+                Timetable.school_id == school_id,
+                Timetable.is_primary == 1,
+                Timetable.valid_from.is_not(None),
+                Timetable.valid_to.is_not(None)
+            ).order_by(Timetable.id)
+        )
+        primaries = list(result.scalars().all())
+
+        service = SubstituteTimetableService(db)
+        generated: List[int] = []
+        for substitute_date in dates:
+            if substitute_date in ready:
+                continue
+            # The primary timetable valid on that date (as the calendar view picks it)
+            base = next((t for t in primaries if t.valid_from <= substitute_date <= t.valid_to), None)
+            if base is None:
+                continue
+            timetable = await service.generate_substitute_timetable(school_id, base.id, substitute_date)
+            generated.append(timetable.id)
+        return generated
+
+
+class SubstituteScheduler:
+    """Background task that precomputes substitute timetables for the next school days.
+
+    Every night at SUBSTITUTE_PRECOMPUTE_HOUR all schools are processed. When absences
+    change, `notify` queues the school and the task processes it once no further change
+    arrived for SUBSTITUTE_NOTIFY_DELAY seconds, so a burst of edits (a morning of sick
+    calls) is one run and the request itself never generates. Existing substitute
+    timetables are repaired by the request, only missing dates are generated here, and the
+    substitute view finds a ready timetable. Every replica runs the task, each school is
+    processed by one of them at a time (see precompute_school)."""
+
+    def __init__(self, days: int, hour: int, delay: float):
+        self.days = days
+        self.hour = hour
+        self.delay = delay
+        self._pending: Set[int] = set()
+        self._due = 0.0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.days > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def notify(self, school_id: int) -> None:
+        """Absences of a school changed, generate its missing substitute timetables after the delay"""
+        if self._task is not None:
+            self._pending.add(school_id)
+            self._due = asyncio.get_running_loop().time() + self.delay
+            self._wakeup.set()
+
+    def _seconds_until_next_run(self) -> float:
+        now = datetime.now()
+        next_run = now.replace(hour=self.hour, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        return (next_run - now).total_seconds()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        nightly = loop.time() + self._seconds_until_next_run()
+        while True:
+            timeout = nightly - loop.time()
+            if self._pending:
+                timeout = min(timeout, self._due - loop.time())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            if loop.time() >= nightly:
+                async with AsyncSessionLocal() as db:
+                    school_ids = list((await db.execute(select(School.id).order_by(School.id))).scalars().all())
+            elif self._pending and loop.time() >= self._due:
+                school_ids = sorted(self._pending)
+            else:
+                continue  # notified, wait until the changes settle
+            self._pending.difference_update(school_ids)
+            for school_id in school_ids:
+                try:
+                    await precompute_school(school_id, self.days)
+                except Exception:
+                    logger.exception("Precomputing substitute timetables failed for school %s", school_id)
+            if loop.time() >= nightly:
+                nightly = loop.time() + self._seconds_until_next_run()
+
+
+substitute_scheduler = SubstituteScheduler(
+    settings.SUBSTITUTE_PRECOMPUTE_DAYS, settings.SUBSTITUTE_PRECOMPUTE_HOUR, settings.SUBSTITUTE_NOTIFY_DELAY
+)
@@ -1,21 +1,50 @@
 from typing import List, Optional, Dict, Tuple, Set
-from datetime import date, datetime
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
 import math
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from app.models.timetable import Timetable, TimetableEntry
+from sqlalchemy import select, delete
+from sqlalchemy.exc import IntegrityError
+from app.models.timetable import Timetable, TimetableEntry, SubstituteChange, SubstituteChangeType
 from app.models.absence import TeacherAbsence
 from app.models.teacher import Teacher
 from app.models.subject import Subject
 from app.models.class_group import ClassGroup
 from app.models.classroom import Classroom
-from app.repositories.timetable_repository import TimetableRepository, TimetableEntryRepository
+from app.repositories.timetable_repository import TimetableRepository, TimetableEntryRepository, invalidate_substitute_views
 from app.repositories.teacher_repository import TeacherRepository
 from app.repositories.classroom_repository import ClassroomRepository
 from app.repositories.absence_repository import TeacherAbsenceRepository
 from app.repositories.class_group_repository import ClassGroupRepository
 from app.repositories.subject_repository import SubjectRepository
 from app.repositories.school_repository import SchoolSettingsRepository
+from app.solver.engine import DAY_NAMES
+from app.solver.rearrange import rearrange_day
+from app.solver.overlay import diff_day, merge_day
+from app.solver.matching import assign
+from app.services.absence_index import AbsenceIndex
+from app.services.capability_index import CapabilityIndex
+from app.services.incremental_validation import invalidate_validators
+from app.services.substitution_service import LOAD_COST, FIT_COST, NON_PRIMARY_COST
+
+# Longest date range generated in one request
+MAX_SUBSTITUTE_RANGE_DAYS = 62
+
+
+@dataclass
+class SubstituteContext:
+    """Data shared by all substitute days generated in one run"""
+    base_timetable: Timetable
+    days_per_week: int
+    max_lessons_per_day: int
+    teachers: List[Teacher]
+    capability_index: CapabilityIndex
+    classrooms: List[Classroom]
+    classes: Dict[int, ClassGroup]
+    subjects: Dict[int, Subject]
+    lunch_hours: Dict[int, Dict[int, List[int]]]
+    absence_index: AbsenceIndex
+
 
 class SubstituteTimetableService:
     def __init__(self, db: AsyncSession):
@@ -42,6 +71,228 @@ class SubstituteTimetableService:
     ) -> Timetable:
         """Generate a substitute timetable for a specific date based on absences.
         First tries to rearrange lessons within the day, then adjusts the rest of the week if needed."""
+        context = await self._load_context(school_id, base_timetable_id, substitute_date, substitute_date)
+        
+        # Track teacher hours
+        teacher_hours: Dict[int, int] = {t.id: 0 for t in context.teachers}
+        entries = await self._plan_day(context, substitute_date, teacher_hours)
+        
+        timetables = await self._save_substitutes(context, school_id, base_timetable_id, [(substitute_date, entries)])
+        
+        # Reload with entries for return
+        return await self.timetable_repo.get_by_id_with_entries(timetables[0].id)
+    
+    async def generate_substitute_timetables(
+        self,
+        school_id: int,
+        base_timetable_id: int,
+        date_from: date,
+        date_to: date
+    ) -> List[Timetable]:
+        """Generate substitute timetables for every school day in [date_from, date_to] in one run.
+        The base timetable, school data and absences are loaded once, days are processed in order
+        with the teacher load carried over within a week, and everything is saved in one transaction."""
+        if date_to < date_from:
+            raise ValueError("date_to must not be before date_from")
+        if (date_to - date_from).days >= MAX_SUBSTITUTE_RANGE_DAYS:
+            raise ValueError(f"Date range can span at most {MAX_SUBSTITUTE_RANGE_DAYS} days")
+        context = await self._load_context(school_id, base_timetable_id, date_from, date_to)
+        
+        days: List[Tuple[date, List[TimetableEntry]]] = []
+        teacher_hours: Dict[int, int] = {}
+        week = None
+        current = date_from
+        while current <= date_to:
+            if self._date_to_day_of_week(current) < context.days_per_week:
+                # Weekly hour limits start over every week
+                if current.isocalendar()[:2] != week:
+                    week = current.isocalendar()[:2]
+                    teacher_hours = {t.id: 0 for t in context.teachers}
+                days.append((current, await self._plan_day(context, current, teacher_hours)))
+            current += timedelta(days=1)
+        
+        if not days:
+            return []
+        timetables = await self._save_substitutes(context, school_id, base_timetable_id, days)
+        return [await self.timetable_repo.get_by_id_with_entries(t.id) for t in timetables]
+    
+    async def repair_substitute_timetables(
+        self,
+        school_id: int,
+        teacher_ids: Set[int],
+        date_from: date,
+        date_to: date
+    ) -> List[int]:
+        """Update the existing substitute timetables between date_from and date_to after absences
+        of some teachers changed. Lessons of those teachers on days they are now absent get another
+        substitute, lessons reassigned away from them go back to them where they are present again,
+        and all other lessons are kept. Days where a lesson cannot be covered this way, or where a
+        lesson of a teacher present again was cancelled or moved, are generated again. Returns the
+        ids of the substitute timetables that changed."""
+        date_from = max(date_from, date.today())
+        if not teacher_ids or date_to < date_from:
+            return []
+        result = await self.db.execute(
+            select(Timetable).where(
+                Timetable.school_id == school_id,
+                Timetable.is_primary == 0,
+                Timetable.substitute_for_date >= date_from,
+                Timetable.substitute_for_date <= date_to
+            ).order_by(Timetable.substitute_for_date)
+        )
+        timetables = list(result.scalars().all())
+        if not timetables:
+            return []
+        
+        absence_index = AbsenceIndex(await self.absence_repo.get_overlapping(school_id, date_from, date_to))
+        capability_index: Optional[CapabilityIndex] = None
+        grade_levels: Dict[int, Optional[int]] = {}
+        changed: List[int] = []
+        regenerate: List[Timetable] = []
+        for timetable in timetables:
+            substitute_date = timetable.substitute_for_date
+            
+            # Lessons of the day and the rows that store them
+            own_entries = list((await self.db.execute(
+                select(TimetableEntry).where(TimetableEntry.timetable_id == timetable.id)
+            )).scalars().all())
+            if own_entries:
+                # Substitute timetable stored with copied entries
+                base_by_id: Dict[int, TimetableEntry] = {}
+                change_rows: Dict[int, SubstituteChange] = {}
+                lessons = own_entries
+            else:
+                base_entries = list((await self.db.execute(
+                    select(TimetableEntry).where(
+                        TimetableEntry.timetable_id == timetable.base_timetable_id,
+                        TimetableEntry.day_of_week == self._date_to_day_of_week(substitute_date)
+                    ).order_by(TimetableEntry.id)
+                )).scalars().all())
+                changes = list((await self.db.execute(
+                    select(SubstituteChange).where(SubstituteChange.timetable_id == timetable.id)
+                    .order_by(SubstituteChange.id)
+                )).scalars().all())
+                base_by_id = {e.id: e for e in base_entries}
+                # Merged lessons are keyed by base entry id, added lessons by -change id
+                change_rows = {c.base_entry_id if c.base_entry_id is not None else -c.id: c for c in changes}
+                lessons = merge_day(timetable.id, base_entries, changes)
+                # Cancelled or moved lessons of a teacher who is present again: the day is planned
+                # again, as putting them back may clash with lessons moved into their slots
+                if any(
+                    change.change_type in (SubstituteChangeType.CANCELLED, SubstituteChangeType.MOVED)
+                    and change.base_entry_id in base_by_id
+                    and base_by_id[change.base_entry_id].teacher_id in teacher_ids
+                    and not absence_index.is_absent(base_by_id[change.base_entry_id].teacher_id, substitute_date)
+                    for change in changes
+                ):
+                    regenerate.append(timetable)
+                    continue
+            
+            teacher_hours: Dict[int, int] = {}
+            for lesson in lessons:
+                if getattr(lesson, "change_type", None) is not None:
+                    teacher_hours[lesson.teacher_id] = teacher_hours.get(lesson.teacher_id, 0) + 1
+            
+            # Lessons of teachers who are now absent get substitutes as one matching per slot
+            to_cover = [
+                lesson for lesson in lessons
+                if lesson.teacher_id in teacher_ids and absence_index.is_absent(lesson.teacher_id, substitute_date)
+            ]
+            substitutes: Dict[int, int] = {}
+            if to_cover:
+                if capability_index is None:
+                    capability_index = CapabilityIndex(await self.teacher_repo.get_by_school_id(school_id))
+                    grade_levels = {c.id: c.grade_level_id for c in await self.class_repo.get_by_school_id(school_id)}
+                assigned = self._match_substitutes(
+                    to_cover, capability_index, substitute_date, lessons, teacher_hours, absence_index, grade_levels
+                )
+                if len(assigned) < len(to_cover):
+                    regenerate.append(timetable)
+                    continue
+                substitutes = {id(to_cover[position]): teacher.id for position, teacher in assigned.items()}
+            
+            modified = False
+            for lesson in lessons:
+                base = base_by_id.get(getattr(lesson, "base_entry_id", None))
+                if id(lesson) in substitutes:
+                    teacher_id = substitutes[id(lesson)]
+                elif base is not None and base.teacher_id in teacher_ids and base.teacher_id != lesson.teacher_id \
+                        and not absence_index.is_absent(base.teacher_id, substitute_date) \
+                        and not any(substitutes.get(id(other), other.teacher_id) == base.teacher_id
+                                    and other.day_of_week == lesson.day_of_week
+                                    and other.lesson_index == lesson.lesson_index for other in lessons) \
+                        and ((lesson.day_of_week, lesson.lesson_index) == (base.day_of_week, base.lesson_index)
+                             or await self._is_available(school_id, base.teacher_id, lesson)):
+                    # The original teacher is back
+                    teacher_id = base.teacher_id
+                else:
+                    continue
+                
+                lesson.teacher_id = teacher_id
+                modified = True
+                if own_entries:
+                    continue  # the entry itself is updated
+                key = lesson.base_entry_id if lesson.base_entry_id is not None else lesson.id
+                change = change_rows.get(key)
+                if change is None:
+                    change_rows[key] = SubstituteChange(
+                        timetable_id=timetable.id,
+                        base_entry_id=lesson.base_entry_id,
+                        change_type=SubstituteChangeType.REASSIGNED,
+                        class_group_id=lesson.class_group_id,
+                        subject_id=lesson.subject_id,
+                        teacher_id=teacher_id,
+                        classroom_id=lesson.classroom_id,
+                        day_of_week=lesson.day_of_week,
+                        lesson_index=lesson.lesson_index
+                    )
+                    self.db.add(change_rows[key])
+                elif base is not None and change.change_type == SubstituteChangeType.REASSIGNED and \
+                        (teacher_id, lesson.classroom_id) == (base.teacher_id, base.classroom_id):
+                    # Back to the base lesson, nothing left to store
+                    await self.db.delete(change)
+                    del change_rows[key]
+                else:
+                    change.teacher_id = teacher_id
+            
+            if modified:
+                changed.append(timetable.id)
+        
+        await self.db.commit()
+        invalidate_substitute_views(*changed)
+        invalidate_validators(*changed)
+        
+        for timetable in regenerate:
+            try:
+                regenerated = await self.generate_substitute_timetable(
+                    school_id, timetable.base_timetable_id, timetable.substitute_for_date
+                )
+            except ValueError:
+                continue  # base timetable or settings are gone, the day stays as it is
+            changed.append(regenerated.id)
+        return changed
+    
+    async def _is_available(self, school_id: int, teacher_id: int, entry) -> bool:
+        """Whether a teacher's availability allows teaching in the slot of an entry"""
+        teacher = await self.teacher_repo.get_by_id(teacher_id)
+        if not teacher or teacher.school_id != school_id:
+            return False
+        if teacher.availability:
+            available_hours = teacher.availability.get(DAY_NAMES[entry.day_of_week], [])
+            if available_hours and entry.lesson_index not in available_hours:
+                return False
+        return True
+    
+    async def _load_context(
+        self,
+        school_id: int,
+        base_timetable_id: int,
+        date_from: date,
+        date_to: date
+    ) -> "SubstituteContext":
+        """Load everything the substitute days between date_from and date_to share"""
+        from app.services.timetable_service import TimetableService, calculate_max_lessons_per_day
+        
         # Get the primary timetable
         base_timetable = await self.timetable_repo.get_by_id_with_entries(base_timetable_id)
         if not base_timetable or base_timetable.school_id != school_id:
@@ -49,95 +300,108 @@ class SubstituteTimetableService:
         if base_timetable.is_primary != 1:
             raise ValueError("Base timetable must be a primary timetable")
         
-        # Check if substitute timetable already exists for this date
-        existing = await self._find_existing_substitute(school_id, base_timetable_id, substitute_date)
-        if existing:
-            # Delete existing substitute timetable and recreate
-            await self._delete_substitute_timetable(existing.id)
-        
         # Get school settings
         settings = await self.settings_repo.get_by_school_id(school_id)
         if not settings:
             raise ValueError("School settings not found")
         
-        # Calculate max lessons per day
-        total_minutes = (settings.end_time.hour * 60 + settings.end_time.minute) - \
-                       (settings.start_time.hour * 60 + settings.start_time.minute)
-        if settings.break_durations and len(settings.break_durations) > 0:
-            avg_break_duration = sum(settings.break_durations) / len(settings.break_durations)
-            lesson_duration = settings.class_hour_length_minutes + int(avg_break_duration)
-        else:
-            lesson_duration = settings.class_hour_length_minutes + settings.break_duration_minutes
-        
-        lunch_hours_count = 0
-        if settings.possible_lunch_hours and settings.lunch_duration_minutes > 0:
-            lunch_hours_count = math.ceil(settings.lunch_duration_minutes / settings.class_hour_length_minutes)
-        
-        lunch_duration_minutes = lunch_hours_count * settings.class_hour_length_minutes if settings.possible_lunch_hours else 0
-        available_minutes = total_minutes - lunch_duration_minutes
-        max_lessons_per_day = int(available_minutes // lesson_duration)
-        
-        # Get all absences for this date
-        day_of_week = self._date_to_day_of_week(substitute_date)
-        absences = await self._get_absences_for_date(school_id, substitute_date)
+        # Load the absences of the whole weeks once (lessons may move to other days)
+        window_start = date_from - timedelta(days=date_from.weekday())
+        window_end = date_to - timedelta(days=date_to.weekday()) + timedelta(days=settings.days_per_week - 1)
+        absence_index = AbsenceIndex(await self.absence_repo.get_overlapping(
+            school_id, window_start, max(date_to, window_end)
+        ))
         
-        # Get all teachers and classrooms
+        # Get all teachers, classrooms, classes and subjects
         teachers = await self.teacher_repo.get_by_school_id(school_id)
         classrooms = await self.classroom_repo.get_by_school_id(school_id)
-        
-        # Get all classes and subjects
         classes = await self.class_repo.get_by_school_id(school_id)
-        classes_dict = {c.id: c for c in classes}
         subjects = await self.subject_repo.get_by_school_id(school_id)
-        subjects_dict = {s.id: s for s in subjects}
-        
-        # Create substitute timetable
-        substitute_timetable = Timetable(
-            school_id=school_id,
-            name=f"Substitute for {substitute_date.strftime('%Y-%m-%d')}",
-            valid_from=substitute_date,
-            valid_to=substitute_date,
-            is_primary=0,
-            substitute_for_date=substitute_date,
-            base_timetable_id=base_timetable_id
-        )
-        substitute_timetable = await self.timetable_repo.create(substitute_timetable)
         
-        # Get entries for the target day from base timetable
-        day_entries = [e for e in base_timetable.entries if e.day_of_week == day_of_week]
+        # Get lunch hours (from base timetable calculation)
+        lunch_hours = await TimetableService(self.db).calculate_class_lunch_hours(school_id, base_timetable_id)
         
-        # Group entries by class
+        return SubstituteContext(
+            base_timetable=base_timetable,
+            days_per_week=settings.days_per_week,
+            max_lessons_per_day=calculate_max_lessons_per_day(settings),
+            teachers=teachers,
+            capability_index=CapabilityIndex(teachers),
+            classrooms=classrooms,
+            classes={c.id: c for c in classes},
+            subjects={s.id: s for s in subjects},
+            lunch_hours=lunch_hours,
+            absence_index=absence_index
+        )
+    
+    async def _plan_day(
+        self,
+        context: "SubstituteContext",
+        substitute_date: date,
+        teacher_hours: Dict[int, int]
+    ) -> List[TimetableEntry]:
+        """Compute the entries of the substitute timetable for one date (not saved)"""
+        day_of_week = self._date_to_day_of_week(substitute_date)
+        
+        # Get entries for the target day from base timetable, grouped by class
         class_entries: Dict[int, List[TimetableEntry]] = {}
-        for entry in day_entries:
-            if entry.class_group_id not in class_entries:
-                class_entries[entry.class_group_id] = []
-            class_entries[entry.class_group_id].append(entry)
+        for entry in context.base_timetable.entries:
+            if entry.day_of_week == day_of_week:
+                class_entries.setdefault(entry.class_group_id, []).append(entry)
         
-        # Track teacher hours
-        teacher_hours: Dict[int, int] = {t.id: 0 for t in teachers}
+        # Lessons of absent teachers get substitutes at their own slots first, as one matching per
+        # slot across all classes, so no class takes the only teacher another class needs
+        absent_teacher_ids = context.absence_index.absent_teachers(substitute_date)
+        day_entries = [e for class_id, entries in class_entries.items() if class_id in context.classes for e in entries]
+        for entry in day_entries:
+            if entry.teacher_id not in absent_teacher_ids:
+                teacher_hours[entry.teacher_id] = teacher_hours.get(entry.teacher_id, 0) + 1
+        to_cover = [e for e in day_entries if e.teacher_id in absent_teacher_ids]
+        assigned = self._match_substitutes(
+            to_cover, context.capability_index, substitute_date, day_entries, teacher_hours, context.absence_index,
+            {c.id: c.grade_level_id for c in context.classes.values()}
+        )
+        substitutes = {id(to_cover[position]): teacher.id for position, teacher in assigned.items()}
         
-        # Get lunch hours for the day (from base timetable calculation)
-        from app.services.timetable_service import TimetableService
-        timetable_service = TimetableService(self.db)
-        lunch_hours = await timetable_service.calculate_class_lunch_hours(school_id, base_timetable_id)
+        # Classes whose lessons are all covered keep their day, only the teacher changes
+        all_entries: List[TimetableEntry] = []
+        uncovered_classes: List[int] = []
+        for class_id, class_day_entries in class_entries.items():
+            if class_id not in context.classes:
+                continue
+            if any(e.teacher_id in absent_teacher_ids and id(e) not in substitutes for e in class_day_entries):
+                uncovered_classes.append(class_id)
+                # The class is planned again below, its lessons are counted there
+                for e in class_day_entries:
+                    teacher_id = substitutes.get(id(e), e.teacher_id)
+                    if teacher_id not in absent_teacher_ids:
+                        teacher_hours[teacher_id] -= 1
+                continue
+            for e in class_day_entries:
+                all_entries.append(e if id(e) not in substitutes else TimetableEntry(
+                    class_group_id=e.class_group_id,
+                    subject_id=e.subject_id,
+                    teacher_id=substitutes[id(e)],
+                    classroom_id=e.classroom_id,
+                    day_of_week=e.day_of_week,
+                    lesson_index=e.lesson_index
+                ))
         
         # Try to rearrange lessons within the day first
-        all_entries: List[TimetableEntry] = []
         failed_classes: Set[int] = set()
         
-        for class_id, class_day_entries in class_entries.items():
-            class_group = classes_dict.get(class_id)
-            if not class_group:
-                continue
+        for class_id in uncovered_classes:
+            class_group = context.classes[class_id]
+            class_day_entries = class_entries[class_id]
             
             # Get lunch hours for this class on this day
-            class_lunch_slots = set(lunch_hours.get(class_id, {}).get(day_of_week, []))
+            class_lunch_slots = set(context.lunch_hours.get(class_id, {}).get(day_of_week, []))
             
             # Try to rearrange lessons within the day
             rearranged = await self._try_rearrange_class_day(
-                class_group, class_day_entries, subjects_dict, teachers, classrooms,
-                absences, substitute_date, day_of_week, max_lessons_per_day,
-                class_lunch_slots, teacher_hours, all_entries, substitute_timetable.id
+                class_group, class_day_entries, context.subjects, context.capability_index, context.classrooms,
+                context.absence_index, substitute_date, day_of_week, context.max_lessons_per_day,
+                class_lunch_slots, teacher_hours, all_entries
             )
             
             if rearranged:
@@ -154,24 +418,18 @@ class SubstituteTimetableService:
             # Get available days (exclude past days and the target day)
             today = date.today()
             available_days = []
-            for day in range(5):  # Monday-Friday
+            for day in range(context.days_per_week):  # School days of the week
                 if day == day_of_week:
                     continue  # Skip target day
                 # Calculate date for this day of week in the same week
                 days_diff = day - day_of_week
-                check_date = date(
-                    substitute_date.year,
-                    substitute_date.month,
-                    substitute_date.day
-                )
-                from datetime import timedelta
-                check_date = check_date + timedelta(days=days_diff)
+                check_date = substitute_date + timedelta(days=days_diff)
                 if check_date >= today:  # Only future days
                     available_days.append((day, check_date))
             
             # Try to move failed classes' lessons to other days
             for class_id in failed_classes:
-                class_group = classes_dict.get(class_id)
+                class_group = context.classes.get(class_id)
                 if not class_group:
                     continue
                 
@@ -179,9 +437,9 @@ class SubstituteTimetableService:
                 
                 # Try moving lessons to other days
                 moved = await self._try_move_class_to_other_days(
-                    class_group, class_day_entries, subjects_dict, teachers, classrooms,
-                    absences, available_days, max_lessons_per_day, lunch_hours,
-                    teacher_hours, all_entries, substitute_timetable.id, base_timetable.entries
+                    class_group, class_day_entries, context.subjects, context.capability_index, context.classrooms,
+                    context.absence_index, available_days, context.max_lessons_per_day, context.lunch_hours,
+                    teacher_hours, all_entries, context.base_timetable.entries
                 )
                 
                 if moved:
@@ -190,101 +448,123 @@ class SubstituteTimetableService:
                                  if not (e.class_group_id == class_id and e.day_of_week == day_of_week)]
                     all_entries.extend(moved)
         
-        # Save all entries
-        for entry in all_entries:
-            await self.entry_repo.create(entry)
+        # Lessons kept from the base timetable are copied, not moved out of it
+        return [
+            TimetableEntry(
+                class_group_id=e.class_group_id,
+                subject_id=e.subject_id,
+                teacher_id=e.teacher_id,
+                classroom_id=e.classroom_id,
+                day_of_week=e.day_of_week,
+                lesson_index=e.lesson_index
+            ) if e.id is not None else e
+            for e in all_entries
+        ]
+    
+    async def _save_substitutes(
+        self,
+        context: "SubstituteContext",
+        school_id: int,
+        base_timetable_id: int,
+        days: List[Tuple[date, List[TimetableEntry]]]
+    ) -> List[Timetable]:
+        """Replace the substitute timetables of the given dates in one transaction.
+        Only the differences to the base timetable's day are stored (see app.solver.overlay)."""
+        dates = [substitute_date for substitute_date, _ in days]
         
-        # Reload with entries for return
-        substitute_timetable = await self.timetable_repo.get_by_id_with_entries(substitute_timetable.id)
+        # Delete existing substitute timetables for these dates
+        result = await self.db.execute(
+            select(Timetable.id).where(
+                Timetable.school_id == school_id,
+                Timetable.base_timetable_id == base_timetable_id,
+                Timetable.substitute_for_date.in_(dates),
+                Timetable.is_primary == 0
+            )
+        )
+        existing_ids = list(result.scalars().all())
+        if existing_ids:
+            await self.db.execute(delete(SubstituteChange).where(SubstituteChange.timetable_id.in_(existing_ids)))
+            await self.db.execute(delete(TimetableEntry).where(TimetableEntry.timetable_id.in_(existing_ids)))
+            await self.db.execute(delete(Timetable).where(Timetable.id.in_(existing_ids)))
+            invalidate_substitute_views(*existing_ids)
+            invalidate_validators(*existing_ids)
         
-        return substitute_timetable
+        timetables = []
+        for substitute_date, entries in days:
+            day_of_week = self._date_to_day_of_week(substitute_date)
+            base_entries = [e for e in context.base_timetable.entries if e.day_of_week == day_of_week]
+            changes = [
+                SubstituteChange(
+                    base_entry_id=base_entry.id if base_entry is not None else None,
+                    change_type=SubstituteChangeType(change_type),
+                    class_group_id=planned.class_group_id if planned is not None else None,
+                    subject_id=planned.subject_id if planned is not None else None,
+                    teacher_id=planned.teacher_id if planned is not None else None,
+                    classroom_id=planned.classroom_id if planned is not None else None,
+                    day_of_week=planned.day_of_week if planned is not None else None,
+                    lesson_index=planned.lesson_index if planned is not None else None
+                )
+                for change_type, base_entry, planned in diff_day(base_entries, entries)
+            ]
+            timetable = Timetable(
+                school_id=school_id,
+                name=f"Substitute for {substitute_date.strftime('%Y-%m-%d')}",
+                valid_from=substitute_date,
+                valid_to=substitute_date,
+                is_primary=0,
+                substitute_for_date=substitute_date,
+                base_timetable_id=base_timetable_id,
+                changes=changes
+            )
+            timetables.append(timetable)
+        self.db.add_all(timetables)
+        try:
+            await self.db.commit()
+        except IntegrityError:
+            await self.db.rollback()
+            raise ValueError("Substitute timetables for these dates are being generated concurrently")
+        # Ids of deleted timetables can be reused
+        invalidate_substitute_views(*(t.id for t in timetables))
+        invalidate_validators(*(t.id for t in timetables))
+        return timetables
     
     async def get_substitute_timetable_with_lunch_hours(
         self,
         school_id: int,
         timetable_id: int
-    ) -> Tuple[Timetable, Dict[int, Dict[int, List[int]]]]:
-        """Get a substitute timetable with entries and calculate lunch hours"""
+    ) -> Tuple[Timetable, list, Dict[int, Dict[int, List[int]]]]:
+        """Get a substitute timetable, its lessons (base day merged with the changes) and lunch hours"""
         from app.services.timetable_service import TimetableService
         
-        timetable = await self.timetable_repo.get_by_id_with_entries(timetable_id)
+        timetable = await self.timetable_repo.get_by_id(timetable_id)
         if not timetable:
-            return None, {}
+            return None, [], {}
+        entries = await self.entry_repo.get_by_timetable_id(timetable_id)
         
         # Use TimetableService to calculate lunch hours
         timetable_service = TimetableService(self.db)
         lunch_hours = await timetable_service.calculate_class_lunch_hours(school_id, timetable_id)
-        return timetable, lunch_hours
+        return timetable, entries, lunch_hours
     
-    async def _find_existing_substitute(
-        self,
-        school_id: int,
-        base_timetable_id: int,
-        substitute_date: date
-    ) -> Optional[Timetable]:
-        """Find existing substitute timetable for a date"""
-        result = await self.db.execute(
-            select(Timetable).where(
-                Timetable.school_id == school_id,
-                Timetable.base_timetable_id == base_timetable_id,
-                Timetable.substitute_for_date == substitute_date,
-                Timetable.is_primary == 0
-            )
-        )
-        return result.scalar_one_or_none()
-    
-    async def _delete_substitute_timetable(self, timetable_id: int):
-        """Delete a substitute timetable and its entries"""
-        # Delete entries first
-        result = await self.db.execute(
-            select(TimetableEntry).where(TimetableEntry.timetable_id == timetable_id)
-        )
-        entries = result.scalars().all()
-        for entry in entries:
-            await self.entry_repo.delete(entry.id)
-        
-        # Delete timetable
-        await self.timetable_repo.delete(timetable_id)
-    
-    async def _get_absences_for_date(self, school_id: int, target_date: date) -> List[TeacherAbsence]:
-        """Get all teacher absences that cover the target date"""
-        from app.models.absence import TeacherAbsence
-        result = await self.db.execute(
-            select(TeacherAbsence).where(
-                TeacherAbsence.school_id == school_id,
-                TeacherAbsence.date_from <= target_date,
-                TeacherAbsence.date_to >= target_date
-            )
-        )
-        return list(result.scalars().all())
-    
-    async def _find_substitute_teacher(
+    def _substitute_candidates(
         self,
         entry: TimetableEntry,
         absent_teacher_id: int,
-        teachers: List[Teacher],
+        capability_index: CapabilityIndex,
         target_date: date,
         existing_entries: List[TimetableEntry],
-        teacher_hours: Dict[int, int]
-    ) -> Optional[Teacher]:
-        """Find a substitute teacher for an entry, following all rules except primary teacher assignment"""
-        day_names = ["monday", "tuesday", "wednesday", "thursday", "friday"]
-        day_name = day_names[entry.day_of_week]
+        teacher_hours: Dict[int, int],
+        absence_index: AbsenceIndex
+    ) -> List[Teacher]:
+        """Teachers who may substitute an entry, following all rules except primary teacher assignment"""
+        day_name = DAY_NAMES[entry.day_of_week]
         
-        for teacher in teachers:
+        candidates = []
+        # Only teachers who can teach this subject
+        for teacher in capability_index.candidates(entry.subject_id):
             if teacher.id == absent_teacher_id:
                 continue
             
-            # Check if teacher can teach this subject
-            can_teach = False
-            for capability in teacher.capabilities:
-                if capability.subject_id == entry.subject_id:
-                    can_teach = True
-                    break
-            
-            if not can_teach:
-                continue
-            
             # Check availability
             if teacher.availability:
                 available_hours = teacher.availability.get(day_name, [])
@@ -297,8 +577,7 @@ class SubstituteTimetableService:
                 continue
             
             # Check if teacher is absent on this date
-            teacher_absences = await self._get_absences_for_date(teacher.school_id, target_date)
-            if any(a.teacher_id == teacher.id for a in teacher_absences):
+            if absence_index.is_absent(teacher.id, target_date):
                 continue
             
             # Check weekly hours limit
@@ -306,9 +585,95 @@ class SubstituteTimetableService:
             if current_hours >= teacher.max_weekly_hours:
                 continue
             
-            return teacher
+            candidates.append(teacher)
         
-        return None
+        return candidates
+    
+    def _substitute_cost(
+        self,
+        teacher: Teacher,
+        entry: TimetableEntry,
+        capability_index: CapabilityIndex,
+        teacher_hours: Dict[int, int],
+        grade_level_id: Optional[int]
+    ) -> float:
+        """Cost of a substitute for an entry, as in SubstitutionService"""
+        level, primary = capability_index.fit(teacher.id, entry.subject_id, entry.class_group_id, grade_level_id)
+        return (
+            LOAD_COST * teacher_hours.get(teacher.id, 0) / max(teacher.max_weekly_hours, 1) +
+            FIT_COST * level +
+            (0 if primary else NON_PRIMARY_COST)
+        )
+    
+    async def _find_substitute_teacher(
+        self,
+        entry: TimetableEntry,
+        absent_teacher_id: int,
+        capability_index: CapabilityIndex,
+        target_date: date,
+        existing_entries: List[TimetableEntry],
+        teacher_hours: Dict[int, int],
+        absence_index: AbsenceIndex,
+        grade_level_id: Optional[int] = None
+    ) -> Optional[Teacher]:
+        """The cheapest substitute teacher for a single entry"""
+        candidates = self._substitute_candidates(
+            entry, absent_teacher_id, capability_index, target_date, existing_entries, teacher_hours, absence_index
+        )
+        if not candidates:
+            return None
+        return min(candidates, key=lambda t: self._substitute_cost(
+            t, entry, capability_index, teacher_hours, grade_level_id
+        ))
+    
+    def _match_substitutes(
+        self,
+        lessons: List[TimetableEntry],
+        capability_index: CapabilityIndex,
+        target_date: date,
+        existing_entries: List[TimetableEntry],
+        teacher_hours: Dict[int, int],
+        absence_index: AbsenceIndex,
+        grade_levels: Dict[int, Optional[int]]
+    ) -> Dict[int, Teacher]:
+        """Assign substitutes to the lessons of absent teachers on one date as a min-cost matching
+        per time slot (see SubstitutionService._assign_substitutes). Returns the teacher per
+        position in lessons, lessons that stay uncovered are missing. Updates teacher_hours."""
+        slots: Dict[Tuple[int, int], List[int]] = {}
+        for position, lesson in enumerate(lessons):
+            slots.setdefault((lesson.day_of_week, lesson.lesson_index), []).append(position)
+        
+        assigned: Dict[int, Teacher] = {}
+        for _, positions in sorted(slots.items()):
+            columns: Dict[int, int] = {}
+            teachers: List[Teacher] = []
+            candidate_costs: List[Dict[int, float]] = []
+            for position in positions:
+                lesson = lessons[position]
+                costs: Dict[int, float] = {}
+                for teacher in self._substitute_candidates(
+                    lesson, lesson.teacher_id, capability_index, target_date, existing_entries,
+                    teacher_hours, absence_index
+                ):
+                    if teacher.id not in columns:
+                        columns[teacher.id] = len(teachers)
+                        teachers.append(teacher)
+                    costs[columns[teacher.id]] = self._substitute_cost(
+                        teacher, lesson, capability_index, teacher_hours, grade_levels.get(lesson.class_group_id)
+                    )
+                candidate_costs.append(costs)
+            if not teachers:
+                continue
+            
+            matrix = [[costs.get(col) for col in range(len(teachers))] for costs in candidate_costs]
+            for position, col in zip(positions, assign(matrix)):
+                if col is None:
+                    continue
+                teacher = teachers[col]
+                assigned[position] = teacher
+                teacher_hours[teacher.id] = teacher_hours.get(teacher.id, 0) + 1
+        
+        return assigned
     
     async def _find_suitable_classroom(
         self,
@@ -419,20 +784,19 @@ class SubstituteTimetableService:
         class_group: ClassGroup,
         class_entries: List[TimetableEntry],
         subjects_dict: Dict[int, Subject],
-        teachers: List[Teacher],
+        capability_index: CapabilityIndex,
         classrooms: List[Classroom],
-        absences: List[TeacherAbsence],
+        absence_index: AbsenceIndex,
         substitute_date: date,
         day_of_week: int,
         max_lessons_per_day: int,
         lunch_slots: Set[int],
         teacher_hours: Dict[int, int],
-        existing_entries: List[TimetableEntry],
-        timetable_id: int
+        existing_entries: List[TimetableEntry]
     ) -> Optional[List[TimetableEntry]]:
-        """Try to rearrange lessons within a day for a class, ensuring all subjects are still taught"""
-        from itertools import permutations
-        
+        """Try to rearrange lessons within a day for a class, ensuring all subjects are still taught.
+        Teachers, substitutes and classrooms are resolved once per lesson and slot, then the
+        arrangement itself is an in-memory search (see app.solver.rearrange)."""
         # Get available lesson indices (excluding lunch slots)
         available_indices = [i for i in range(1, max_lessons_per_day + 1) if i not in lunch_slots]
         
@@ -446,129 +810,79 @@ class SubstituteTimetableService:
             if subject:
                 lessons_to_place.append((entry, subject))
         
-        # Try different arrangements using async backtracking
-        async def can_place_lesson(entry: TimetableEntry, subject: Subject, lesson_index: int, 
-                           placed: List[Tuple[TimetableEntry, int]]) -> Tuple[bool, Optional[Teacher], Optional[Classroom]]:
-            """Check if a lesson can be placed at a specific index and return teacher/classroom"""
-            # Check if slot is already taken
-            if any(li == lesson_index for _, li in placed):
-                return False, None, None
-            
-            # Check subject constraints
-            placed_indices = [li for _, li in placed]
-            if not self._check_subject_constraints_for_rearrangement(
-                subject, class_group.id, lesson_index, placed_indices
-            ):
-                return False, None, None
-            
-            # Check if original teacher is absent
-            absent_teacher_id = None
-            for absence in absences:
-                if absence.teacher_id == entry.teacher_id:
-                    absent_teacher_id = absence.teacher_id
-                    break
-            
-            # Find teacher
-            teacher_id = entry.teacher_id
-            if absent_teacher_id:
-                # Need substitute teacher
-                # Create a temporary entry for checking
-                temp_entry = TimetableEntry(
-                    timetable_id=timetable_id,
-                    class_group_id=entry.class_group_id,
-                    subject_id=entry.subject_id,
-                    teacher_id=entry.teacher_id,
-                    classroom_id=entry.classroom_id,
-                    day_of_week=day_of_week,
-                    lesson_index=lesson_index
-                )
-                substitute_teacher = await self._find_substitute_teacher(
-                    temp_entry, absent_teacher_id, teachers, substitute_date,
-                    existing_entries + [TimetableEntry(
-                        timetable_id=timetable_id,
-                        class_group_id=e.class_group_id,
-                        subject_id=e.subject_id,
-                        teacher_id=e.teacher_id,
-                        classroom_id=e.classroom_id,
-                        day_of_week=day_of_week,
-                        lesson_index=li
-                    ) for e, li in placed],
-                    teacher_hours
-                )
-                if not substitute_teacher:
-                    return False, None, None
-                teacher_id = substitute_teacher.id
+        # Occupancy of the other classes on this day
+        day_entries = [e for e in existing_entries if e.day_of_week == day_of_week]
+        busy_teachers = {(e.teacher_id, e.lesson_index) for e in day_entries}
+        absent_teacher_ids = absence_index.absent_teachers(substitute_date)
+        day_name = DAY_NAMES[day_of_week]
+        teachers_by_id = capability_index.teachers
+        
+        def is_available(teacher: Teacher, lesson_index: int) -> bool:
+            if teacher.availability:
+                available_hours = teacher.availability.get(day_name, [])
+                if available_hours and lesson_index not in available_hours:
+                    return False
+            return True
+        
+        # Teacher (original or cheapest suitable substitute) per (subject, teacher, slot)
+        teacher_cache: Dict[Tuple[int, int, int], Optional[Teacher]] = {}
+        
+        def teacher_for(entry: TimetableEntry, lesson_index: int) -> Optional[Teacher]:
+            key = (entry.subject_id, entry.teacher_id, lesson_index)
+            if key in teacher_cache:
+                return teacher_cache[key]
+            teacher = None
+            if entry.teacher_id in absent_teacher_ids:
+                candidates = [
+                    candidate for candidate in capability_index.candidates(entry.subject_id)
+                    if candidate.id != entry.teacher_id and candidate.id not in absent_teacher_ids
+                    and is_available(candidate, lesson_index) and (candidate.id, lesson_index) not in busy_teachers
+                    and teacher_hours.get(candidate.id, 0) < candidate.max_weekly_hours
+                ]
+                if candidates:
+                    teacher = min(candidates, key=lambda t: self._substitute_cost(
+                        t, entry, capability_index, teacher_hours, class_group.grade_level_id
+                    ))
             else:
-                # Check if original teacher is available at this time
-                if any(e.teacher_id == teacher_id and e.day_of_week == day_of_week 
-                      and e.lesson_index == lesson_index for e in existing_entries):
-                    return False, None, None
-                
-                # Check teacher availability
-                day_names = ["monday", "tuesday", "wednesday", "thursday", "friday"]
-                day_name = day_names[day_of_week]
-                teacher = next((t for t in teachers if t.id == teacher_id), None)
-                if teacher and teacher.availability:
-                    available_hours = teacher.availability.get(day_name, [])
-                    if available_hours and lesson_index not in available_hours:
-                        return False, None, None
-            
-            # Find classroom
-            placed_entries_for_check = existing_entries + [
-                TimetableEntry(
-                    timetable_id=timetable_id,
-                    class_group_id=e.class_group_id,
-                    subject_id=e.subject_id,
-                    teacher_id=e.teacher_id,
-                    classroom_id=e.classroom_id,
-                    day_of_week=day_of_week,
-                    lesson_index=li
-                ) for e, li in placed
-            ]
-            classroom = await self._find_suitable_classroom(
-                subject, class_group, day_of_week, lesson_index, classrooms, placed_entries_for_check
-            )
-            
-            return True, next((t for t in teachers if t.id == teacher_id), None), classroom
-        
-        # Async backtracking to find valid arrangement
-        async def backtrack(remaining: List[Tuple[TimetableEntry, Subject]], 
-                     placed: List[Tuple[TimetableEntry, int]]) -> Optional[List[Tuple[TimetableEntry, int, Teacher, Optional[Classroom]]]]:
-            if not remaining:
-                return [(e, li, next((t for t in teachers if t.id == e.teacher_id), None), None) 
-                        for e, li in placed]
-            
-            entry, subject = remaining[0]
+                original = teachers_by_id.get(entry.teacher_id)
+                if (entry.teacher_id, lesson_index) not in busy_teachers and \
+                        (original is None or is_available(original, lesson_index)):
+                    teacher = original
+            teacher_cache[key] = teacher
+            return teacher
+        
+        # Candidate slots per lesson, with the teacher and classroom to use there
+        candidates: List[List[int]] = []
+        assignments: List[Dict[int, Tuple[Teacher, Optional[Classroom]]]] = []
+        classroom_cache: Dict[Tuple[int, int], Optional[Classroom]] = {}
+        for entry, subject in lessons_to_place:
+            options: Dict[int, Tuple[Teacher, Optional[Classroom]]] = {}
             for lesson_index in available_indices:
-                if any(li == lesson_index for _, li in placed):
+                teacher = teacher_for(entry, lesson_index)
+                if not teacher:
                     continue
-                
-                can_place, teacher, classroom = await can_place_lesson(entry, subject, lesson_index, placed)
-                if can_place:
-                    new_placed = placed + [(entry, lesson_index)]
-                    result = await backtrack(remaining[1:], new_placed)
-                    if result:
-                        # Update teacher and classroom in result
-                        for i, (e, li, t, c) in enumerate(result):
-                            if e.id == entry.id:
-                                result[i] = (e, li, teacher, classroom)
-                                break
-                        return result
-            
-            return None
+                room_key = (subject.id, lesson_index)
+                if room_key not in classroom_cache:
+                    classroom_cache[room_key] = await self._find_suitable_classroom(
+                        subject, class_group, day_of_week, lesson_index, classrooms, day_entries
+                    )
+                options[lesson_index] = (teacher, classroom_cache[room_key])
+            if not options:
+                return None
+            candidates.append(list(options))
+            assignments.append(options)
         
-        result = await backtrack(lessons_to_place, [])
-        if not result:
+        arrangement = rearrange_day(
+            candidates, [not subject.allow_consecutive_hours for _, subject in lessons_to_place]
+        )
+        if arrangement is None:
             return None
         
         # Create entries from result
         entries = []
-        for entry, lesson_index, teacher, classroom in result:
-            if not teacher:
-                return None  # Should not happen
-            
+        for (entry, _), options, lesson_index in zip(lessons_to_place, assignments, arrangement):
+            teacher, classroom = options[lesson_index]
             new_entry = TimetableEntry(
-                timetable_id=timetable_id,
                 class_group_id=entry.class_group_id,
                 subject_id=entry.subject_id,
                 teacher_id=teacher.id,
@@ -604,15 +918,14 @@ class SubstituteTimetableService:
         class_group: ClassGroup,
         class_entries: List[TimetableEntry],
         subjects_dict: Dict[int, Subject],
-        teachers: List[Teacher],
+        capability_index: CapabilityIndex,
         classrooms: List[Classroom],
-        absences: List[TeacherAbsence],
+        absence_index: AbsenceIndex,
         available_days: List[Tuple[int, date]],
         max_lessons_per_day: int,
         lunch_hours: Dict[int, Dict[int, List[int]]],
         teacher_hours: Dict[int, int],
         existing_entries: List[TimetableEntry],
-        timetable_id: int,
         base_entries: List[TimetableEntry]
     ) -> Optional[List[TimetableEntry]]:
         """Try to move a class's lessons to other days in the week"""
@@ -620,7 +933,6 @@ class SubstituteTimetableService:
             return None
         
         moved_entries = []
-        school_id = class_group.school_id
         
         for entry in class_entries:
             subject = subjects_dict.get(entry.subject_id)
@@ -635,12 +947,7 @@ class SubstituteTimetableService:
                 available_indices = [i for i in range(1, max_lessons_per_day + 1) if i not in class_lunch_slots]
                 
                 # Check if original teacher is absent on this day
-                day_absences = await self._get_absences_for_date(school_id, check_date)
-                absent_teacher_id = None
-                for absence in day_absences:
-                    if absence.teacher_id == entry.teacher_id:
-                        absent_teacher_id = absence.teacher_id
-                        break
+                absent_teacher_id = entry.teacher_id if absence_index.is_absent(entry.teacher_id, check_date) else None
                 
                 # Try to find a slot for this lesson
                 for lesson_index in available_indices:
@@ -653,7 +960,6 @@ class SubstituteTimetableService:
                     teacher_id = entry.teacher_id
                     if absent_teacher_id:
                         temp_entry = TimetableEntry(
-                            timetable_id=timetable_id,
                             class_group_id=entry.class_group_id,
                             subject_id=entry.subject_id,
                             teacher_id=entry.teacher_id,
@@ -662,8 +968,9 @@ class SubstituteTimetableService:
                             lesson_index=lesson_index
                         )
                         substitute_teacher = await self._find_substitute_teacher(
-                            temp_entry, absent_teacher_id, teachers, check_date,
-                            existing_entries + moved_entries, teacher_hours
+                            temp_entry, absent_teacher_id, capability_index, check_date,
+                            existing_entries + moved_entries, teacher_hours, absence_index,
+                            class_group.grade_level_id
                         )
                         if not substitute_teacher:
                             continue
@@ -673,10 +980,8 @@ class SubstituteTimetableService:
                         if any(e.teacher_id == teacher_id and e.day_of_week == day 
                               and e.lesson_index == lesson_index for e in existing_entries + moved_entries):
                             continue
-                        
-                        day_names = ["monday", "tuesday", "wednesday", "thursday", "friday"]
-                        day_name = day_names[day]
-                        teacher = next((t for t in teachers if t.id == teacher_id), None)
+                        day_name = DAY_NAMES[day]
+                        teacher = capability_index.teachers.get(teacher_id)
                         if teacher and teacher.availability:
                             available_hours = teacher.availability.get(day_name, [])
                             if available_hours and lesson_index not in available_hours:
@@ -698,7 +1003,6 @@ class SubstituteTimetableService:
                     
                     # Create entry
                     new_entry = TimetableEntry(
-                        timetable_id=timetable_id,
                         class_group_id=entry.class_group_id,
                         subject_id=entry.subject_id,
                         teacher_id=teacher_id,
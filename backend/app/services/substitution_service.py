@@ -1,13 +1,24 @@
-from typing import List, Optional
-from datetime import date
+from typing import List, Optional, Dict, Tuple
+from datetime import date, timedelta
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.absence import TeacherAbsence, Substitution, SubstitutionStatus
 from app.models.timetable import TimetableEntry
 from app.models.teacher import Teacher
+from app.repositories.base_repository import unit_of_work
 from app.repositories.absence_repository import TeacherAbsenceRepository, SubstitutionRepository
 from app.repositories.timetable_repository import TimetableEntryRepository
 from app.repositories.teacher_repository import TeacherRepository
+from app.repositories.class_group_repository import ClassGroupRepository
 from app.services.timetable_validation_service import TimetableValidationService
+from app.services.absence_index import AbsenceIndex
+from app.services.capability_index import CapabilityIndex
+from app.solver.engine import DAY_NAMES
+from app.solver.matching import assign
+
+# Substitute preference costs (lower is better)
+LOAD_COST = 10.0  # times the share of the weekly hours the teacher already teaches
+FIT_COST = 1.0  # per step from a class-specific to a grade-level, general or other-class capability
+NON_PRIMARY_COST = 1.0  # teacher is not a primary teacher of the subject
 
 class SubstitutionService:
     def __init__(self, db: AsyncSession):
@@ -16,6 +27,7 @@ class SubstitutionService:
         self.substitution_repo = SubstitutionRepository(db)
         self.entry_repo = TimetableEntryRepository(db)
         self.teacher_repo = TeacherRepository(db)
+        self.class_repo = ClassGroupRepository(db)
         self.validation_service = TimetableValidationService(db)
     
     async def generate_substitutions(
@@ -28,72 +40,196 @@ class SubstitutionService:
         if not absence or absence.school_id != school_id:
             raise ValueError("Absence not found")
         
-        # Find affected timetable entries
-        affected_entries = await self._find_affected_entries(absence)
+        return await self._generate_for_absences(school_id, [absence])
+    
+    async def generate_substitutions_bulk(
+        self,
+        school_id: int,
+        absence_ids: Optional[List[int]] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None
+    ) -> List[Substitution]:
+        """Generate substitutions for several absences at once: the given ones, or all absences
+        overlapping [date_from, date_to]. A substitute covers at most one lesson held on the same
+        date and lesson index across all of them."""
+        if absence_ids:
+            absences = [await self.absence_repo.get_by_id(absence_id) for absence_id in dict.fromkeys(absence_ids)]
+            if any(not absence or absence.school_id != school_id for absence in absences):
+                raise ValueError("Absence not found")
+        elif date_from and date_to:
+            if date_to < date_from:
+                raise ValueError("date_to must not be before date_from")
+            absences = await self.absence_repo.get_overlapping(school_id, date_from, date_to)
+        else:
+            raise ValueError("Either absence_ids or date_from and date_to are required")
         
-        substitutions: List[Substitution] = []
+        return await self._generate_for_absences(school_id, absences)
+    
+    async def _generate_for_absences(
+        self,
+        school_id: int,
+        absences: List[TeacherAbsence]
+    ) -> List[Substitution]:
+        """Assign substitutes to the lessons of all absences together and save them in one insert"""
+        if not absences:
+            return []
         
-        for entry in affected_entries:
-            # Try to find a substitute teacher
-            substitute_teacher = await self._find_substitute_teacher(entry, absence)
-            
-            substitution = Substitution(
-                school_id=school_id,
-                timetable_entry_id=entry.id,
-                original_teacher_id=absence.teacher_id,
-                substitute_teacher_id=substitute_teacher.id if substitute_teacher else None,
-                status=SubstitutionStatus.AUTO_GENERATED if substitute_teacher else SubstitutionStatus.AUTO_GENERATED
-            )
-            substitution = await self.substitution_repo.create(substitution)
-            substitutions.append(substitution)
+        # Find affected timetable entries (each lesson once, for the first absence covering it)
+        affected: Dict[int, Tuple[TimetableEntry, TeacherAbsence]] = {}
+        for absence in absences:
+            for entry in await self._find_affected_entries(absence):
+                affected.setdefault(entry.id, (entry, absence))
+        if not affected:
+            return []
+        
+        # Other absences during these ones and the qualified teachers, loaded once for all entries
+        absence_index = AbsenceIndex(await self.absence_repo.get_overlapping(
+            school_id, min(a.date_from for a in absences), max(a.date_to for a in absences)
+        ))
+        capability_index = CapabilityIndex(await self.teacher_repo.get_by_school_id(school_id))
+        
+        classes = await self.class_repo.get_by_school_id(school_id)
+        grade_levels = {c.id: c.grade_level_id for c in classes}
         
-        return substitutions
+        # Choose substitutes for all affected lessons together
+        assigned = await self._assign_substitutes(
+            list(affected.values()), absence_index, capability_index, grade_levels
+        )
+        
+        rows = [
+            {
+                "school_id": school_id,
+                "timetable_entry_id": entry.id,
+                "original_teacher_id": absence.teacher_id,
+                "substitute_teacher_id": assigned[entry.id].id if entry.id in assigned else None,
+                "status": SubstitutionStatus.AUTO_GENERATED
+            }
+            for entry, absence in affected.values()
+        ]
+        async with unit_of_work(self.db):
+            return await self.substitution_repo.create_many(rows)
     
     async def _find_affected_entries(self, absence: TeacherAbsence) -> List[TimetableEntry]:
-        """Find timetable entries affected by the absence"""
-        # Get all entries for this teacher
-        all_entries = await self.entry_repo.get_by_teacher_and_date_range(
-            absence.teacher_id, absence.date_from, absence.date_to
+        """Find timetable entries affected by the absence (lessons held on one of its dates)"""
+        return await self.entry_repo.get_by_teacher_and_date_range(
+            absence.school_id, absence.teacher_id, absence.date_from, absence.date_to
         )
+    
+    async def _assign_substitutes(
+        self,
+        entries: List[Tuple[TimetableEntry, TeacherAbsence]],
+        absence_index: AbsenceIndex,
+        capability_index: CapabilityIndex,
+        grade_levels: Dict[int, Optional[int]]
+    ) -> Dict[int, Teacher]:
+        """Assign substitutes to lessons (each with the absence it is affected by) as a min-cost
+        matching per time slot: a teacher covers at most one lesson of a slot, as many lessons as
+        possible are covered and among those the assignment prefers lightly loaded, specifically
+        qualified and primary teachers. Slots are (date, lesson index) pairs, lessons held in a
+        common slot (on any of their dates) are matched together. Slots are processed in order,
+        so the load includes the lessons assigned before."""
+        # Lessons sharing a (date, lesson_index) slot end up in the same group
+        group_of: List[int] = list(range(len(entries)))
+        
+        def find(i: int) -> int:
+            while group_of[i] != i:
+                group_of[i] = group_of[group_of[i]]
+                i = group_of[i]
+            return i
+        
+        first_in_slot: Dict[Tuple[date, int], int] = {}
+        lesson_slots: List[List[Tuple[date, int]]] = []
+        for i, (entry, absence) in enumerate(entries):
+            keys = [(d, entry.lesson_index) for d in self._lesson_dates(entry, absence)]
+            lesson_slots.append(keys)
+            for key in keys:
+                if key in first_in_slot:
+                    group_of[find(i)] = find(first_in_slot[key])
+                else:
+                    first_in_slot[key] = i
+        groups: Dict[int, List[int]] = {}
+        for i in range(len(entries)):
+            groups.setdefault(find(i), []).append(i)
+        
+        if not groups:
+            return {}
         
-        # Filter entries that fall within the absence period
-        # This is simplified - would need proper date-to-day-of-week mapping
-        # In a real implementation, we'd:
-        # 1. Get all timetables for the school
-        # 2. Map absence dates to day_of_week
-        # 3. Filter entries by matching day_of_week and date range
-        affected = []
-        for entry in all_entries:
-            # For now, return all entries for this teacher
-            # TODO: Implement proper date-to-day-of-week mapping
-            affected.append(entry)
+        # Teachers busy per slot and lessons per teacher, for the affected timetables and days only
+        timetable_ids = {entry.timetable_id for entry, _ in entries}
+        busy_teachers = await self.entry_repo.get_busy_teachers(timetable_ids, {entry.day_of_week for entry, _ in entries})
+        teacher_hours = await self.entry_repo.count_by_teacher(timetable_ids)
+        assigned: Dict[int, Teacher] = {}
+        ordered = sorted(groups.values(), key=lambda members: min(
+            (key for i in members for key in lesson_slots[i]), default=(date.max, 0)
+        ))
+        for members in ordered:
+            columns: Dict[int, int] = {}
+            teachers: List[Teacher] = []
+            candidate_costs: List[Dict[int, float]] = []
+            for i in members:
+                entry, absence = entries[i]
+                busy = busy_teachers.get((entry.timetable_id, entry.day_of_week, entry.lesson_index), set())
+                costs: Dict[int, float] = {}
+                for teacher in self._substitute_candidates(entry, absence, absence_index, capability_index):
+                    if teacher.id in busy:
+                        continue
+                    hours = teacher_hours.get((entry.timetable_id, teacher.id), 0)
+                    if hours >= teacher.max_weekly_hours:
+                        continue
+                    if teacher.id not in columns:
+                        columns[teacher.id] = len(teachers)
+                        teachers.append(teacher)
+                    level, primary = capability_index.fit(
+                        teacher.id, entry.subject_id, entry.class_group_id, grade_levels.get(entry.class_group_id)
+                    )
+                    costs[columns[teacher.id]] = (
+                        LOAD_COST * hours / max(teacher.max_weekly_hours, 1) +
+                        FIT_COST * level +
+                        (0 if primary else NON_PRIMARY_COST)
+                    )
+                candidate_costs.append(costs)
+            if not teachers:
+                continue
+            
+            matrix = [[costs.get(col) for col in range(len(teachers))] for costs in candidate_costs]
+            for i, col in zip(members, assign(matrix)):
+                if col is None:
+                    continue
+                entry = entries[i][0]
+                teacher = teachers[col]
+                assigned[entry.id] = teacher
+                key = (entry.timetable_id, teacher.id)
+                teacher_hours[key] = teacher_hours.get(key, 0) + 1
         
-        return affected
+        return assigned
     
-    async def _find_substitute_teacher(
+    def _lesson_dates(self, entry: TimetableEntry, absence: TeacherAbsence) -> List[date]:
+        """Dates of the absence on which a lesson takes place"""
+        first = absence.date_from + timedelta(days=(entry.day_of_week - absence.date_from.weekday()) % 7)
+        if first > absence.date_to:
+            return []
+        return [first + timedelta(weeks=w) for w in range((absence.date_to - first).days // 7 + 1)]
+    
+    def _substitute_candidates(
         self,
         entry: TimetableEntry,
-        absence: TeacherAbsence
-    ) -> Optional[Teacher]:
-        """Find a suitable substitute teacher"""
-        # Get all teachers for this school
-        teachers = await self.teacher_repo.get_by_school_id(entry.timetable.school_id)
+        absence: TeacherAbsence,
+        absence_index: AbsenceIndex,
+        capability_index: CapabilityIndex
+    ) -> List[Teacher]:
+        """Teachers who can teach the lesson, are present and available at its time"""
+        day_name = DAY_NAMES[entry.day_of_week]
         
-        day_names = ["monday", "tuesday", "wednesday", "thursday", "friday"]
-        day_name = day_names[entry.day_of_week]
+        lesson_dates = self._lesson_dates(entry, absence)
         
-        for teacher in teachers:
+        candidates = []
+        # Only teachers who can teach this subject
+        for teacher in capability_index.candidates(entry.subject_id):
             if teacher.id == absence.teacher_id:
                 continue
             
-            # Check if teacher can teach this subject
-            can_teach = False
-            for capability in teacher.capabilities:
-                if capability.subject_id == entry.subject_id:
-                    can_teach = True
-                    break
-            
-            if not can_teach:
+            # Check if teacher is absent when the lesson takes place
+            if any(absence_index.is_absent(teacher.id, d) for d in lesson_dates):
                 continue
             
             # Check availability
@@ -102,18 +238,6 @@ class SubstitutionService:
                 if entry.lesson_index not in available_hours:
                     continue
             
-            # Check if already busy
-            existing_entries = await self.entry_repo.get_by_timetable_id(entry.timetable_id)
-            if any(e.teacher_id == teacher.id and e.day_of_week == entry.day_of_week 
-                   and e.lesson_index == entry.lesson_index for e in existing_entries):
-                continue
-            
-            # Check weekly hours
-            teacher_hours = sum(1 for e in existing_entries if e.teacher_id == teacher.id)
-            if teacher_hours >= teacher.max_weekly_hours:
-                continue
-            
-            return teacher
+            candidates.append(teacher)
         
-        return None
-
+        return candidates
@@ -1,12 +1,22 @@
-from typing import List, Dict
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.timetable import TimetableEntry
-from app.models.subject import Subject
+from app.models.subject import Subject, ClassSubjectAllocation
 from app.models.teacher import Teacher
 from app.models.class_group import ClassGroup
-from app.models.school import SchoolSettings
+from app.models.classroom import Classroom
+from app.models.school import School, SchoolSettings
 from app.repositories.timetable_repository import TimetableEntryRepository
 from app.repositories.school_repository import SchoolSettingsRepository
+from app.solver.constraints import check_constraints
+from app.solver.engine import DAY_NAMES
+from app.services.incremental_validation import IncrementalValidator, cache_validator, cached_validator
+
+# (timetable_id, timetable version, school data version) -> errors of recent validations
+VALIDATION_CACHE_SIZE = 128
+_results: "OrderedDict[Tuple[int, int, int], List[ValidationError]]" = OrderedDict()
 
 class ValidationError:
     def __init__(self, type: str, message: str, entry_id: int = None):
@@ -21,7 +31,30 @@ class TimetableValidationService:
         self.settings_repo = SchoolSettingsRepository(db)
     
     async def validate_timetable(self, timetable_id: int) -> List[ValidationError]:
-        """Validate all constraints for a timetable"""
+        """Validate all constraints for a timetable. Results are cached per timetable version
+        and school data version, so repeated validation of an unchanged timetable is a lookup."""
+        from app.models.timetable import Timetable
+        result = await self.db.execute(
+            select(Timetable.version, School.data_version)
+            .join(School, School.id == Timetable.school_id)
+            .where(Timetable.id == timetable_id)
+        )
+        versions = result.one_or_none()
+        if versions is None:
+            return []
+        key = (timetable_id, *versions)
+        cached = _results.get(key)
+        if cached is not None:
+            _results.move_to_end(key)
+            return list(cached)
+        
+        errors = await self._validate(timetable_id)
+        _results[key] = errors
+        if len(_results) > VALIDATION_CACHE_SIZE:
+            _results.popitem(last=False)
+        return list(errors)
+    
+    async def _validate(self, timetable_id: int) -> List[ValidationError]:
         errors: List[ValidationError] = []
         entries = await self.entry_repo.get_by_timetable_id(timetable_id)
         
@@ -29,7 +62,6 @@ class TimetableValidationService:
             return errors
         
         # Get school_id from timetable directly
-        from sqlalchemy import select
         from app.models.timetable import Timetable
         result = await self.db.execute(select(Timetable).where(Timetable.id == timetable_id))
         timetable = result.scalar_one_or_none()
@@ -39,103 +71,69 @@ class TimetableValidationService:
         school_id = timetable.school_id
         settings = await self.settings_repo.get_by_school_id(school_id)
         
-        # Group entries by various dimensions for validation
-        teacher_entries: Dict[int, List[TimetableEntry]] = {}
-        class_entries: Dict[int, List[TimetableEntry]] = {}
-        classroom_entries: Dict[int, List[TimetableEntry]] = {}
         teacher_hours: Dict[int, int] = {}
-        class_subject_hours: Dict[tuple, int] = {}  # (class_id, subject_id) -> hours
+        # Lesson indices per (class, day, subject)
+        subject_days: Dict[Tuple[int, int, int], List[int]] = {}
         
         for entry in entries:
-            # Group by teacher
-            if entry.teacher_id not in teacher_entries:
-                teacher_entries[entry.teacher_id] = []
-            teacher_entries[entry.teacher_id].append(entry)
-            
-            # Group by class
-            if entry.class_group_id not in class_entries:
-                class_entries[entry.class_group_id] = []
-            class_entries[entry.class_group_id].append(entry)
-            
-            # Group by classroom
-            if entry.classroom_id:
-                if entry.classroom_id not in classroom_entries:
-                    classroom_entries[entry.classroom_id] = []
-                classroom_entries[entry.classroom_id].append(entry)
-            
             # Count teacher hours
             teacher_hours[entry.teacher_id] = teacher_hours.get(entry.teacher_id, 0) + 1
             
-            # Count class-subject hours
-            key = (entry.class_group_id, entry.subject_id)
-            class_subject_hours[key] = class_subject_hours.get(key, 0) + 1
+            subject_days.setdefault((entry.class_group_id, entry.day_of_week, entry.subject_id), []).append(entry.lesson_index)
         
-        # Validate: No teacher has two lessons simultaneously
-        for teacher_id, teacher_entries_list in teacher_entries.items():
-            for i, entry1 in enumerate(teacher_entries_list):
-                for entry2 in teacher_entries_list[i+1:]:
-                    if (entry1.day_of_week == entry2.day_of_week and 
-                        entry1.lesson_index == entry2.lesson_index):
-                        errors.append(ValidationError(
-                            "teacher_conflict",
-                            f"Teacher {entry1.teacher.full_name} has two lessons at the same time",
-                            entry1.id
-                        ))
+        # Validate: No teacher, class or classroom has two lessons simultaneously.
+        # Every pair of lessons in a slot is a conflict reported on the earlier lesson.
+        errors.extend(_slot_conflicts(
+            entries, lambda e: e.teacher_id,
+            "teacher_conflict", lambda e: f"Teacher {e.teacher.full_name} has two lessons at the same time"
+        ))
+        errors.extend(_slot_conflicts(
+            entries, lambda e: e.class_group_id,
+            "class_conflict", lambda e: f"Class {e.class_group.name} has two lessons at the same time"
+        ))
+        errors.extend(_slot_conflicts(
+            [e for e in entries if e.classroom_id], lambda e: e.classroom_id,
+            "classroom_conflict", lambda e: f"Classroom {e.classroom.name} has two lessons at the same time"
+        ))
         
-        # Validate: No class has two lessons simultaneously
-        for class_id, class_entries_list in class_entries.items():
-            for i, entry1 in enumerate(class_entries_list):
-                for entry2 in class_entries_list[i+1:]:
-                    if (entry1.day_of_week == entry2.day_of_week and 
-                        entry1.lesson_index == entry2.lesson_index):
-                        errors.append(ValidationError(
-                            "class_conflict",
-                            f"Class {entry1.class_group.name} has two lessons at the same time",
-                            entry1.id
-                        ))
-        
-        # Validate: No classroom has two lessons simultaneously
-        for classroom_id, classroom_entries_list in classroom_entries.items():
-            for i, entry1 in enumerate(classroom_entries_list):
-                for entry2 in classroom_entries_list[i+1:]:
-                    if (entry1.day_of_week == entry2.day_of_week and 
-                        entry1.lesson_index == entry2.lesson_index):
-                        errors.append(ValidationError(
-                            "classroom_conflict",
-                            f"Classroom {entry1.classroom.name} has two lessons at the same time",
-                            entry1.id
-                        ))
+        # Referenced teachers, subjects, classes, classrooms and allocations, one query each
+        teachers = await self._load_by_ids(Teacher, teacher_hours)
+        subjects = await self._load_by_ids(Subject, {key[2] for key in subject_days})
+        classes = await self._load_by_ids(ClassGroup, {key[0] for key in subject_days})
+        classrooms = await self._load_by_ids(Classroom, {e.classroom_id for e in entries if e.classroom_id})
+        allocations = await self._load_allocations(classes)
+        # Allocations override whether a subject may occur more than once a day
+        allow_multiple = {(a.class_group_id, a.subject_id): a.allow_multiple_in_one_day for a in allocations}
         
         # Validate: Teacher max weekly hours
         for teacher_id, hours in teacher_hours.items():
-            from sqlalchemy import select
-            result = await self.db.execute(select(Teacher).where(Teacher.id == teacher_id))
-            teacher = result.scalar_one_or_none()
+            teacher = teachers.get(teacher_id)
             if teacher and hours > teacher.max_weekly_hours:
                 errors.append(ValidationError(
                     "teacher_hours_exceeded",
                     f"Teacher {teacher.full_name} exceeds max weekly hours ({hours} > {teacher.max_weekly_hours})"
                 ))
         
-        # Validate: ClassSubjectAllocation weekly hours fulfilled
-        # This would need to check against ClassSubjectAllocation records
-        # For now, we'll skip this as it requires loading allocations
+        # Longest run of consecutive lessons per (class, day, subject), from the sorted lesson indices
+        longest_runs: Dict[Tuple[int, int, int], int] = {}
+        for key, indices in subject_days.items():
+            indices.sort()
+            longest = current = 1
+            for previous, index in zip(indices, indices[1:]):
+                current = current + 1 if index == previous + 1 else 1
+                longest = max(longest, current)
+            longest_runs[key] = longest
         
         # Validate: Subject constraints (consecutive hours, multiple in day, etc.)
+        occupied = {(e.class_group_id, e.day_of_week, e.subject_id, e.lesson_index) for e in entries}
         for entry in entries:
-            from sqlalchemy import select
-            result = await self.db.execute(select(Subject).where(Subject.id == entry.subject_id))
-            subject = result.scalar_one_or_none()
+            subject = subjects.get(entry.subject_id)
             if subject:
+                key = (entry.class_group_id, entry.day_of_week, entry.subject_id)
                 # Check consecutive hours
                 if not subject.allow_consecutive_hours:
                     # Check if this entry is consecutive with another
-                    same_day_entries = [e for e in entries 
-                                      if e.class_group_id == entry.class_group_id 
-                                      and e.day_of_week == entry.day_of_week
-                                      and e.subject_id == entry.subject_id
-                                      and abs(e.lesson_index - entry.lesson_index) == 1]
-                    if same_day_entries:
+                    if (*key, entry.lesson_index - 1) in occupied or (*key, entry.lesson_index + 1) in occupied:
                         errors.append(ValidationError(
                             "consecutive_hours_violation",
                             f"Subject {subject.name} does not allow consecutive hours",
@@ -143,42 +141,145 @@ class TimetableValidationService:
                         ))
                 
                 # Check max consecutive hours
-                if subject.max_consecutive_hours:
-                    # Count consecutive hours for this subject on this day
-                    same_day_subject_entries = sorted(
-                        [e for e in entries 
-                         if e.class_group_id == entry.class_group_id 
-                         and e.day_of_week == entry.day_of_week
-                         and e.subject_id == entry.subject_id],
-                        key=lambda e: e.lesson_index
-                    )
-                    max_consecutive = 1
-                    current_consecutive = 1
-                    for i in range(1, len(same_day_subject_entries)):
-                        if same_day_subject_entries[i].lesson_index == same_day_subject_entries[i-1].lesson_index + 1:
-                            current_consecutive += 1
-                            max_consecutive = max(max_consecutive, current_consecutive)
-                        else:
-                            current_consecutive = 1
-                    
-                    if max_consecutive > subject.max_consecutive_hours:
-                        errors.append(ValidationError(
-                            "max_consecutive_hours_violation",
-                            f"Subject {subject.name} exceeds max consecutive hours ({max_consecutive} > {subject.max_consecutive_hours})"
-                        ))
+                if subject.max_consecutive_hours and longest_runs[key] > subject.max_consecutive_hours:
+                    errors.append(ValidationError(
+                        "max_consecutive_hours_violation",
+                        f"Subject {subject.name} exceeds max consecutive hours ({longest_runs[key]} > {subject.max_consecutive_hours})"
+                    ))
                 
                 # Check allow_multiple_in_one_day
-                if not subject.allow_multiple_in_one_day:
-                    same_day_count = len([e for e in entries 
-                                         if e.class_group_id == entry.class_group_id 
-                                         and e.day_of_week == entry.day_of_week
-                                         and e.subject_id == entry.subject_id])
-                    if same_day_count > 1:
-                        errors.append(ValidationError(
-                            "multiple_in_day_violation",
-                            f"Subject {subject.name} cannot occur multiple times in one day",
-                            entry.id
-                        ))
+                multiple = allow_multiple.get((entry.class_group_id, entry.subject_id), subject.allow_multiple_in_one_day)
+                if not multiple and len(subject_days[key]) > 1:
+                    errors.append(ValidationError(
+                        "multiple_in_day_violation",
+                        f"Subject {subject.name} cannot occur multiple times in one day",
+                        entry.id
+                    ))
+        
+        # Validate: allocation hours and blocks, teacher availability, classroom capacity and specialisation
+        report = check_constraints(
+            entries, allocations, teachers, subjects, classrooms, classes,
+            settings.days_per_week if settings else 0,
+            # A substitute timetable covers a single day
+            check_allocation_hours=timetable.is_primary != 0
+        )
+        for class_id, subject_id, planned, required in report.allocation_hours:
+            errors.append(ValidationError(
+                "allocation_hours_mismatch",
+                f"Class {_name(classes, class_id)} has {planned} of {required} weekly hours of {_name(subjects, subject_id)}"
+            ))
+        for class_id, subject_id, block in report.required_blocks:
+            errors.append(ValidationError(
+                "required_consecutive_hours_violation",
+                f"Subject {_name(subjects, subject_id)} must be taught in blocks of {block} consecutive hours in class {_name(classes, class_id)}"
+            ))
+        for i in report.unavailable_teacher:
+            entry = entries[i]
+            errors.append(ValidationError(
+                "teacher_unavailable",
+                f"Teacher {teachers[entry.teacher_id].full_name} is not available on {DAY_NAMES[entry.day_of_week]} in lesson {entry.lesson_index}",
+                entry.id
+            ))
+        for i in report.over_capacity:
+            entry = entries[i]
+            class_group, classroom = classes[entry.class_group_id], classrooms[entry.classroom_id]
+            errors.append(ValidationError(
+                "classroom_capacity_exceeded",
+                f"Class {class_group.name} ({class_group.number_of_students} students) does not fit into classroom {classroom.name} (capacity {classroom.capacity})",
+                entry.id
+            ))
+        for i in report.wrong_room:
+            entry = entries[i]
+            errors.append(ValidationError(
+                "classroom_specialization_mismatch",
+                f"Subject {_name(subjects, entry.subject_id)} requires a specialized classroom, {classrooms[entry.classroom_id].name} is not one",
+                entry.id
+            ))
         
         return errors
+    
+    async def get_incremental_validator(
+        self,
+        timetable_id: int,
+        teacher_ids: Iterable[int] = ()
+    ) -> Optional[IncrementalValidator]:
+        """Constraint state of a timetable for checking edits, cached per timetable version and
+        school data version. teacher_ids are teachers the edits assign, their weekly hour limits
+        are loaded when they have no lessons in the timetable yet."""
+        from app.models.timetable import Timetable
+        result = await self.db.execute(
+            select(Timetable.version, School.data_version)
+            .join(School, School.id == Timetable.school_id)
+            .where(Timetable.id == timetable_id)
+        )
+        versions = result.one_or_none()
+        if versions is None:
+            return None
+        key = (timetable_id, *versions)
+        validator = cached_validator(key)
+        if validator is None:
+            entries = await self.entry_repo.get_by_timetable_id(timetable_id)
+            teachers = await self._load_by_ids(Teacher, {e.teacher_id for e in entries})
+            subjects = await self._load_by_ids(Subject, {e.subject_id for e in entries})
+            allocations = await self._load_allocations(await self._load_by_ids(ClassGroup, {e.class_group_id for e in entries}))
+            validator = IncrementalValidator(
+                entries, teachers, subjects,
+                {(a.class_group_id, a.subject_id): a.allow_multiple_in_one_day for a in allocations}
+            )
+            cache_validator(key, validator)
+        missing = set(teacher_ids) - validator.max_hours.keys()
+        if missing:
+            validator.add_teachers((await self._load_by_ids(Teacher, missing)).values())
+        return validator
+    
+    async def _load_allocations(self, classes: Dict[int, ClassGroup]) -> List[ClassSubjectAllocation]:
+        if not classes:
+            return []
+        result = await self.db.execute(
+            select(ClassSubjectAllocation)
+            .where(ClassSubjectAllocation.class_group_id.in_(classes))
+            .order_by(ClassSubjectAllocation.id)
+        )
+        return list(result.scalars().all())
+    
+    async def _load_by_ids(self, model, ids: Iterable[int]) -> Dict[int, Any]:
+        """id -> row of a model for the given ids, in one query"""
+        ids = set(ids)
+        if not ids:
+            return {}
+        result = await self.db.execute(select(model).where(model.id.in_(ids)))
+        return {row.id: row for row in result.scalars().all()}
+
 
+def _name(rows: Dict[int, Any], id: int) -> str:
+    row = rows.get(id)
+    return row.name if row else str(id)
+
+
+def _slot_conflicts(
+    entries: List[TimetableEntry],
+    resource: Callable[[TimetableEntry], int],
+    error_type: str,
+    message: Callable[[TimetableEntry], str]
+) -> List[ValidationError]:
+    """Conflicts of lessons sharing a (resource, day, lesson) slot: one error per pair,
+    reported on the earlier lesson, grouped by resource in order of first appearance"""
+    slots: Dict[Tuple[int, int, int], int] = {}
+    by_resource: Dict[int, List[TimetableEntry]] = {}
+    for entry in entries:
+        key = (resource(entry), entry.day_of_week, entry.lesson_index)
+        slots[key] = slots.get(key, 0) + 1
+        by_resource.setdefault(key[0], []).append(entry)
+    
+    errors: List[ValidationError] = []
+    seen: Dict[Tuple[int, int, int], int] = {}
+    for resource_entries in by_resource.values():
+        for entry in resource_entries:
+            key = (resource(entry), entry.day_of_week, entry.lesson_index)
+            if slots[key] == 1:
+                continue
+            # Lessons of the slot after this one
+            later = slots[key] - 1 - seen.get(key, 0)
+            seen[key] = seen.get(key, 0) + 1
+            errors.extend(ValidationError(error_type, message(entry), entry.id) for _ in range(later))
+    return errors
@@ -0,0 +1,31 @@
+from app.solver.trace import TraceRecorder, NullTraceRecorder, NULL_TRACE, open_trace, read_trace
+from app.solver.state import SlotGrid, CapabilityTable, SolverState
+from app.solver.engine import GreedyEngine, Placement, DAY_NAMES
+from app.solver.snapshot import ProblemSnapshot
+from app.solver.runner import ENGINES, Solution, solve
+from app.solver.rearrange import rearrange_day
+from app.solver.matching import assign
+from app.solver.overlay import ResolvedEntry, diff_day, merge_day
+
+__all__ = [
+    "TraceRecorder",
+    "NullTraceRecorder",
+    "NULL_TRACE",
+    "open_trace",
+    "read_trace",
+    "SlotGrid",
+    "CapabilityTable",
+    "SolverState",
+    "GreedyEngine",
+    "Placement",
+    "DAY_NAMES",
+    "ProblemSnapshot",
+    "ENGINES",
+    "Solution",
+    "solve",
+    "rearrange_day",
+    "assign",
+    "ResolvedEntry",
+    "diff_day",
+    "merge_day",
+]
@@ -0,0 +1,128 @@
+"""
+Offline timetable solver.
+
+Export a school's problem snapshot (needs the database):
+    python -m app.solver export --school-id 1 --output problem.json
+
+Solve a snapshot without a database:
+    python -m app.solver solve problem.json --engine restarts --seed 42 --budget 50 --output solution.json
+
+Import an XHSTT benchmark archive as snapshots (one file per instance):
+    python -m app.solver import-xhstt ArchiveName.xml --output-dir instances/
+
+Benchmark engines on XHSTT archives, snapshots or directories of them:
+    python -m app.solver benchmark instances/ --engines greedy restarts --budget 20
+
+The solution file contains the run summary, the soft-constraint metrics and the
+placements as [class_group_id, subject_id, teacher_id, classroom_id, day_of_week, lesson_index].
+The API generates timetables from the same snapshot with the greedy engine, so
+`--engine greedy --seed S` reproduces a timetable generated online with seed S.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+from typing import List, Optional
+
+from app.solver.runner import ENGINES, MAX_SEED, solve
+from app.solver.snapshot import ProblemSnapshot, dump, load
+from app.solver.trace import NULL_TRACE, open_trace
+
+
+async def export_snapshot(school_id: int) -> ProblemSnapshot:
+    from app.core.database import AsyncSessionLocal
+    from app.services.timetable_service import TimetableService
+
+    async with AsyncSessionLocal() as db:
+        return await TimetableService(db).build_snapshot(school_id)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.solver", description="Offline timetable solver")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Export the problem snapshot of a school")
+    export.add_argument("--school-id", type=int, required=True)
+    export.add_argument("--output", "-o", required=True, help="Snapshot file (.json, .json.gz or .msgpack)")
+
+    run = commands.add_parser("solve", help="Solve a problem snapshot")
+    run.add_argument("snapshot", help="Snapshot file (.json, .json.gz or .msgpack)")
+    run.add_argument("--engine", choices=ENGINES, default="greedy")
+    run.add_argument("--seed", type=int, default=None, help="Random seed (drawn if omitted)")
+    run.add_argument("--budget", type=int, default=None, help="Number of runs for the restarts engine")
+    run.add_argument("--time-limit", type=float, default=None, help="Stop restarting after this many seconds")
+    run.add_argument("--output", "-o", default=None, help="Solution file (.json, .json.gz or .msgpack)")
+    run.add_argument("--trace", default=None, help="Write the placement decision trace (greedy engine)")
+
+    xhstt = commands.add_parser("import-xhstt", help="Convert an XHSTT archive into problem snapshots")
+    xhstt.add_argument("archive", help="XHSTT archive (.xml)")
+    xhstt.add_argument("--output-dir", "-o", required=True)
+    xhstt.add_argument("--format", choices=["json", "json.gz", "msgpack"], default="json")
+
+    bench = commands.add_parser("benchmark", help="Run engines on reference instances")
+    bench.add_argument("paths", nargs="+", help="XHSTT archives, snapshot files or directories")
+    bench.add_argument("--engines", nargs="+", choices=ENGINES, default=list(ENGINES))
+    bench.add_argument("--seed", type=int, default=1)
+    bench.add_argument("--budget", type=int, default=None, help="Number of runs for the restarts engine")
+    bench.add_argument("--time-limit", type=float, default=None, help="Per-instance time limit of restarts")
+    bench.add_argument("--output", "-o", default=None, help="Write the results as JSON")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "import-xhstt":
+        from app.solver.xhstt import load_archive
+
+        os.makedirs(args.output_dir, exist_ok=True)
+        for instance in load_archive(args.archive):
+            path = os.path.join(args.output_dir, f"{instance.id}.{args.format}")
+            dump(instance.snapshot.to_dict(), path)
+            print(json.dumps({"instance": instance.id, "name": instance.name, "output": path, **instance.stats}))
+        return
+
+    if args.command == "benchmark":
+        from app.solver.benchmark import format_table, load_instances, run_benchmark
+
+        results = run_benchmark(load_instances(args.paths), args.engines, seed=args.seed,
+                                budget=args.budget, time_limit=args.time_limit)
+        if args.output:
+            dump({"results": results}, args.output)
+        print(format_table(results))
+        return
+
+    if args.command == "export":
+        snapshot = asyncio.run(export_snapshot(args.school_id))
+        dump(snapshot.to_dict(), args.output)
+        print(json.dumps({
+            "school_id": snapshot.school_id,
+            "classes": len(snapshot.classes),
+            "teachers": len(snapshot.teachers),
+            "classrooms": len(snapshot.classrooms),
+            "lessons": sum(len(lessons) for lessons in snapshot.lessons_by_class().values()),
+            "output": args.output,
+        }, indent=2))
+        return
+
+    snapshot = ProblemSnapshot.from_dict(load(args.snapshot))
+    seed = args.seed if args.seed is not None else random.SystemRandom().randrange(MAX_SEED)
+    trace = open_trace(args.trace) if args.trace else NULL_TRACE
+    if trace.enabled:
+        trace.run(school_id=snapshot.school_id, seed=seed, engine=args.engine,
+                  max_lessons_per_day=snapshot.lessons_per_day, snapshot=args.snapshot)
+    try:
+        solution = solve(snapshot, engine=args.engine, seed=seed, budget=args.budget,
+                         time_limit=args.time_limit, trace=trace)
+        if trace.enabled:
+            trace.end(placed=len(solution.placements), unplaced=solution.unplaced)
+    finally:
+        trace.close()
+
+    if args.output:
+        dump({"school_id": snapshot.school_id, **solution.to_dict()}, args.output)
+    json.dump(solution.summary(), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Benchmark the engines on reference instances.
+
+Instances are XHSTT archives (``.xml``, every instance in the file) or problem
+snapshots (``.json``, ``.json.gz``, ``.msgpack``). For every instance and engine
+the runner reports the solve time, the hard cost (lessons missing from or placed
+beyond the weekly hours of their class-subject; clashes and unavailable times are
+never produced by the engines) and the soft cost
+(the weighted soft-constraint score, see app.solver.scoring).
+"""
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.solver.runner import solve
+from app.solver.snapshot import ProblemSnapshot, load
+from app.solver.xhstt import load_archive
+
+
+def load_instances(paths: Sequence[str]) -> List[Tuple[str, ProblemSnapshot]]:
+    """Load (name, snapshot) pairs from XHSTT archives, snapshot files or directories of them"""
+    instances: List[Tuple[str, ProblemSnapshot]] = []
+    for path in paths:
+        if os.path.isdir(path):
+            instances.extend(load_instances(sorted(os.path.join(path, name) for name in os.listdir(path))))
+        elif path.endswith(".xml"):
+            instances.extend((instance.id, instance.snapshot) for instance in load_archive(path))
+        elif path.endswith((".json", ".json.gz", ".msgpack")):
+            instances.append((os.path.basename(path), ProblemSnapshot.from_dict(load(path))))
+    return instances
+
+
+def run_benchmark(
+    instances: Sequence[Tuple[str, ProblemSnapshot]],
+    engines: Sequence[str],
+    seed: int = 1,
+    budget: Optional[int] = None,
+    time_limit: Optional[float] = None
+) -> List[Dict]:
+    """Solve every instance with every engine and collect the results"""
+    results = []
+    for name, snapshot in instances:
+        for engine in engines:
+            solution = solve(snapshot, engine=engine, seed=seed, budget=budget, time_limit=time_limit)
+            results.append({
+                "instance": name,
+                "engine": engine,
+                "lessons": solution.lessons,
+                "placed": len(solution.placements),
+                "hard_cost": solution.hard_cost,
+                "soft_cost": round(solution.metrics["total"], 2),
+                "seconds": round(solution.elapsed, 3),
+                "runs": solution.runs,
+            })
+    return results
+
+
+def format_table(results: List[Dict]) -> str:
+    columns = ["instance", "engine", "lessons", "placed", "hard_cost", "soft_cost", "seconds", "runs"]
+    widths = {c: max([len(c)] + [len(str(r[c])) for r in results]) for c in columns}
+    lines = ["  ".join(c.ljust(widths[c]) for c in columns)]
+    for result in results:
+        lines.append("  ".join(str(result[c]).ljust(widths[c]) for c in columns))
+    return "\n".join(lines)
@@ -0,0 +1,131 @@
+"""Vectorized hard-constraint checks of a timetable against allocations and resources.
+
+The entries are turned into NumPy columns once and every check is a grouped
+aggregation or a lookup over those columns:
+
+- allocation hours: lessons per (class, subject) against ``weekly_hours``
+- required blocks: lessons outside runs of ``required_consecutive_hours`` beyond the remainder
+- teacher availability: lessons outside the teacher's available lessons of the day
+- room capacity: classes larger than the capacity of their classroom
+- room specialisation: specialised subjects in classrooms without that specialisation
+
+``check_constraints`` returns positions into the entry list (or allocation rows),
+callers turn them into messages.
+"""
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.solver.engine import DAY_NAMES
+
+
+@dataclass
+class ConstraintReport:
+    # (class_group_id, subject_id, planned, required) per allocation whose weekly hours are not met
+    allocation_hours: List[Tuple[int, int, int, int]] = field(default_factory=list)
+    # (class_group_id, subject_id, required_consecutive_hours) per allocation with lessons outside blocks
+    required_blocks: List[Tuple[int, int, int]] = field(default_factory=list)
+    # Positions of entries violating teacher availability / room capacity / room specialisation
+    unavailable_teacher: List[int] = field(default_factory=list)
+    over_capacity: List[int] = field(default_factory=list)
+    wrong_room: List[int] = field(default_factory=list)
+
+
+def _run_lengths(occupied: np.ndarray) -> np.ndarray:
+    """Length of the run of occupied cells every occupied cell belongs to (last axis), 0 elsewhere"""
+    forward = np.zeros(occupied.shape, dtype=np.int32)
+    forward[..., 0] = occupied[..., 0]
+    for l in range(1, occupied.shape[-1]):
+        forward[..., l] = (forward[..., l - 1] + 1) * occupied[..., l]
+    lengths = forward.copy()
+    for l in range(occupied.shape[-1] - 2, -1, -1):
+        continues = occupied[..., l] & occupied[..., l + 1]
+        lengths[..., l] = np.where(continues, lengths[..., l + 1], forward[..., l])
+    return lengths
+
+
+def check_constraints(
+    entries: Sequence,
+    allocations: Sequence,
+    teachers: Mapping[int, Any],
+    subjects: Mapping[int, Any],
+    classrooms: Mapping[int, Any],
+    classes: Mapping[int, Any],
+    days_per_week: int,
+    check_allocation_hours: bool = True
+) -> ConstraintReport:
+    """Check entries (anything with the TimetableEntry attributes) in one pass of array operations.
+    Allocation hours only make sense for full weeks, substitute days pass check_allocation_hours=False."""
+    report = ConstraintReport()
+    if not entries:
+        return report
+    n = len(entries)
+    class_ids = np.fromiter((e.class_group_id for e in entries), dtype=np.int64, count=n)
+    subject_ids = np.fromiter((e.subject_id for e in entries), dtype=np.int64, count=n)
+    teacher_ids = np.fromiter((e.teacher_id for e in entries), dtype=np.int64, count=n)
+    room_ids = np.fromiter((e.classroom_id or 0 for e in entries), dtype=np.int64, count=n)
+    days = np.fromiter((e.day_of_week for e in entries), dtype=np.int64, count=n)
+    lessons = np.fromiter((e.lesson_index for e in entries), dtype=np.int64, count=n)
+    n_lessons = int(lessons.max()) + 2  # padding so that runs end inside the array
+    n_days = max(days_per_week, int(days.max()) + 1)
+
+    # Allocations joined to entries by (class, subject)
+    pair_of = {(a.class_group_id, a.subject_id): i for i, a in enumerate(allocations)}
+    if pair_of:
+        pairs = np.fromiter((pair_of.get((c, s), -1) for c, s in zip(class_ids.tolist(), subject_ids.tolist())),
+                            dtype=np.int64, count=n)
+        allocated = pairs >= 0
+        weekly = np.array([a.weekly_hours for a in allocations], dtype=np.int64)
+        if check_allocation_hours:
+            planned = np.bincount(pairs[allocated], minlength=len(allocations))
+            for i in np.nonzero(planned != weekly)[0]:
+                a = allocations[i]
+                report.allocation_hours.append((a.class_group_id, a.subject_id, int(planned[i]), int(weekly[i])))
+
+        required = np.array([a.required_consecutive_hours or 0 for a in allocations], dtype=np.int64)
+        blocked = required > 1
+        if blocked.any():
+            # Occupancy per [allocation, day, lesson] and the run every lesson belongs to
+            occupied = np.zeros((len(allocations), n_days, n_lessons), dtype=bool)
+            occupied[pairs[allocated], days[allocated], lessons[allocated]] = True
+            lengths = _run_lengths(occupied)
+            short = (occupied & (lengths < required[:, None, None])).sum(axis=(1, 2))
+            # Hours left over after full blocks may stand alone
+            remainder = np.where(blocked, weekly % np.maximum(required, 1), 0)
+            for i in np.nonzero(blocked & (short > remainder))[0]:
+                a = allocations[i]
+                report.required_blocks.append((a.class_group_id, a.subject_id, int(required[i])))
+
+    # Teacher availability as a [teacher, day, lesson] table (no restriction when unset or empty)
+    teacher_index = {teacher_id: i for i, teacher_id in enumerate(teachers)}
+    available = np.ones((len(teacher_index) + 1, n_days, n_lessons), dtype=bool)
+    for teacher_id, i in teacher_index.items():
+        availability = teachers[teacher_id].availability
+        if not availability:
+            continue
+        for day in range(min(n_days, len(DAY_NAMES))):
+            listed = availability.get(DAY_NAMES[day], [])
+            if listed:
+                # Restricted even when no listed hour falls inside the timetable's lessons
+                available[i, day, :] = False
+                available[i, day, [h for h in listed if 0 <= h < n_lessons]] = True
+    rows = np.fromiter((teacher_index.get(t, len(teacher_index)) for t in teacher_ids.tolist()), dtype=np.int64, count=n)
+    report.unavailable_teacher = np.nonzero(~available[rows, days, lessons])[0].tolist()
+
+    # Class size against classroom capacity (unknown values never violate)
+    sizes = np.fromiter(((getattr(classes.get(c), "number_of_students", None) or 0) for c in class_ids.tolist()),
+                        dtype=np.int64, count=n)
+    capacities = np.fromiter(((getattr(classrooms.get(r), "capacity", None) or 0) for r in room_ids.tolist()),
+                             dtype=np.int64, count=n)
+    report.over_capacity = np.nonzero((room_ids > 0) & (sizes > 0) & (capacities > 0) & (sizes > capacities))[0].tolist()
+
+    # Specialised subjects need a classroom specialised in them
+    specialised = {s.id for s in subjects.values() if s.requires_specialized_classroom or s.is_laboratory}
+    if specialised:
+        needs_room = np.isin(subject_ids, list(specialised)) & (room_ids > 0)
+        room_subjects = {(r.id, s) for r in classrooms.values() for s in (r.specializations or [])}
+        matches = np.fromiter(((r, s) in room_subjects for r, s in zip(room_ids.tolist(), subject_ids.tolist())),
+                              dtype=bool, count=n)
+        report.wrong_room = np.nonzero(needs_room & ~matches)[0].tolist()
+    return report
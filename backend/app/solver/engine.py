@@ -0,0 +1,470 @@
+"""Greedy placement engine used to generate primary timetables.
+
+The engine works on plain model objects (classes, subjects, allocations, teachers,
+classrooms) and keeps all occupancy in a SolverState, so no lookups scan the list of
+already placed lessons. Placements are returned as tuples; persisting them is up to
+the caller.
+"""
+import random
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from app.solver import trace as tr
+from app.solver.state import CapabilityTable, SlotGrid, SolverState
+from app.solver.trace import NullTraceRecorder, NULL_TRACE
+
+DAY_NAMES = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+
+class Placement(NamedTuple):
+    class_group_id: int
+    subject_id: int
+    teacher_id: int
+    classroom_id: Optional[int]
+    day_of_week: int
+    lesson_index: int
+
+
+class GreedyEngine:
+    """Places the lessons of one class after another, day-first and then gap-minimizing"""
+
+    def __init__(
+        self,
+        classes: Sequence,
+        teachers: Sequence,
+        classrooms: Sequence,
+        days_per_week: int,
+        lessons_per_day: int,
+        rng: Optional[random.Random] = None,
+        trace: NullTraceRecorder = NULL_TRACE
+    ):
+        self.grid = SlotGrid(days_per_week, lessons_per_day)
+        self.state = SolverState(
+            self.grid,
+            [t.id for t in teachers],
+            [c.id for c in classes],
+            [r.id for r in classrooms]
+        )
+        self.teachers = list(teachers)
+        self.teachers_by_id = {t.id: t for t in teachers}
+        self.classrooms = list(classrooms)
+        self.capabilities = CapabilityTable(self.teachers, self.state.teacher_index)
+        self.rng = rng or random.Random()
+        self.trace = trace
+
+        # Availability as a teacher x slot table (1 = available)
+        self.teacher_available = bytearray(b"\x01") * len(self.state.teacher_busy)
+        for teacher in self.teachers:
+            if not teacher.availability:
+                continue
+            base = self.state.teacher_index[teacher.id] * self.grid.size
+            for day in range(min(days_per_week, len(DAY_NAMES))):
+                available_hours = teacher.availability.get(DAY_NAMES[day], [])
+                if not available_hours:
+                    continue
+                for lesson_index in range(1, lessons_per_day + 1):
+                    if lesson_index not in available_hours:
+                        self.teacher_available[base + self.grid.slot(day, lesson_index)] = 0
+
+    def place_class(
+        self,
+        class_group,
+        subjects_to_place: List[Tuple],
+        lunch_hours_per_day: Optional[Dict[int, List[int]]] = None,
+        is_primary_timetable: bool = True
+    ) -> List[Placement]:
+        """Place subjects for a class ensuring every day has at least one lesson, with even distribution"""
+        placements: List[Placement] = []
+        tracing = self.trace.enabled
+        state = self.state
+        days = self.grid.days
+        max_lessons_per_day = self.grid.lessons_per_day
+        lunch_hours_per_day_dict = lunch_hours_per_day or {}
+
+        # Create a list of available slots (day, lesson_index) excluding lunch breaks
+        available_slots = []
+        for day in range(days):
+            lunch_hours_for_day_set = set(lunch_hours_per_day_dict.get(day, []))
+            for lesson_index in range(1, max_lessons_per_day + 1):
+                if lesson_index not in lunch_hours_for_day_set:
+                    available_slots.append((day, lesson_index))
+
+        # Teacher assigned to each subject of this class; primary timetables only use the primary teacher
+        class_subject_teacher: Dict[int, int] = {}  # subject_id -> teacher_id
+        if is_primary_timetable:
+            for subject, allocation in subjects_to_place:
+                if allocation.primary_teacher_id and allocation.primary_teacher_id in self.teachers_by_id:
+                    class_subject_teacher[subject.id] = allocation.primary_teacher_id
+
+        def place(subject, teacher_id: int, classroom, day: int, lesson_index: int) -> Placement:
+            placement = Placement(class_group.id, subject.id, teacher_id,
+                                  classroom.id if classroom else None, day, lesson_index)
+            state.place(*placement)
+            placements.append(placement)
+            return placement
+
+        def try_slot(subject, allocation, day: int, lesson_index: int) -> Tuple[Optional[Placement], Optional[str]]:
+            """Try to place a lesson into a free class slot; returns the placement or the rejection reason"""
+            assigned_teacher_id = class_subject_teacher.get(subject.id)
+            teacher = self._find_suitable_teacher(
+                subject, class_group, day, lesson_index, is_primary_timetable, assigned_teacher_id
+            )
+            if not teacher:
+                reason = self._teacher_rejection_reason(day, lesson_index, assigned_teacher_id) if tracing else None
+                return None, reason
+            if not assigned_teacher_id:
+                class_subject_teacher[subject.id] = teacher.id
+            if not self._check_subject_constraints(subject, class_group.id, day, lesson_index, allocation):
+                return None, tr.REASON_SUBJECT_CONSTRAINT
+            classroom = self._find_suitable_classroom(subject, class_group, day, lesson_index)
+            return place(subject, teacher.id, classroom, day, lesson_index), None
+
+        subjects_remaining = list(subjects_to_place)
+
+        # First, ensure at least one lesson per day
+        # CRITICAL: First lesson of each day MUST be at lesson_index 1 (school start time)
+        for day in range(days):
+            if not subjects_remaining:
+                break
+
+            lunch_hours_for_day_set = set(lunch_hours_per_day_dict.get(day, []))
+            day_lesson_indices = set(state.class_day(class_group.id, day))
+
+            # If this is the first lesson for this day, try ALL subjects until one fits at lesson_index 1
+            if not day_lesson_indices and 1 not in lunch_hours_for_day_set:
+                lesson_index = 1
+                for idx, (subject, allocation) in enumerate(subjects_remaining):
+                    started = self.trace.start() if tracing else 0.0
+                    if state.is_class_busy(class_group.id, day, lesson_index):
+                        if tracing:
+                            self.trace.decision("day_start", class_group.id, subject.id,
+                                                [[day, lesson_index, tr.REASON_CLASS_BUSY]], None, started)
+                        continue
+                    placement, reason = try_slot(subject, allocation, day, lesson_index)
+                    if placement:
+                        subjects_remaining.pop(idx)
+                        if tracing:
+                            self.trace.decision("day_start", class_group.id, subject.id,
+                                                [], self._trace_slot(placement), started)
+                        break  # Move to next day
+                    if tracing:
+                        self.trace.decision("day_start", class_group.id, subject.id,
+                                            [[day, lesson_index, reason]], None, started)
+
+            # Find a subject that can be placed on this day (for remaining subjects)
+            for idx, (subject, allocation) in enumerate(subjects_remaining):
+                started = self.trace.start() if tracing else 0.0
+                tried: List[list] = []
+
+                candidate_slots = []
+                for lesson_index in range(1, max_lessons_per_day + 1):
+                    if lesson_index in lunch_hours_for_day_set:
+                        if tracing:
+                            tried.append([day, lesson_index, tr.REASON_LUNCH])
+                        continue
+                    if state.is_class_busy(class_group.id, day, lesson_index):
+                        if tracing:
+                            tried.append([day, lesson_index, tr.REASON_CLASS_BUSY])
+                        continue
+                    # Prioritize lesson_index 1 for first lesson of day, then slots adjacent to existing lessons
+                    is_first = (lesson_index == 1) if not day_lesson_indices else False
+                    is_adjacent = (lesson_index - 1 in day_lesson_indices) or (lesson_index + 1 in day_lesson_indices)
+                    candidate_slots.append((is_first, is_adjacent, lesson_index))
+                candidate_slots.sort(key=lambda x: (not x[0], not x[1], x[2]))
+
+                placement = None
+                for _, _, lesson_index in candidate_slots:
+                    placement, reason = try_slot(subject, allocation, day, lesson_index)
+                    if placement:
+                        subjects_remaining.pop(idx)
+                        break
+                    if tracing:
+                        tried.append([day, lesson_index, reason])
+
+                if tracing:
+                    self.trace.decision("day", class_group.id, subject.id, tried,
+                                        self._trace_slot(placement) if placement else None, started)
+                if placement:
+                    break
+
+        # Now place remaining subjects with even distribution and minimal gaps:
+        # days without lessons first, then slots adjacent to existing lessons, then emptier days
+        def sorted_slots() -> List[Tuple[int, int]]:
+            day_lesson_indices = [set(state.class_day(class_group.id, day)) for day in range(days)]
+            day_hours = [state.day_hours(class_group.id, day) for day in range(days)]
+
+            def slot_priority(slot):
+                day, lesson_index = slot
+                if not day_hours[day]:
+                    return (-1, 0, day, lesson_index)
+                lessons = day_lesson_indices[day]
+                is_adjacent = (lesson_index - 1 in lessons) or (lesson_index + 1 in lessons)
+                return (0 if is_adjacent else 1, day_hours[day], day, lesson_index)
+
+            return sorted(available_slots, key=slot_priority)
+
+        # Track how many hours have been placed in blocks for each subject
+        subject_hours_placed: Dict[int, int] = {}  # subject_id -> hours placed
+
+        for subject, allocation in subjects_remaining:
+            hours_placed = subject_hours_placed.get(subject.id, 0)
+            hours_to_place = allocation.weekly_hours if allocation else 1
+            hours_remaining = hours_to_place - hours_placed
+
+            if hours_remaining <= 0:
+                continue  # All hours for this subject are already placed
+
+            # If required_consecutive_hours is set, try to place consecutive blocks first
+            required_consecutive = allocation.required_consecutive_hours if allocation else None
+            if required_consecutive and required_consecutive > 1 and hours_remaining >= required_consecutive:
+                blocks_placed = 0
+                while hours_remaining >= required_consecutive and blocks_placed < 10:  # Limit iterations
+                    if not self._place_consecutive_block(
+                        class_group, subject, allocation, required_consecutive, lunch_hours_per_day_dict,
+                        class_subject_teacher, is_primary_timetable, placements
+                    ):
+                        # If we can't place a consecutive block, try individual placement
+                        break
+                    hours_remaining -= required_consecutive
+                    hours_placed += required_consecutive
+                    subject_hours_placed[subject.id] = hours_placed
+                    blocks_placed += 1
+
+                if hours_remaining == 0:
+                    continue
+
+            # Place individually
+            started = self.trace.start() if tracing else 0.0
+            tried = []
+            placement = None
+            for day, lesson_index in sorted_slots():
+                if state.is_class_busy(class_group.id, day, lesson_index):
+                    if tracing:
+                        tried.append([day, lesson_index, tr.REASON_CLASS_BUSY])
+                    continue
+                placement, reason = try_slot(subject, allocation, day, lesson_index)
+                if placement:
+                    break
+                if tracing:
+                    tried.append([day, lesson_index, reason])
+
+            if tracing:
+                self.trace.decision("fill", class_group.id, subject.id, tried,
+                                    self._trace_slot(placement) if placement else None, started)
+
+        return placements
+
+    def _place_consecutive_block(
+        self,
+        class_group,
+        subject,
+        allocation,
+        block_size: int,
+        lunch_hours_per_day: Dict[int, List[int]],
+        class_subject_teacher: Dict[int, int],
+        is_primary_timetable: bool,
+        placements: List[Placement]
+    ) -> bool:
+        """Place a consecutive block of lessons for a subject. Returns True if successful."""
+        tracing = self.trace.enabled
+        started = self.trace.start() if tracing else 0.0
+        tried: List[list] = []
+        state = self.state
+
+        for day in range(self.grid.days):
+            lunch_hours_for_day_set = set(lunch_hours_per_day.get(day, []))
+
+            for start_index in range(1, self.grid.lessons_per_day + 1 - block_size + 1):
+                consecutive_slots = range(start_index, start_index + block_size)
+
+                # Check if any slot is a lunch break or already taken
+                if any(slot in lunch_hours_for_day_set for slot in consecutive_slots):
+                    if tracing:
+                        tried.append([day, start_index, tr.REASON_LUNCH])
+                    continue
+                if any(state.is_class_busy(class_group.id, day, slot) for slot in consecutive_slots):
+                    if tracing:
+                        tried.append([day, start_index, tr.REASON_CLASS_BUSY])
+                    continue
+
+                assigned_teacher_id = class_subject_teacher.get(subject.id)
+
+                # Check if the same teacher is available for all slots
+                teacher = None
+                for slot_index in consecutive_slots:
+                    candidate_teacher = self._find_suitable_teacher(
+                        subject, class_group, day, slot_index, is_primary_timetable, assigned_teacher_id
+                    )
+                    if not candidate_teacher:
+                        if tracing:
+                            tried.append([day, start_index,
+                                          self._teacher_rejection_reason(day, slot_index, assigned_teacher_id)])
+                        break
+                    if teacher is None:
+                        teacher = candidate_teacher
+                    elif teacher.id != candidate_teacher.id:
+                        if tracing:
+                            tried.append([day, start_index, tr.REASON_TEACHER_MISMATCH])
+                        break
+                else:
+                    if not assigned_teacher_id:
+                        class_subject_teacher[subject.id] = teacher.id
+
+                    # Check subject constraints for the first slot
+                    if not self._check_subject_constraints(subject, class_group.id, day, start_index, allocation):
+                        if tracing:
+                            tried.append([day, start_index, tr.REASON_SUBJECT_CONSTRAINT])
+                        continue
+
+                    first = None
+                    for slot_index in consecutive_slots:
+                        classroom = self._find_suitable_classroom(subject, class_group, day, slot_index)
+                        placement = Placement(class_group.id, subject.id, teacher.id,
+                                              classroom.id if classroom else None, day, slot_index)
+                        state.place(*placement)
+                        placements.append(placement)
+                        first = first or placement
+
+                    if tracing:
+                        self.trace.decision("block", class_group.id, subject.id, tried,
+                                            self._trace_slot(first), started)
+                    return True
+
+        if tracing:
+            self.trace.decision("block", class_group.id, subject.id, tried, None, started)
+        return False
+
+    def _trace_slot(self, placement: Placement) -> list:
+        """Compact trace representation of a placement"""
+        return [placement.day_of_week, placement.lesson_index, placement.teacher_id, placement.classroom_id]
+
+    def _teacher_usable(self, teacher, day: int, lesson_index: int) -> bool:
+        """Check availability, conflicts and weekly hours of a teacher at a slot"""
+        offset = self.state.teacher_index[teacher.id] * self.grid.size + self.grid.slot(day, lesson_index)
+        return (
+            self.teacher_available[offset] == 1 and
+            self.state.teacher_busy[offset] == 0 and
+            self.state.hours_of(teacher.id) < teacher.max_weekly_hours
+        )
+
+    def _teacher_rejection_reason(self, day: int, lesson_index: int, assigned_teacher_id: Optional[int] = None) -> str:
+        """Explain why _find_suitable_teacher found no teacher (only used when tracing)"""
+        teacher = self.teachers_by_id.get(assigned_teacher_id)
+        if teacher is None:
+            return tr.REASON_NO_TEACHER
+        offset = self.state.teacher_index[teacher.id] * self.grid.size + self.grid.slot(day, lesson_index)
+        if not self.teacher_available[offset]:
+            return tr.REASON_TEACHER_UNAVAILABLE
+        if self.state.teacher_busy[offset]:
+            return tr.REASON_TEACHER_BUSY
+        if self.state.hours_of(teacher.id) >= teacher.max_weekly_hours:
+            return tr.REASON_TEACHER_MAX_HOURS
+        return tr.REASON_NO_TEACHER
+
+    def _find_suitable_teacher(
+        self,
+        subject,
+        class_group,
+        day: int,
+        lesson_index: int,
+        is_primary_timetable: bool = True,
+        assigned_teacher_id: Optional[int] = None
+    ):
+        """Find a teacher who can teach this subject and is available at this specific time slot.
+        For primary timetables, if assigned_teacher_id is provided, only checks that teacher.
+        For substitute timetables, can return any suitable teacher."""
+        if assigned_teacher_id is not None:
+            teacher = self.teachers_by_id.get(assigned_teacher_id)
+            if not teacher or not self._teacher_usable(teacher, day, lesson_index):
+                return None
+            return teacher
+
+        # Primary timetables only use the pre-found primary teachers
+        if is_primary_timetable:
+            return None
+
+        # For substitute timetables, prefer the primary teacher of the class, otherwise any suitable teacher
+        capabilities = self.capabilities
+        primary_teacher = None
+        other_teachers = []
+        seen = set()
+        for position in capabilities.rows(subject.id):
+            teacher_idx = capabilities.teacher[position]
+            if teacher_idx in seen:
+                continue
+            if not capabilities.matches_class(position, class_group.id, class_group.grade_level_id):
+                continue
+            # Only the first matching capability of a teacher counts
+            seen.add(teacher_idx)
+            teacher = self.teachers[teacher_idx]
+            if not self._teacher_usable(teacher, day, lesson_index):
+                continue
+            if capabilities.primary[position] and capabilities.class_group[position] == class_group.id:
+                primary_teacher = teacher
+            else:
+                other_teachers.append(teacher)
+
+        if primary_teacher:
+            return primary_teacher
+
+        # Shuffle for load balancing
+        if other_teachers:
+            self.rng.shuffle(other_teachers)
+            return other_teachers[0]
+
+        return None
+
+    def _find_suitable_classroom(self, subject, class_group, day: int, lesson_index: int):
+        """Find a suitable classroom, preferring ones where the class fits"""
+        if not self.classrooms:
+            return None
+
+        class_size = class_group.number_of_students
+        specialized = subject.requires_specialized_classroom or subject.is_laboratory
+        busy = self.state.classroom_busy
+        size = self.grid.size
+        slot = self.grid.slot(day, lesson_index)
+
+        first_fitting = None
+        first_other = None
+        specialized_other = None
+        for idx, classroom in enumerate(self.classrooms):
+            if busy[idx * size + slot]:
+                continue
+            fits = True
+            if class_size is not None and classroom.capacity is not None:
+                fits = class_size <= classroom.capacity
+            is_specialized = specialized and classroom.specializations and subject.id in classroom.specializations
+            if fits:
+                if is_specialized:
+                    return classroom
+                if first_fitting is None:
+                    first_fitting = classroom
+            else:
+                if is_specialized and specialized_other is None:
+                    specialized_other = classroom
+                if first_other is None:
+                    first_other = classroom
+
+        # Specialized classrooms that don't fit are still preferred over generic ones
+        return specialized_other or first_fitting or first_other
+
+    def _check_subject_constraints(self, subject, class_group_id: int, day: int, lesson_index: int,
+                                   allocation=None) -> bool:
+        """Check if placing subject at this position violates constraints"""
+        day_subjects = self.state.class_day(class_group_id, day)
+
+        # Check consecutive hours
+        if not subject.allow_consecutive_hours:
+            if day_subjects.get(lesson_index - 1) == subject.id or day_subjects.get(lesson_index + 1) == subject.id:
+                return False
+
+        # Check multiple in day - use allocation setting if available, otherwise use subject setting
+        allow_multiple = subject.allow_multiple_in_one_day
+        if allocation and allocation.allow_multiple_in_one_day is not None:
+            allow_multiple = allocation.allow_multiple_in_one_day
+
+        if not allow_multiple:
+            if subject.id in day_subjects.values():
+                return False
+
+        return True
@@ -0,0 +1,75 @@
+"""Min-cost assignment of lessons to substitute teachers.
+
+``assign(costs)`` solves the rectangular assignment problem with the Hungarian
+algorithm (shortest augmenting paths with potentials, O(n^2 m) for n lessons and
+m teachers). Pairs that are not allowed have cost None. Every lesson also gets an
+"uncovered" option costing ``UNCOVERED_COST``, which is larger than any real
+assignment, so the result first covers as many lessons as possible and then has
+the lowest total cost among those.
+"""
+from typing import List, Optional, Sequence
+
+UNCOVERED_COST = 1_000_000.0
+_FORBIDDEN = UNCOVERED_COST * 1000
+
+
+def assign(costs: Sequence[Sequence[Optional[float]]]) -> List[Optional[int]]:
+    """For every row (lesson) the chosen column (teacher) or None if it stays uncovered"""
+    n = len(costs)
+    if n == 0:
+        return []
+    m = len(costs[0])
+    width = m + n  # one "uncovered" column per lesson
+
+    def cost(row: int, col: int) -> float:
+        if col >= m:
+            return UNCOVERED_COST
+        value = costs[row][col]
+        return _FORBIDDEN if value is None else value
+
+    # 1-based arrays as in the textbook formulation; column 0 is the virtual start
+    u = [0.0] * (n + 1)
+    v = [0.0] * (width + 1)
+    match = [0] * (width + 1)  # column -> row
+    way = [0] * (width + 1)
+    for row in range(1, n + 1):
+        match[0] = row
+        col0 = 0
+        min_to = [float("inf")] * (width + 1)
+        used = [False] * (width + 1)
+        while True:
+            used[col0] = True
+            row0 = match[col0]
+            delta = float("inf")
+            col1 = 0
+            for col in range(1, width + 1):
+                if used[col]:
+                    continue
+                reduced = cost(row0 - 1, col - 1) - u[row0] - v[col]
+                if reduced < min_to[col]:
+                    min_to[col] = reduced
+                    way[col] = col0
+                if min_to[col] < delta:
+                    delta = min_to[col]
+                    col1 = col
+            for col in range(width + 1):
+                if used[col]:
+                    u[match[col]] += delta
+                    v[col] -= delta
+                else:
+                    min_to[col] -= delta
+            col0 = col1
+            if match[col0] == 0:
+                break
+        # Flip the augmenting path
+        while col0:
+            col1 = way[col0]
+            match[col0] = match[col1]
+            col0 = col1
+
+    result: List[Optional[int]] = [None] * n
+    for col in range(1, m + 1):
+        row = match[col]
+        if row and costs[row - 1][col - 1] is not None:
+            result[row - 1] = col - 1
+    return result
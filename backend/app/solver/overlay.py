@@ -0,0 +1,106 @@
+"""Substitute timetables as overlays over the base timetable.
+
+A substitute timetable for a date stores only what differs from the base
+timetable's lessons on that weekday: moved, reassigned, cancelled and added
+lessons. ``diff_day`` computes those changes from a planned day, ``merge_day``
+applies stored changes to the base lessons again. Both work on plain objects
+with the attributes of TimetableEntry / SubstituteChange.
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+MOVED = "MOVED"
+REASSIGNED = "REASSIGNED"
+CANCELLED = "CANCELLED"
+ADDED = "ADDED"
+
+
+@dataclass
+class ResolvedEntry:
+    """A lesson of a substitute timetable: a base entry, possibly changed, or an added lesson"""
+    id: int
+    timetable_id: int
+    class_group_id: int
+    subject_id: int
+    teacher_id: int
+    classroom_id: Optional[int]
+    day_of_week: int
+    lesson_index: int
+    base_entry_id: Optional[int] = None
+    change_type: Optional[str] = None
+    class_group: Any = None
+    subject: Any = None
+    teacher: Any = None
+    classroom: Any = None
+
+
+def _slot(entry) -> Tuple[int, int]:
+    return entry.day_of_week, entry.lesson_index
+
+
+def diff_day(base_entries: Sequence, planned: Sequence) -> List[Tuple[str, Optional[Any], Optional[Any]]]:
+    """Changes (change_type, base_entry, planned_entry) that turn the base lessons of a day into
+    the planned ones. Lessons are paired per class and subject: identical lessons are not
+    changes, then lessons in the same slot (REASSIGNED), then the rest in order (MOVED)."""
+    base_groups: Dict[Tuple[int, int], List] = {}
+    for entry in base_entries:
+        base_groups.setdefault((entry.class_group_id, entry.subject_id), []).append(entry)
+    planned_groups: Dict[Tuple[int, int], List] = {}
+    for entry in planned:
+        planned_groups.setdefault((entry.class_group_id, entry.subject_id), []).append(entry)
+
+    changes: List[Tuple[str, Optional[Any], Optional[Any]]] = []
+    for key in list(base_groups) + [k for k in planned_groups if k not in base_groups]:
+        base = list(base_groups.get(key, []))
+        remaining = []
+        for entry in planned_groups.get(key, []):
+            same = next((b for b in base if _slot(b) == _slot(entry) and b.teacher_id == entry.teacher_id
+                         and b.classroom_id == entry.classroom_id), None)
+            if same is not None:
+                base.remove(same)
+            else:
+                remaining.append(entry)
+        moved = []
+        for entry in remaining:
+            same_slot = next((b for b in base if _slot(b) == _slot(entry)), None)
+            if same_slot is not None:
+                base.remove(same_slot)
+                changes.append((REASSIGNED, same_slot, entry))
+            else:
+                moved.append(entry)
+        for entry in moved:
+            changes.append((MOVED, base.pop(0), entry) if base else (ADDED, None, entry))
+        changes.extend((CANCELLED, b, None) for b in base)
+    return changes
+
+
+def _change_type(change) -> str:
+    value = change.change_type
+    return getattr(value, "value", value)
+
+
+def merge_day(timetable_id: int, base_entries: Sequence, changes: Sequence) -> List[ResolvedEntry]:
+    """Lessons of a substitute timetable: its base day lessons with the changes applied"""
+    by_base = {c.base_entry_id: c for c in changes if c.base_entry_id is not None}
+    resolved: List[ResolvedEntry] = []
+    for entry in base_entries:
+        change = by_base.get(entry.id)
+        if change is None:
+            resolved.append(ResolvedEntry(
+                entry.id, timetable_id, entry.class_group_id, entry.subject_id, entry.teacher_id,
+                entry.classroom_id, entry.day_of_week, entry.lesson_index, base_entry_id=entry.id
+            ))
+        elif _change_type(change) != CANCELLED:
+            resolved.append(ResolvedEntry(
+                entry.id, timetable_id, change.class_group_id, change.subject_id, change.teacher_id,
+                change.classroom_id, change.day_of_week, change.lesson_index,
+                base_entry_id=entry.id, change_type=_change_type(change)
+            ))
+    for change in changes:
+        if change.base_entry_id is None and _change_type(change) == ADDED:
+            # Added lessons have no entry id of their own
+            resolved.append(ResolvedEntry(
+                -change.id, timetable_id, change.class_group_id, change.subject_id, change.teacher_id,
+                change.classroom_id, change.day_of_week, change.lesson_index, change_type=ADDED
+            ))
+    return resolved
@@ -0,0 +1,57 @@
+"""Rearrangement of one class's lessons within a day.
+
+Every lesson comes with the lesson indices it may go to (teacher, substitute and
+classroom already checked) and whether it must not be next to another lesson
+placed before it. The search assigns lessons in order, depth-first over those
+indices, with the used lesson indices kept as a bitmask: whether the remaining
+lessons fit depends only on (lesson position, used mask), so dead states are
+memoized and never expanded twice. The first arrangement found is the same one
+a plain backtracking in the same order would find.
+"""
+from typing import List, Optional, Sequence
+
+# Search nodes before a rearrangement is given up (the lessons are moved to other days)
+DEFAULT_NODE_BUDGET = 50000
+
+
+def rearrange_day(
+    candidates: Sequence[Sequence[int]],
+    no_adjacent: Sequence[bool],
+    node_budget: int = DEFAULT_NODE_BUDGET
+) -> Optional[List[int]]:
+    """Pick a distinct lesson index for every lesson from its candidates.
+
+    Returns the chosen index per lesson or None if there is no arrangement (or
+    the node budget ran out)."""
+    count = len(candidates)
+    bits = [[(index, 1 << index) for index in lesson_candidates] for lesson_candidates in candidates]
+    dead = set()
+    chosen = [0] * count
+    nodes = 0
+
+    def search(position: int, used: int) -> bool:
+        nonlocal nodes
+        if position == count:
+            return True
+        if (position, used) in dead:
+            return False
+        nodes += 1
+        if nodes > node_budget:
+            return False
+        for index, bit in bits[position]:
+            if used & bit:
+                continue
+            # Lesson must not follow directly after / before an already placed lesson
+            if no_adjacent[position] and used & ((bit << 1) | (bit >> 1)):
+                continue
+            chosen[position] = index
+            if search(position + 1, used | bit):
+                return True
+            if nodes > node_budget:
+                return False
+        dead.add((position, used))
+        return False
+
+    if not search(0, 0):
+        return None
+    return chosen
@@ -0,0 +1,119 @@
+"""
+Inspect and replay a placement decision trace.
+Run with: python -m app.solver.replay TRACE [--top N] [--rerun]
+
+Without --rerun the trace is only profiled: rejection reasons, the slowest
+decisions and the lessons that could not be placed. With --rerun the recorded
+problem snapshot is solved again offline with the recorded seed and the new
+decisions are compared with the recorded ones, pointing at the first divergence
+(for an unchanged solver there is none and failures reproduce exactly). The
+database is not touched.
+"""
+import argparse
+import io
+import json
+from collections import Counter
+from typing import Dict, List, Optional
+
+from app.solver.runner import solve
+from app.solver.snapshot import ProblemSnapshot, load
+from app.solver.trace import TraceRecorder, read_trace
+
+
+def summarize(records: List[dict], top: int = 10) -> Dict:
+    """Aggregate a trace into reason counts, hot decisions and unplaced lessons"""
+    run = next((r for r in records if r["t"] == "run"), {})
+    # The embedded problem snapshot is too large for the report
+    run = {key: value for key, value in run.items() if key != "problem"}
+    decisions = [r for r in records if r["t"] == "place"]
+    reasons: Counter = Counter()
+    phases: Counter = Counter()
+    for decision in decisions:
+        phases[(decision["phase"], decision["chosen"] is not None)] += 1
+        for _, _, reason in decision["tried"]:
+            reasons[reason] += 1
+
+    # Lessons are dropped when the final fill phase cannot place them
+    unplaced = []
+    for decision in decisions:
+        if decision["phase"] == "fill" and decision["chosen"] is None:
+            unplaced.append({
+                "class": decision["class"],
+                "subject": decision["subject"],
+                "reasons": dict(Counter(reason for _, _, reason in decision["tried"])),
+            })
+
+    slowest = sorted(decisions, key=lambda d: d.get("us", 0), reverse=True)[:top]
+    widest = sorted(decisions, key=lambda d: len(d["tried"]), reverse=True)[:top]
+    return {
+        "run": run,
+        "decisions": len(decisions),
+        "phases": {f"{phase}:{'placed' if ok else 'failed'}": n for (phase, ok), n in sorted(phases.items())},
+        "reasons": dict(reasons.most_common()),
+        "unplaced": unplaced,
+        "slowest": [_describe(d) for d in slowest],
+        "most_rejections": [_describe(d) for d in widest],
+    }
+
+
+def _describe(decision: dict) -> dict:
+    return {
+        "phase": decision["phase"],
+        "class": decision["class"],
+        "subject": decision["subject"],
+        "rejected": len(decision["tried"]),
+        "chosen": decision["chosen"],
+        "us": decision.get("us"),
+    }
+
+
+def first_divergence(recorded: List[dict], replayed: List[dict]) -> Optional[Dict]:
+    """Return the first decision that differs between two traces, or None if they match"""
+    recorded = [r for r in recorded if r["t"] == "place"]
+    replayed = [r for r in replayed if r["t"] == "place"]
+    for index, (old, new) in enumerate(zip(recorded, replayed)):
+        if (old["phase"], old["class"], old["subject"], old["tried"], old["chosen"]) != \
+                (new["phase"], new["class"], new["subject"], new["tried"], new["chosen"]):
+            return {"index": index, "recorded": _describe(old), "replayed": _describe(new)}
+    if len(recorded) != len(replayed):
+        return {"index": min(len(recorded), len(replayed)), "recorded_decisions": len(recorded),
+                "replayed_decisions": len(replayed)}
+    return None
+
+
+def rerun(records: List[dict]) -> List[dict]:
+    """Solve the recorded problem again with the recorded seed and return the new trace.
+    Runs offline: the problem is the snapshot embedded in the run header (traces written by
+    the service) or the snapshot file it names (traces written by python -m app.solver)."""
+    run = next((r for r in records if r["t"] == "run"), None)
+    if not run:
+        raise ValueError("Trace has no run header")
+    if run.get("problem"):
+        snapshot = ProblemSnapshot.from_dict(run["problem"])
+    elif isinstance(run.get("snapshot"), str):
+        snapshot = ProblemSnapshot.from_dict(load(run["snapshot"]))
+    else:
+        raise ValueError("Trace does not record its problem snapshot and cannot be replayed")
+
+    buffer = io.StringIO()
+    solve(snapshot, engine="greedy", seed=run["seed"], trace=TraceRecorder(buffer))
+    return [json.loads(line) for line in buffer.getvalue().splitlines() if line]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Profile or replay a placement decision trace")
+    parser.add_argument("trace", help="Trace file (.ndjson or .ndjson.gz)")
+    parser.add_argument("--top", type=int, default=10, help="Number of hot decisions to list")
+    parser.add_argument("--rerun", action="store_true", help="Re-run the generation with the recorded seed and compare")
+    args = parser.parse_args(argv)
+
+    records = list(read_trace(args.trace))
+    report = summarize(records, args.top)
+    if args.rerun:
+        replayed = rerun(records)
+        report["divergence"] = first_divergence(records, replayed)
+    print(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""Run a placement engine on a problem snapshot.
+
+Engines:
+
+- ``greedy``: a single pass of GreedyEngine (what the API uses)
+- ``restarts``: the greedy pass followed by re-runs with shuffled class order and
+  shuffled ties between equally difficult lessons; the run with the fewest
+  missing or surplus lessons and then the lowest soft-constraint score wins.
+  ``budget`` is the number of runs, ``time_limit`` optionally stops earlier.
+
+The result depends only on the snapshot, the engine, the seed and the budget
+(unless a time limit cuts the restarts short).
+"""
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from app.solver.engine import GreedyEngine, Placement
+from app.solver.scoring import TimetableScorer
+from app.solver.snapshot import ProblemSnapshot
+from app.solver.trace import NullTraceRecorder, NULL_TRACE
+
+ENGINES = ("greedy", "restarts")
+DEFAULT_RESTARTS = 20
+
+# Seeds are stored in a 32-bit INTEGER column
+MAX_SEED = 2 ** 31
+
+
+def subject_difficulty(subject) -> int:
+    """Calculate difficulty score for placing a subject (higher = harder)"""
+    score = 0
+    if subject.requires_specialized_classroom:
+        score += 10
+    if subject.is_laboratory:
+        score += 5
+    if subject.required_block_length:
+        score += subject.required_block_length * 3
+    if not subject.allow_multiple_in_one_day:
+        score += 5
+    if not subject.allow_consecutive_hours:
+        score += 2
+    return score
+
+
+@dataclass
+class Solution:
+    engine: str
+    seed: int
+    placements: List[Placement]
+    lessons: int
+    runs: int = 1
+    elapsed: float = 0.0
+    metrics: Dict[str, float] = field(default_factory=dict)
+    # Lessons missing from / placed beyond the weekly hours of their allocation
+    unplaced: int = 0
+    overplaced: int = 0
+
+    @property
+    def hard_cost(self) -> int:
+        return self.unplaced + self.overplaced
+
+    def summary(self) -> Dict:
+        return {
+            "engine": self.engine,
+            "seed": self.seed,
+            "runs": self.runs,
+            "elapsed": round(self.elapsed, 3),
+            "lessons": self.lessons,
+            "placed": len(self.placements),
+            "unplaced": self.unplaced,
+            "overplaced": self.overplaced,
+            "metrics": self.metrics,
+        }
+
+    def to_dict(self) -> Dict:
+        return {**self.summary(), "placements": [list(p) for p in self.placements]}
+
+
+def allocation_deviation(snapshot: ProblemSnapshot, placements: List[Placement]) -> Tuple[int, int]:
+    """(unplaced, overplaced) lessons compared with the weekly hours of every class-subject"""
+    required: Dict[Tuple[int, int], int] = {}
+    for class_group_id, class_lessons in snapshot.lessons_by_class().items():
+        for subject, _ in class_lessons:
+            required[(class_group_id, subject.id)] = required.get((class_group_id, subject.id), 0) + 1
+    placed: Dict[Tuple[int, int], int] = {}
+    for placement in placements:
+        key = (placement.class_group_id, placement.subject_id)
+        placed[key] = placed.get(key, 0) + 1
+    unplaced = sum(max(hours - placed.get(key, 0), 0) for key, hours in required.items())
+    overplaced = sum(max(count - required.get(key, 0), 0) for key, count in placed.items())
+    return unplaced, overplaced
+
+
+def run_greedy(
+    snapshot: ProblemSnapshot,
+    rng: random.Random,
+    trace: NullTraceRecorder = NULL_TRACE,
+    shuffle: bool = False
+) -> List[Placement]:
+    """One greedy pass over all classes. With shuffle, the class order and the order of
+    equally difficult lessons are randomized (the hardest lessons still go first)."""
+    lessons = snapshot.lessons_by_class()
+    classes = list(snapshot.classes)
+    if shuffle:
+        rng.shuffle(classes)
+
+    engine = GreedyEngine(
+        snapshot.classes, snapshot.teachers, snapshot.classrooms,
+        days_per_week=snapshot.days_per_week,
+        lessons_per_day=snapshot.lessons_per_day,
+        rng=rng,
+        trace=trace
+    )
+    placements: List[Placement] = []
+    for class_group in classes:
+        class_lessons = lessons[class_group.id]
+        if shuffle:
+            rng.shuffle(class_lessons)
+        # Harder constraints first
+        class_lessons.sort(key=lambda x: subject_difficulty(x[0]), reverse=True)
+        placements.extend(engine.place_class(class_group, class_lessons, snapshot.lunch_hours.get(class_group.id, {})))
+    return placements
+
+
+def solve(
+    snapshot: ProblemSnapshot,
+    engine: str = "greedy",
+    seed: Optional[int] = None,
+    budget: Optional[int] = None,
+    time_limit: Optional[float] = None,
+    trace: NullTraceRecorder = NULL_TRACE
+) -> Solution:
+    """Solve a snapshot with the chosen engine. The trace is only recorded by the greedy engine."""
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine '{engine}', expected one of {', '.join(ENGINES)}")
+    if seed is None:
+        seed = random.SystemRandom().randrange(MAX_SEED)
+
+    started = time.perf_counter()
+    lessons = sum(len(class_lessons) for class_lessons in snapshot.lessons_by_class().values())
+    scorer = TimetableScorer(
+        [c.id for c in snapshot.classes],
+        [t.id for t in snapshot.teachers],
+        [s.id for s in snapshot.subjects],
+        [r.id for r in snapshot.classrooms],
+        snapshot.days_per_week,
+        snapshot.lessons_per_day,
+        snapshot.lunch_hours
+    )
+
+    placements = run_greedy(snapshot, random.Random(seed), trace)
+    metrics = scorer.score(placements)
+    deviation = allocation_deviation(snapshot, placements)
+    runs = 1
+
+    if engine == "restarts":
+        seeds = random.Random(seed)
+        for _ in range(max((budget or DEFAULT_RESTARTS) - 1, 0)):
+            if time_limit is not None and time.perf_counter() - started >= time_limit:
+                break
+            candidate = run_greedy(snapshot, random.Random(seeds.randrange(MAX_SEED)), shuffle=True)
+            candidate_metrics = scorer.score(candidate)
+            candidate_deviation = allocation_deviation(snapshot, candidate)
+            runs += 1
+            if (sum(candidate_deviation), candidate_metrics["total"]) < (sum(deviation), metrics["total"]):
+                placements, metrics, deviation = candidate, candidate_metrics, candidate_deviation
+
+    return Solution(
+        engine=engine,
+        seed=seed,
+        placements=placements,
+        lessons=lessons,
+        runs=runs,
+        elapsed=time.perf_counter() - started,
+        metrics=metrics,
+        unplaced=deviation[0],
+        overplaced=deviation[1]
+    )
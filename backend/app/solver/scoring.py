@@ -0,0 +1,285 @@
+"""Soft-constraint scoring of timetables.
+
+A timetable is represented as dense NumPy arrays over (class, day, lesson) and
+(teacher, day, lesson) and every metric is computed with array operations:
+
+- class_gaps: free lessons between the first and last lesson of a class day (lunch excluded)
+- teacher_gaps: free lessons between the first and last lesson of a teacher day
+- day_balance: variance of the number of lessons per day, summed over classes
+- subject_spread: lessons of a subject above the even share (ceil(hours / days)) on a day
+- room_changes: adjacent lessons of a class taught in different classrooms
+
+Lower is better. ``TimetableScorer.evaluate`` scores a whole timetable,
+``ScoreSession`` keeps the per-row components so that moving a few lessons is
+re-scored by recomputing only the touched rows.
+"""
+from dataclasses import dataclass, asdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+EMPTY = -1
+
+METRICS = ("class_gaps", "teacher_gaps", "day_balance", "subject_spread", "room_changes")
+
+
+@dataclass
+class ScoreWeights:
+    class_gaps: float = 3.0
+    teacher_gaps: float = 1.0
+    day_balance: float = 1.0
+    subject_spread: float = 2.0
+    room_changes: float = 0.5
+
+    def total(self, metrics: Dict[str, float]) -> float:
+        weights = asdict(self)
+        return float(sum(weights[name] * metrics[name] for name in METRICS))
+
+
+@dataclass
+class TimetableArrays:
+    """Dense array view of a timetable"""
+    class_subject: np.ndarray  # [classes, days, lessons] subject index or EMPTY
+    class_room: np.ndarray  # [classes, days, lessons] classroom index or EMPTY
+    teacher_load: np.ndarray  # [teachers, days, lessons] number of lessons (> 1 means a clash)
+    lunch: np.ndarray  # [classes, days, lessons] True for the lunch break of the class
+
+    def copy(self) -> "TimetableArrays":
+        return TimetableArrays(self.class_subject.copy(), self.class_room.copy(),
+                               self.teacher_load.copy(), self.lunch)
+
+
+def row_gaps(occupied: np.ndarray, blocked: Optional[np.ndarray] = None) -> np.ndarray:
+    """Free slots between the first and the last occupied slot of every row (last axis)"""
+    started = np.cumsum(occupied, axis=-1) > 0
+    not_finished = np.cumsum(occupied[..., ::-1], axis=-1)[..., ::-1] > 0
+    free = ~occupied if blocked is None else ~(occupied | blocked)
+    return (started & not_finished & free).sum(axis=-1)
+
+
+def row_room_changes(rooms: np.ndarray) -> np.ndarray:
+    """Adjacent lessons with different classrooms in every row (last axis)"""
+    before, after = rooms[..., :-1], rooms[..., 1:]
+    return ((before != EMPTY) & (after != EMPTY) & (before != after)).sum(axis=-1)
+
+
+def day_variance(loads: np.ndarray) -> np.ndarray:
+    """Variance of lessons per day for every row of a [rows, days] load matrix"""
+    return loads.var(axis=-1)
+
+
+def subject_excess(counts: np.ndarray) -> np.ndarray:
+    """Lessons above the even share per day for every row of a [rows, days] count matrix"""
+    days = counts.shape[-1]
+    share = -(-counts.sum(axis=-1, keepdims=True) // days)  # ceil(hours / days)
+    return np.maximum(counts - share, 0).sum(axis=-1)
+
+
+class TimetableScorer:
+    """Maps timetable entries onto arrays and evaluates the soft-constraint metrics"""
+
+    def __init__(
+        self,
+        class_ids: Sequence[int],
+        teacher_ids: Sequence[int],
+        subject_ids: Sequence[int],
+        classroom_ids: Sequence[int],
+        days_per_week: int,
+        lessons_per_day: int,
+        lunch_hours: Optional[Dict[int, Dict[int, List[int]]]] = None,
+        weights: Optional[ScoreWeights] = None
+    ):
+        self.class_index = {class_id: i for i, class_id in enumerate(class_ids)}
+        self.teacher_index = {teacher_id: i for i, teacher_id in enumerate(teacher_ids)}
+        self.subject_index = {subject_id: i for i, subject_id in enumerate(subject_ids)}
+        self.classroom_index = {classroom_id: i for i, classroom_id in enumerate(classroom_ids)}
+        self.days = days_per_week
+        self.lessons_per_day = lessons_per_day
+        self.weights = weights or ScoreWeights()
+
+        self.lunch = np.zeros((len(self.class_index), days_per_week, lessons_per_day), dtype=bool)
+        for class_id, days in (lunch_hours or {}).items():
+            if class_id not in self.class_index:
+                continue
+            for day, lesson_indices in days.items():
+                day = int(day)
+                for lesson_index in lesson_indices:
+                    if 0 <= day < days_per_week and 1 <= lesson_index <= lessons_per_day:
+                        self.lunch[self.class_index[class_id], day, lesson_index - 1] = True
+
+    @classmethod
+    def for_entries(
+        cls,
+        entries: Sequence,
+        days_per_week: int,
+        lessons_per_day: Optional[int] = None,
+        lunch_hours: Optional[Dict[int, Dict[int, List[int]]]] = None,
+        class_ids: Iterable[int] = (),
+        weights: Optional[ScoreWeights] = None
+    ) -> "TimetableScorer":
+        """Build a scorer covering all classes, teachers, subjects and classrooms used by the entries.
+        The grid is widened to the entries' days and lessons (days_per_week may have been lowered
+        after the timetable was generated)."""
+        days_per_week = max(days_per_week, max((e.day_of_week + 1 for e in entries), default=0))
+        lessons_per_day = max(lessons_per_day or 1, max((e.lesson_index for e in entries), default=1))
+        return cls(
+            sorted(set(class_ids) | {e.class_group_id for e in entries}),
+            sorted({e.teacher_id for e in entries}),
+            sorted({e.subject_id for e in entries}),
+            sorted({e.classroom_id for e in entries if e.classroom_id is not None}),
+            days_per_week,
+            lessons_per_day,
+            lunch_hours,
+            weights
+        )
+
+    def _cell(self, entry) -> Tuple[int, int, int, int, int, int]:
+        """Array coordinates of an entry: (class, day, lesson, teacher, subject, classroom)"""
+        return (
+            self.class_index[entry.class_group_id],
+            entry.day_of_week,
+            entry.lesson_index - 1,
+            self.teacher_index[entry.teacher_id],
+            self.subject_index[entry.subject_id],
+            self.classroom_index[entry.classroom_id] if entry.classroom_id is not None else EMPTY,
+        )
+
+    def build(self, entries: Iterable) -> TimetableArrays:
+        """Build the array view of a set of entries (anything with the TimetableEntry attributes)"""
+        shape = (len(self.class_index), self.days, self.lessons_per_day)
+        class_subject = np.full(shape, EMPTY, dtype=np.int32)
+        class_room = np.full(shape, EMPTY, dtype=np.int32)
+        teacher_load = np.zeros((len(self.teacher_index), self.days, self.lessons_per_day), dtype=np.int16)
+
+        cells = np.array([self._cell(e) for e in entries], dtype=np.int64).reshape(-1, 6)
+        c, d, l, t, s, r = cells.T
+        class_subject[c, d, l] = s
+        class_room[c, d, l] = r
+        np.add.at(teacher_load, (t, d, l), 1)
+        return TimetableArrays(class_subject, class_room, teacher_load, self.lunch)
+
+    def subject_day_counts(self, arrays: TimetableArrays) -> np.ndarray:
+        """Lessons per [class, subject, day]"""
+        n_classes, days, _ = arrays.class_subject.shape
+        n_subjects = len(self.subject_index)
+        c, d, l = np.nonzero(arrays.class_subject != EMPTY)
+        flat = (c * n_subjects + arrays.class_subject[c, d, l]) * days + d
+        counts = np.bincount(flat, minlength=n_classes * n_subjects * days)
+        return counts.reshape(n_classes, n_subjects, days)
+
+    def evaluate(self, arrays: TimetableArrays) -> Dict[str, float]:
+        """Full evaluation: every metric plus the weighted total"""
+        occupied = arrays.class_subject != EMPTY
+        metrics = {
+            "class_gaps": int(row_gaps(occupied, arrays.lunch).sum()),
+            "teacher_gaps": int(row_gaps(arrays.teacher_load > 0).sum()),
+            "day_balance": float(day_variance(occupied.sum(axis=-1)).sum()),
+            "subject_spread": int(subject_excess(self.subject_day_counts(arrays)).sum()),
+            "room_changes": int(row_room_changes(arrays.class_room).sum()),
+        }
+        metrics["total"] = self.weights.total(metrics)
+        return metrics
+
+    def score(self, entries: Iterable) -> Dict[str, float]:
+        return self.evaluate(self.build(entries))
+
+    def session(self, entries: Iterable) -> "ScoreSession":
+        return ScoreSession(self, self.build(entries))
+
+
+class ScoreSession:
+    """Timetable arrays with cached per-row metric components for incremental re-scoring"""
+
+    def __init__(self, scorer: TimetableScorer, arrays: TimetableArrays):
+        self.scorer = scorer
+        self.arrays = arrays
+        occupied = arrays.class_subject != EMPTY
+        self.class_gaps = row_gaps(occupied, arrays.lunch)  # [classes, days]
+        self.teacher_gaps = row_gaps(arrays.teacher_load > 0)  # [teachers, days]
+        self.room_changes = row_room_changes(arrays.class_room)  # [classes, days]
+        self.day_balance = day_variance(occupied.sum(axis=-1))  # [classes]
+        self.subject_counts = scorer.subject_day_counts(arrays)  # [classes, subjects, days]
+        self.subject_spread = subject_excess(self.subject_counts)  # [classes, subjects]
+
+    def metrics(self) -> Dict[str, float]:
+        metrics = {
+            "class_gaps": int(self.class_gaps.sum()),
+            "teacher_gaps": int(self.teacher_gaps.sum()),
+            "day_balance": float(self.day_balance.sum()),
+            "subject_spread": int(self.subject_spread.sum()),
+            "room_changes": int(self.room_changes.sum()),
+        }
+        metrics["total"] = self.scorer.weights.total(metrics)
+        return metrics
+
+    @property
+    def total(self) -> float:
+        return self.metrics()["total"]
+
+    def apply(self, removed: Iterable = (), added: Iterable = ()) -> float:
+        """Remove and add entries, update the touched rows and return the change of the total.
+        A class slot holds a single lesson: moving a lesson onto an occupied slot should be
+        expressed as a swap (both lessons removed and re-added)."""
+        arrays = self.arrays
+        class_rows, teacher_rows, subject_rows = set(), set(), set()
+        for sign, entries in ((-1, removed), (1, added)):
+            for entry in entries:
+                c, d, l, t, s, r = self.scorer._cell(entry)
+                if sign > 0:
+                    arrays.class_subject[c, d, l] = s
+                    arrays.class_room[c, d, l] = r
+                else:
+                    arrays.class_subject[c, d, l] = EMPTY
+                    arrays.class_room[c, d, l] = EMPTY
+                arrays.teacher_load[t, d, l] += sign
+                self.subject_counts[c, s, d] += sign
+                class_rows.add((c, d))
+                teacher_rows.add((t, d))
+                subject_rows.add((c, s))
+
+        weights = self.scorer.weights
+        delta = 0.0
+        if class_rows:
+            c, d = (np.array(axis) for axis in zip(*sorted(class_rows)))
+            occupied = arrays.class_subject[c, d] != EMPTY
+            gaps = row_gaps(occupied, arrays.lunch[c, d])
+            rooms = row_room_changes(arrays.class_room[c, d])
+            delta += weights.class_gaps * float((gaps - self.class_gaps[c, d]).sum())
+            delta += weights.room_changes * float((rooms - self.room_changes[c, d]).sum())
+            self.class_gaps[c, d] = gaps
+            self.room_changes[c, d] = rooms
+
+            classes = np.unique(c)
+            balance = day_variance((arrays.class_subject[classes] != EMPTY).sum(axis=-1))
+            delta += weights.day_balance * float((balance - self.day_balance[classes]).sum())
+            self.day_balance[classes] = balance
+        if teacher_rows:
+            t, d = (np.array(axis) for axis in zip(*sorted(teacher_rows)))
+            gaps = row_gaps(arrays.teacher_load[t, d] > 0)
+            delta += weights.teacher_gaps * float((gaps - self.teacher_gaps[t, d]).sum())
+            self.teacher_gaps[t, d] = gaps
+        if subject_rows:
+            c, s = (np.array(axis) for axis in zip(*sorted(subject_rows)))
+            spread = subject_excess(self.subject_counts[c, s])
+            delta += weights.subject_spread * float((spread - self.subject_spread[c, s]).sum())
+            self.subject_spread[c, s] = spread
+        return delta
+
+    def delta(self, removed: Sequence = (), added: Sequence = ()) -> float:
+        """Change of the total if the entries were moved, leaving the session unchanged"""
+        cells = np.array([self.scorer._cell(e) for e in (*removed, *added)], dtype=np.int64).reshape(-1, 6)
+        c, d, l = cells[:, 0], cells[:, 1], cells[:, 2]
+        # Class slots hold a single lesson, so the touched class rows are restored explicitly;
+        # teacher loads and subject counts are counters and revert by applying the inverse move
+        saved = (
+            self.arrays.class_subject[c, d, l].copy(),
+            self.arrays.class_room[c, d, l].copy(),
+            self.class_gaps[c, d].copy(),
+            self.room_changes[c, d].copy(),
+            self.day_balance[c].copy(),
+        )
+        change = self.apply(removed, added)
+        self.apply(added, removed)
+        (self.arrays.class_subject[c, d, l], self.arrays.class_room[c, d, l],
+         self.class_gaps[c, d], self.room_changes[c, d], self.day_balance[c]) = saved
+        return change
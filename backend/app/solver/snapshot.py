@@ -0,0 +1,189 @@
+"""Problem snapshot: everything the solver needs to generate a timetable for a school.
+
+A snapshot is plain data (dataclasses with the same attribute names as the ORM
+models), so engines run on it without a database. The API builds a snapshot from
+the school before solving and ``python -m app.solver export`` writes the same
+snapshot to a file, so a run with the same seed gives the same timetable offline
+and online.
+
+Files are JSON (``.json``, ``.json.gz``) or msgpack (``.msgpack``).
+"""
+import gzip
+import json
+import msgpack
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+@dataclass
+class CapabilitySpec:
+    subject_id: int
+    class_group_id: Optional[int] = None
+    grade_level_id: Optional[int] = None
+    is_primary: int = 0
+
+
+@dataclass
+class TeacherSpec:
+    id: int
+    max_weekly_hours: int
+    availability: Optional[Dict[str, List[int]]] = None
+    capabilities: List[CapabilitySpec] = field(default_factory=list)
+    full_name: str = ""
+
+
+@dataclass
+class ClassSpec:
+    id: int
+    grade_level_id: Optional[int] = None
+    number_of_students: Optional[int] = None
+    name: str = ""
+
+
+@dataclass
+class ClassroomSpec:
+    id: int
+    capacity: Optional[int] = None
+    specializations: Optional[List[Any]] = None
+    name: str = ""
+
+
+@dataclass
+class SubjectSpec:
+    id: int
+    allow_consecutive_hours: Optional[bool] = True
+    max_consecutive_hours: Optional[int] = None
+    allow_multiple_in_one_day: Optional[bool] = True
+    required_block_length: Optional[int] = None
+    is_laboratory: Optional[bool] = False
+    requires_specialized_classroom: Optional[bool] = False
+    name: str = ""
+
+
+@dataclass
+class AllocationSpec:
+    class_group_id: int
+    subject_id: int
+    weekly_hours: int
+    primary_teacher_id: Optional[int] = None
+    allow_multiple_in_one_day: Optional[bool] = False
+    required_consecutive_hours: Optional[int] = None
+
+
+@dataclass
+class ProblemSnapshot:
+    school_id: int
+    days_per_week: int
+    lessons_per_day: int
+    classes: List[ClassSpec]
+    teachers: List[TeacherSpec]
+    classrooms: List[ClassroomSpec]
+    subjects: List[SubjectSpec]
+    allocations: List[AllocationSpec]
+    # class_id -> {day: lunch lesson indices} assigned before placement
+    lunch_hours: Dict[int, Dict[int, List[int]]] = field(default_factory=dict)
+    version: int = SNAPSHOT_FORMAT_VERSION
+
+    @classmethod
+    def from_models(
+        cls,
+        school_id: int,
+        days_per_week: int,
+        lessons_per_day: int,
+        classes: List,
+        teachers: List,
+        classrooms: List,
+        subjects: List,
+        allocations: List,
+        lunch_hours: Optional[Dict[int, Dict[int, List[int]]]] = None
+    ) -> "ProblemSnapshot":
+        """Copy the solver-relevant attributes of loaded ORM objects"""
+        return cls(
+            school_id=school_id,
+            days_per_week=days_per_week,
+            lessons_per_day=lessons_per_day,
+            classes=[ClassSpec(c.id, c.grade_level_id, c.number_of_students, c.name) for c in classes],
+            teachers=[
+                TeacherSpec(
+                    t.id, t.max_weekly_hours, t.availability,
+                    [CapabilitySpec(cap.subject_id, cap.class_group_id, cap.grade_level_id, cap.is_primary)
+                     for cap in t.capabilities],
+                    t.full_name
+                )
+                for t in teachers
+            ],
+            classrooms=[ClassroomSpec(r.id, r.capacity, r.specializations, r.name) for r in classrooms],
+            subjects=[
+                SubjectSpec(
+                    s.id, s.allow_consecutive_hours, s.max_consecutive_hours, s.allow_multiple_in_one_day,
+                    s.required_block_length, s.is_laboratory, s.requires_specialized_classroom, s.name
+                )
+                for s in subjects
+            ],
+            allocations=[
+                AllocationSpec(a.class_group_id, a.subject_id, a.weekly_hours, a.primary_teacher_id,
+                               a.allow_multiple_in_one_day, a.required_consecutive_hours)
+                for a in allocations
+            ],
+            lunch_hours=lunch_hours or {},
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ProblemSnapshot":
+        if data.get("version", SNAPSHOT_FORMAT_VERSION) != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {data.get('version')}")
+        return cls(
+            school_id=data["school_id"],
+            days_per_week=data["days_per_week"],
+            lessons_per_day=data["lessons_per_day"],
+            classes=[ClassSpec(**c) for c in data["classes"]],
+            teachers=[
+                TeacherSpec(**{**t, "capabilities": [CapabilitySpec(**cap) for cap in t.get("capabilities", [])]})
+                for t in data["teachers"]
+            ],
+            classrooms=[ClassroomSpec(**r) for r in data["classrooms"]],
+            subjects=[SubjectSpec(**s) for s in data["subjects"]],
+            allocations=[AllocationSpec(**a) for a in data["allocations"]],
+            # JSON object keys are strings
+            lunch_hours={
+                int(class_id): {int(day): list(hours) for day, hours in days.items()}
+                for class_id, days in data.get("lunch_hours", {}).items()
+            },
+        )
+
+    def lessons_by_class(self) -> Dict[int, List[tuple]]:
+        """Expand allocations into one (subject, allocation) pair per weekly lesson, per class"""
+        subjects = {s.id: s for s in self.subjects}
+        lessons: Dict[int, List[tuple]] = {c.id: [] for c in self.classes}
+        for allocation in self.allocations:
+            subject = subjects.get(allocation.subject_id)
+            if subject is None or allocation.class_group_id not in lessons:
+                continue
+            lessons[allocation.class_group_id].extend([(subject, allocation)] * allocation.weekly_hours)
+        return lessons
+
+
+def dump(data: Dict[str, Any], path: str) -> None:
+    """Write a dict as JSON or msgpack, chosen by the file extension"""
+    if path.endswith(".msgpack"):
+        with open(path, "wb") as stream:
+            stream.write(msgpack.packb(data, use_bin_type=True))
+        return
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "wt", encoding="utf-8") as stream:
+        json.dump(data, stream, default=str)
+
+
+def load(path: str) -> Dict[str, Any]:
+    """Read a dict written by dump()"""
+    if path.endswith(".msgpack"):
+        with open(path, "rb") as stream:
+            return msgpack.unpackb(stream.read(), raw=False, strict_map_key=False)
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as stream:
+        return json.load(stream)
@@ -0,0 +1,137 @@
+"""Compact in-memory state of the placement engine.
+
+Time slots are packed into a single integer (``day * lessons_per_day + lesson_index - 1``)
+and every resource (teacher, class, classroom) is addressed by a dense index, so the
+occupancy of the whole week lives in flat byte/int arrays whose size is linear in
+``resources x slots``. Teacher capabilities are stored CSR-style: one row range per
+subject listing the qualified teachers, instead of nested lists of ORM objects.
+"""
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence
+
+FREE = -1
+
+
+class SlotGrid:
+    """Maps (day_of_week, lesson_index) pairs to packed integer slots and back"""
+
+    def __init__(self, days_per_week: int, lessons_per_day: int):
+        self.days = days_per_week
+        self.lessons_per_day = lessons_per_day
+        self.size = days_per_week * lessons_per_day
+
+    def slot(self, day: int, lesson_index: int) -> int:
+        return day * self.lessons_per_day + lesson_index - 1
+
+    def day_of(self, slot: int) -> int:
+        return slot // self.lessons_per_day
+
+    def lesson_of(self, slot: int) -> int:
+        return slot % self.lessons_per_day + 1
+
+    def contains(self, day: int, lesson_index: int) -> bool:
+        return 0 <= day < self.days and 1 <= lesson_index <= self.lessons_per_day
+
+
+class CapabilityTable:
+    """CSR table of teacher capabilities: for every subject a contiguous row range
+    with the teacher index, class/grade restriction and primary flag of each capability"""
+
+    def __init__(self, teachers: Sequence, teacher_index: Dict[int, int]):
+        rows_by_subject: Dict[int, List[tuple]] = {}
+        for teacher in teachers:
+            for capability in teacher.capabilities:
+                rows_by_subject.setdefault(capability.subject_id, []).append((
+                    teacher_index[teacher.id],
+                    capability.class_group_id if capability.class_group_id is not None else FREE,
+                    capability.grade_level_id if capability.grade_level_id is not None else FREE,
+                    1 if capability.is_primary == 1 else 0,
+                ))
+
+        self.subject_row: Dict[int, int] = {}
+        self.offsets = array("i", [0])
+        self.teacher = array("i")
+        self.class_group = array("i")
+        self.grade_level = array("i")
+        self.primary = bytearray()
+        for row, subject_id in enumerate(sorted(rows_by_subject)):
+            self.subject_row[subject_id] = row
+            for teacher_idx, class_group_id, grade_level_id, is_primary in rows_by_subject[subject_id]:
+                self.teacher.append(teacher_idx)
+                self.class_group.append(class_group_id)
+                self.grade_level.append(grade_level_id)
+                self.primary.append(is_primary)
+            self.offsets.append(len(self.teacher))
+
+    def rows(self, subject_id: int) -> range:
+        """Capability rows of a subject, in teacher order"""
+        row = self.subject_row.get(subject_id)
+        if row is None:
+            return range(0)
+        return range(self.offsets[row], self.offsets[row + 1])
+
+    def matches_class(self, position: int, class_group_id: int, grade_level_id: Optional[int]) -> bool:
+        """Whether a capability applies to a class (class-specific, grade-wide or general)"""
+        cap_class = self.class_group[position]
+        cap_grade = self.grade_level[position]
+        return (
+            cap_class == class_group_id or
+            (cap_class == FREE and cap_grade == grade_level_id) or
+            (cap_class == FREE and cap_grade == FREE)
+        )
+
+
+class SolverState:
+    """Occupancy of teachers, classes and classrooms over the packed slot grid"""
+
+    def __init__(self, grid: SlotGrid, teacher_ids: Iterable[int], class_ids: Iterable[int],
+                 classroom_ids: Iterable[int]):
+        self.grid = grid
+        self.teacher_index = {teacher_id: i for i, teacher_id in enumerate(teacher_ids)}
+        self.class_index = {class_id: i for i, class_id in enumerate(class_ids)}
+        self.classroom_index = {classroom_id: i for i, classroom_id in enumerate(classroom_ids)}
+
+        n = grid.size
+        self.teacher_busy = bytearray(len(self.teacher_index) * n)
+        self.classroom_busy = bytearray(len(self.classroom_index) * n)
+        # Subject taught to a class in each slot (FREE if the class has no lesson)
+        self.class_subject = array("i", [FREE]) * (len(self.class_index) * n)
+        self.teacher_hours = array("i", [0]) * len(self.teacher_index)
+        self.class_day_hours = array("i", [0]) * (len(self.class_index) * grid.days)
+        self.placed = 0
+
+    def is_teacher_busy(self, teacher_id: int, day: int, lesson_index: int) -> bool:
+        return self.teacher_busy[self.teacher_index[teacher_id] * self.grid.size + self.grid.slot(day, lesson_index)] == 1
+
+    def is_classroom_busy(self, classroom_id: int, day: int, lesson_index: int) -> bool:
+        return self.classroom_busy[self.classroom_index[classroom_id] * self.grid.size + self.grid.slot(day, lesson_index)] == 1
+
+    def is_class_busy(self, class_group_id: int, day: int, lesson_index: int) -> bool:
+        return self.class_subject[self.class_index[class_group_id] * self.grid.size + self.grid.slot(day, lesson_index)] != FREE
+
+    def class_day(self, class_group_id: int, day: int) -> Dict[int, int]:
+        """Lessons of a class on a day as {lesson_index: subject_id}"""
+        lessons_per_day = self.grid.lessons_per_day
+        base = self.class_index[class_group_id] * self.grid.size + day * lessons_per_day
+        row = self.class_subject[base:base + lessons_per_day]
+        return {i + 1: subject_id for i, subject_id in enumerate(row) if subject_id != FREE}
+
+    def hours_of(self, teacher_id: int) -> int:
+        return self.teacher_hours[self.teacher_index[teacher_id]]
+
+    def day_hours(self, class_group_id: int, day: int) -> int:
+        return self.class_day_hours[self.class_index[class_group_id] * self.grid.days + day]
+
+    def place(self, class_group_id: int, subject_id: int, teacher_id: int, classroom_id: Optional[int],
+              day: int, lesson_index: int) -> None:
+        slot = self.grid.slot(day, lesson_index)
+        n = self.grid.size
+        class_idx = self.class_index[class_group_id]
+        teacher_idx = self.teacher_index[teacher_id]
+        self.class_subject[class_idx * n + slot] = subject_id
+        self.teacher_busy[teacher_idx * n + slot] = 1
+        if classroom_id is not None:
+            self.classroom_busy[self.classroom_index[classroom_id] * n + slot] = 1
+        self.teacher_hours[teacher_idx] += 1
+        self.class_day_hours[class_idx * self.grid.days + day] += 1
+        self.placed += 1
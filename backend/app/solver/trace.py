@@ -0,0 +1,119 @@
+"""Decision trace of the placement engine.
+
+A trace is an NDJSON stream (optionally gzip-compressed when the file name ends
+with ``.gz``). The first record describes the run, every following record one
+placement decision:
+
+    {"t": "run", "seed": 42, "school_id": 1, "problem": {...}, ...}
+    {"t": "place", "phase": "fill", "class": 3, "subject": 7,
+     "tried": [[0, 4, "teacher_busy"], ...], "chosen": [1, 2, 12, 5], "us": 81}
+    {"t": "end", "placed": 214, "unplaced": 12}
+
+``problem`` is the solved ProblemSnapshot (``to_dict``), so a run can be replayed
+offline (see app.solver.replay). ``tried`` lists the rejected candidate slots as ``[day, lesson_index, reason]``,
+``chosen`` is ``[day, lesson_index, teacher_id, classroom_id]`` or null when the
+lesson could not be placed in that phase.
+"""
+import gzip
+import json
+import time
+from typing import IO, Iterator, List, Optional
+
+TRACE_FORMAT_VERSION = 1
+
+# Rejection reasons
+REASON_LUNCH = "lunch"
+REASON_CLASS_BUSY = "class_busy"
+REASON_NO_TEACHER = "no_teacher"
+REASON_TEACHER_UNAVAILABLE = "teacher_unavailable"
+REASON_TEACHER_BUSY = "teacher_busy"
+REASON_TEACHER_MAX_HOURS = "teacher_max_hours"
+REASON_TEACHER_MISMATCH = "teacher_mismatch"
+REASON_SUBJECT_CONSTRAINT = "subject_constraint"
+
+
+class NullTraceRecorder:
+    """Recorder used when tracing is disabled. Callers check ``enabled`` before
+    building any record, so a disabled trace costs one attribute lookup per decision."""
+    enabled = False
+
+    def run(self, **meta) -> None:
+        pass
+
+    def start(self) -> float:
+        return 0.0
+
+    def decision(self, phase: str, class_group_id: int, subject_id: int,
+                 tried: List[list], chosen: Optional[list], started: float = 0.0) -> None:
+        pass
+
+    def end(self, **summary) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+NULL_TRACE = NullTraceRecorder()
+
+
+class TraceRecorder(NullTraceRecorder):
+    """Writes placement decisions to a text stream as NDJSON"""
+    enabled = True
+
+    def __init__(self, stream: IO[str], close_stream: bool = False):
+        self.stream = stream
+        self.close_stream = close_stream
+        self.decisions = 0
+
+    def _write(self, record: dict) -> None:
+        self.stream.write(json.dumps(record, separators=(",", ":"), default=str))
+        self.stream.write("\n")
+
+    def run(self, **meta) -> None:
+        self._write({"t": "run", "v": TRACE_FORMAT_VERSION, **meta})
+
+    def start(self) -> float:
+        return time.perf_counter()
+
+    def decision(self, phase: str, class_group_id: int, subject_id: int,
+                 tried: List[list], chosen: Optional[list], started: float = 0.0) -> None:
+        self.decisions += 1
+        record = {
+            "t": "place",
+            "phase": phase,
+            "class": class_group_id,
+            "subject": subject_id,
+            "tried": tried,
+            "chosen": chosen,
+        }
+        if started:
+            record["us"] = int((time.perf_counter() - started) * 1_000_000)
+        self._write(record)
+
+    def end(self, **summary) -> None:
+        self._write({"t": "end", "decisions": self.decisions, **summary})
+        self.stream.flush()
+
+    def close(self) -> None:
+        if self.close_stream:
+            self.stream.close()
+
+
+def open_trace(path: str) -> TraceRecorder:
+    """Open a trace file for writing (gzip-compressed if the path ends with .gz)"""
+    if path.endswith(".gz"):
+        stream = gzip.open(path, "wt", encoding="utf-8")
+    else:
+        stream = open(path, "w", encoding="utf-8")
+    return TraceRecorder(stream, close_stream=True)
+
+
+def read_trace(path: str) -> Iterator[dict]:
+    """Iterate over the records of a trace file"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as stream:
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
@@ -0,0 +1,248 @@
+"""Import XHSTT (XML high-school timetabling) benchmark instances as problem snapshots.
+
+Mapping onto the snapshot (and thus the school models):
+
+- Times: days come from the ``Day`` of each time (or a Day time group it belongs to);
+  the order of the times within a day gives ``lesson_index`` (1-based), the order of
+  the days gives ``day_of_week``.
+- Resources: resource types are classified by id/name into teachers, classes
+  (class/student/group) and rooms; other resource types are ignored.
+- Events: every event becomes weekly lessons of a class (its first preassigned class
+  resource); events with the same course (or name) and teacher form one subject and
+  one allocation with ``weekly_hours`` = the sum of their durations. The preassigned
+  teacher is the allocation's primary teacher, a preassigned room makes the subject
+  require that (specialized) room.
+- Constraints: required AvoidUnavailableTimes constraints of teachers become teacher
+  availability, SplitEvents minimum durations become required consecutive hours.
+  Other constraints are not modelled; the soft cost reported by the benchmark is our
+  own soft-constraint score, not the XHSTT soft cost.
+
+Things the models cannot express are counted in ``XhsttInstance.stats`` (events
+without a class, joint events of several classes, unassigned teachers, preassigned
+times) so benchmark results can be read with that in mind.
+"""
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from app.solver.engine import DAY_NAMES
+from app.solver.snapshot import (
+    AllocationSpec, CapabilitySpec, ClassroomSpec, ClassSpec, ProblemSnapshot, SubjectSpec, TeacherSpec
+)
+
+# Availability lists are "available lesson indices"; an empty list means "no restriction",
+# so a day without any available lesson is written as [0] (lesson index 0 never exists)
+NO_LESSON_AVAILABLE = [0]
+
+
+@dataclass
+class XhsttInstance:
+    id: str
+    name: str
+    snapshot: ProblemSnapshot
+    stats: Dict[str, int] = field(default_factory=dict)
+
+
+def _text(element: Optional[ET.Element], tag: str, default: str = "") -> str:
+    child = element.find(tag) if element is not None else None
+    return child.text.strip() if child is not None and child.text else default
+
+
+def _refs(element: Optional[ET.Element], path: str) -> List[str]:
+    if element is None:
+        return []
+    return [child.get("Reference") for child in element.findall(path) if child.get("Reference")]
+
+
+def _resource_kind(type_id: str, type_name: str) -> Optional[str]:
+    key = f"{type_id} {type_name}".lower()
+    if "teacher" in key:
+        return "teacher"
+    if "room" in key:
+        return "room"
+    if "class" in key or "student" in key or "group" in key:
+        return "class"
+    return None
+
+
+def _map_times(times_element: ET.Element) -> Tuple[Dict[str, Tuple[int, int]], int, int]:
+    """Map time ids to (day_of_week, lesson_index); returns the map, days and lessons per day"""
+    day_ids = [day.get("Id") for day in times_element.findall("TimeGroups/Day")]
+    day_set = set(day_ids)
+    times_by_day: Dict[str, List[str]] = {}
+    for time in times_element.findall("Time"):
+        day_ref = next(iter(_refs(time, "Day")), None)
+        if day_ref is None:
+            day_ref = next((ref for ref in _refs(time, "TimeGroups/TimeGroup") if ref in day_set), None)
+        if day_ref is None:
+            day_ref = ""  # Instance without days: a single long day
+        if day_ref not in day_set and day_ref not in times_by_day:
+            day_ids.append(day_ref)
+            day_set.add(day_ref)
+        times_by_day.setdefault(day_ref, []).append(time.get("Id"))
+
+    ordered_days = [day_id for day_id in day_ids if day_id in times_by_day]
+    time_slots: Dict[str, Tuple[int, int]] = {}
+    for day, day_id in enumerate(ordered_days):
+        for position, time_id in enumerate(times_by_day[day_id]):
+            time_slots[time_id] = (day, position + 1)
+    lessons_per_day = max((len(times) for times in times_by_day.values()), default=0)
+    return time_slots, len(ordered_days), lessons_per_day
+
+
+def _constraint_events(constraint: ET.Element, event_groups: Dict[str, List[str]]) -> List[str]:
+    applies_to = constraint.find("AppliesTo")
+    events = _refs(applies_to, "Events/Event")
+    for group in _refs(applies_to, "EventGroups/EventGroup"):
+        events.extend(event_groups.get(group, []))
+    return events
+
+
+def _constraint_resources(constraint: ET.Element, resource_groups: Dict[str, List[str]]) -> List[str]:
+    applies_to = constraint.find("AppliesTo")
+    resources = _refs(applies_to, "Resources/Resource")
+    for group in _refs(applies_to, "ResourceGroups/ResourceGroup"):
+        resources.extend(resource_groups.get(group, []))
+    return resources
+
+
+def parse_instance(instance: ET.Element) -> XhsttInstance:
+    """Convert one <Instance> element into a problem snapshot"""
+    instance_id = instance.get("Id", "")
+    name = _text(instance.find("MetaData"), "Name", instance_id)
+    stats = {"events": 0, "lessons": 0, "events_without_class": 0, "joint_events": 0,
+             "unassigned_teacher_events": 0, "preassigned_times_ignored": 0}
+
+    times_element = instance.find("Times")
+    time_slots, days_per_week, lessons_per_day = _map_times(times_element) if times_element is not None else ({}, 0, 0)
+    time_groups: Dict[str, List[str]] = {}
+    for time in times_element.findall("Time") if times_element is not None else []:
+        for group in _refs(time, "TimeGroups/TimeGroup") + _refs(time, "Day") + _refs(time, "Week"):
+            time_groups.setdefault(group, []).append(time.get("Id"))
+
+    # Resources
+    resources_element = instance.find("Resources")
+    type_kinds = {
+        rt.get("Id"): _resource_kind(rt.get("Id", ""), _text(rt, "Name"))
+        for rt in resources_element.findall("ResourceTypes/ResourceType")
+    } if resources_element is not None else {}
+    teachers: Dict[str, TeacherSpec] = {}
+    classes: Dict[str, ClassSpec] = {}
+    classrooms: Dict[str, ClassroomSpec] = {}
+    resource_groups: Dict[str, List[str]] = {}
+    for resource in resources_element.findall("Resource") if resources_element is not None else []:
+        resource_id = resource.get("Id")
+        resource_name = _text(resource, "Name", resource_id)
+        for group in _refs(resource, "ResourceGroups/ResourceGroup"):
+            resource_groups.setdefault(group, []).append(resource_id)
+        kind = type_kinds.get(next(iter(_refs(resource, "ResourceType")), None))
+        if kind == "teacher":
+            teachers[resource_id] = TeacherSpec(len(teachers) + 1, days_per_week * lessons_per_day,
+                                                full_name=resource_name)
+        elif kind == "class":
+            classes[resource_id] = ClassSpec(len(classes) + 1, name=resource_name)
+        elif kind == "room":
+            classrooms[resource_id] = ClassroomSpec(len(classrooms) + 1, specializations=[], name=resource_name)
+
+    # Events (courses are event groups too)
+    events_element = instance.find("Events")
+    event_groups: Dict[str, List[str]] = {}
+    events = events_element.findall("Event") if events_element is not None else []
+    for event in events:
+        for group in _refs(event, "EventGroups/EventGroup") + _refs(event, "Course"):
+            event_groups.setdefault(group, []).append(event.get("Id"))
+
+    # Constraints we can express
+    constraints = instance.find("Constraints")
+    min_duration: Dict[str, int] = {}
+    unavailable: Dict[str, set] = {}
+    for constraint in list(constraints) if constraints is not None else []:
+        if constraint.tag == "SplitEventsConstraint":
+            minimum = int(_text(constraint, "MinimumDuration", "1") or 1)
+            for event_id in _constraint_events(constraint, event_groups):
+                min_duration[event_id] = max(min_duration.get(event_id, 1), minimum)
+        elif constraint.tag == "AvoidUnavailableTimesConstraint" and _text(constraint, "Required") == "true":
+            times = _refs(constraint, "Times/Time")
+            for group in _refs(constraint, "TimeGroups/TimeGroup"):
+                times.extend(time_groups.get(group, []))
+            for resource_id in _constraint_resources(constraint, resource_groups):
+                unavailable.setdefault(resource_id, set()).update(times)
+
+    subjects: Dict[Tuple[str, Optional[str]], SubjectSpec] = {}
+    allocations: Dict[Tuple[int, int], AllocationSpec] = {}
+    for event in events:
+        stats["events"] += 1
+        duration = int(_text(event, "Duration", "1") or 1)
+        if event.find("Time") is not None:
+            stats["preassigned_times_ignored"] += 1
+
+        assigned = _refs(event, "Resources/Resource")
+        event_classes = [classes[r] for r in assigned if r in classes]
+        event_teachers = [teachers[r] for r in assigned if r in teachers]
+        event_rooms = [classrooms[r] for r in assigned if r in classrooms]
+        if not event_classes:
+            stats["events_without_class"] += 1
+            continue
+        if len(event_classes) > 1:
+            stats["joint_events"] += 1
+        if not event_teachers:
+            stats["unassigned_teacher_events"] += 1
+
+        class_spec = event_classes[0]
+        teacher = event_teachers[0] if event_teachers else None
+        label = next(iter(_refs(event, "Course")), None) or _text(event, "Name", event.get("Id"))
+        subject_key = (label, teacher.full_name if teacher else None)
+        subject = subjects.get(subject_key)
+        if subject is None:
+            subject = subjects[subject_key] = SubjectSpec(len(subjects) + 1, name=label)
+        for room in event_rooms[:1]:
+            subject.requires_specialized_classroom = True
+            if subject.id not in room.specializations:
+                room.specializations.append(subject.id)
+
+        allocation = allocations.get((class_spec.id, subject.id))
+        if allocation is None:
+            allocation = allocations[(class_spec.id, subject.id)] = AllocationSpec(
+                class_spec.id, subject.id, 0, primary_teacher_id=teacher.id if teacher else None
+            )
+            if teacher:
+                teacher.capabilities.append(CapabilitySpec(subject.id, class_group_id=class_spec.id, is_primary=1))
+        allocation.weekly_hours += duration
+        stats["lessons"] += duration
+        block = min(min_duration.get(event.get("Id"), 1), duration)
+        if block > 1:
+            allocation.required_consecutive_hours = min(allocation.required_consecutive_hours or block, block)
+
+    for allocation in allocations.values():
+        # Spread lessons over the week unless there are more lessons than days
+        allocation.allow_multiple_in_one_day = allocation.weekly_hours > days_per_week
+
+    for resource_id, times in unavailable.items():
+        teacher = teachers.get(resource_id)
+        if teacher is None or days_per_week > len(DAY_NAMES):
+            continue
+        availability = {}
+        for day in range(days_per_week):
+            blocked = {time_slots[t][1] for t in times if t in time_slots and time_slots[t][0] == day}
+            if blocked:
+                available = [i for i in range(1, lessons_per_day + 1) if i not in blocked]
+                availability[DAY_NAMES[day]] = available or NO_LESSON_AVAILABLE
+        teacher.availability = availability or None
+
+    snapshot = ProblemSnapshot(
+        school_id=0,
+        days_per_week=days_per_week,
+        lessons_per_day=lessons_per_day,
+        classes=list(classes.values()),
+        teachers=list(teachers.values()),
+        classrooms=list(classrooms.values()),
+        subjects=list(subjects.values()),
+        allocations=list(allocations.values()),
+    )
+    return XhsttInstance(instance_id, name, snapshot, stats)
+
+
+def load_archive(path: str) -> List[XhsttInstance]:
+    """Parse every instance of an XHSTT archive file"""
+    root = ET.parse(path).getroot()
+    return [parse_instance(instance) for instance in root.iter("Instance")]
@@ -0,0 +1,41 @@
+import api from '@/services/api'
+
+// A timetable without its entries, as returned by the timetable listing
+export interface TimetableSummary {
+  id: number
+  school_id: number
+  name: string
+  valid_from: string | null
+  valid_to: string | null
+  is_primary: number
+  substitute_for_date: string | null
+  base_timetable_id: number | null
+  seed: number | null
+  entry_count: number
+}
+
+export interface TimetableFilters {
+  is_primary?: number
+  date_from?: string
+  date_to?: string
+}
+
+interface TimetablePage {
+  items: TimetableSummary[]
+  next_cursor: number | null
+}
+
+// Summaries of all timetables of a school matching the filters, following the listing's pages.
+// Entries are only returned by the single-timetable endpoint.
+export async function fetchTimetableSummaries(schoolId: number, filters: TimetableFilters = {}): Promise<TimetableSummary[]> {
+  const summaries: TimetableSummary[] = []
+  let after: number | null = null
+  do {
+    const params: Record<string, any> = { ...filters, limit: 200 }
+    if (after !== null) params.after = after
+    const response = await api.get<TimetablePage>(`/timetables/schools/${schoolId}/timetables`, { params })
+    summaries.push(...response.data.items)
+    after = response.data.next_cursor
+  } while (after !== null)
+  return summaries
+}
@@ -64,6 +64,8 @@ const translations: Record<Language, Translations> = {
       startTime: 'Start Time',
       endTime: 'End Time',
       classHourLength: 'Class Hour Length (minutes)',
+      daysPerWeek: 'School Days per Week',
+      daysPerWeekHint: 'Days starting on Monday (5 = Monday-Friday)',
       breakDuration: 'Break Duration (minutes)',
       breakDurations: 'Break Durations (minutes)',
       defaultBreakDuration: 'Default Break Duration (minutes)',
@@ -487,6 +489,8 @@ const translations: Record<Language, Translations> = {
       startTime: 'Začátek',
       endTime: 'Konec',
       classHourLength: 'Délka vyučovací hodiny (minuty)',
+      daysPerWeek: 'Počet školních dnů v týdnu',
+      daysPerWeekHint: 'Dny od pondělí (5 = pondělí až pátek)',
       breakDuration: 'Délka přestávky (minuty)',
       breakDurations: 'Délky přestávek (minuty)',
       defaultBreakDuration: 'Výchozí délka přestávky (minuty)',